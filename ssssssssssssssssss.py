@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import date, datetime, timedelta
 import time
 from fpdf import FPDF
 from io import BytesIO
@@ -8,116 +9,348 @@ import zipfile
 import json
 import re
 import os
+import html
+import string
+import textwrap
 import pickle
 import calendar
 import hashlib
+import zlib
+import hmac
+import secrets
+import copy
 import base64
+import struct
+import bisect
+import threading
+import queue
+import socket
+import sqlite3
+import sys
+from contextlib import closing, contextmanager
+from functools import partial, wraps
+from collections import Counter
+import tempfile
+import gzip
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow-backed strings and Parquet snapshots are optional
+    pyarrow = None
+    pq = None
+
+try:
+    import zstandard
+except ImportError:  # Backups are gzip-compressed without it
+    zstandard = None
 
 # ==============================
 # SECURE AUTHENTICATION SYSTEM
 # ==============================
-def hash_password(password):
-    """Hash a password using SHA-256 with a fixed salt"""
-    salt = b"mobile_shop_salt_2024"
-    hashed = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
+AUTH_FILE = 'auth_config.pkl'
+DEFAULT_USERNAME = "bond007"
+DEFAULT_PASSWORD = "bond007"
+DEFAULT_RESET_CODE = "bond#"
+# Salt and cost of the original single-user file; hashes in it are still accepted
+LEGACY_SALT = b"mobile_shop_salt_2024"
+LEGACY_ITERATIONS = 100000
+# PBKDF2 cost of newly set passwords; existing hashes keep the cost they were made with
+KDF_ITERATIONS = int(os.environ.get('MOBILE_SHOP_KDF_ITERATIONS', LEGACY_ITERATIONS))
+ROLES = ['cashier', 'owner']
+OWNER_PAGES = ["Bulk Import", "Manage Users", "Backups"]
+SALE_PAGES = ["Mobile Sale", "Accessories Sale", "Repair Service"]
+SESSION_TOKEN_TTL = 2 * 3600  # seconds a login survives browser reconnects
+
+def hash_password(password, salt=LEGACY_SALT, iterations=LEGACY_ITERATIONS):
+    """Hash a password with PBKDF2-SHA256"""
+    hashed = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
     return base64.b64encode(hashed).decode('utf-8')
 
-def load_credentials():
-    """Load credentials from secure storage"""
+def new_secret(password):
+    """Salted hash record for a password or reset code, with a fresh random salt"""
+    salt = secrets.token_bytes(16)
+    return {
+        'salt': base64.b64encode(salt).decode('utf-8'),
+        'iterations': KDF_ITERATIONS,
+        'password_hash': hash_password(password, salt, KDF_ITERATIONS)
+    }
+
+def legacy_secret(password_hash):
+    """Hash record for a hash made with the original fixed salt"""
+    return {
+        'salt': base64.b64encode(LEGACY_SALT).decode('utf-8'),
+        'iterations': LEGACY_ITERATIONS,
+        'password_hash': password_hash
+    }
+
+def verify_secret(record, password):
+    """Check a password against a hash record (one PBKDF2 run)"""
+    hashed = hash_password(password, base64.b64decode(record['salt']), record['iterations'])
+    return hmac.compare_digest(hashed, record['password_hash'])
+
+@st.cache_resource
+def auth_state():
+    """Process-wide copy of the credentials, re-read only when the file changes"""
+    return {
+        'lock': threading.Lock(),
+        'write_lock': threading.Lock(),  # serializes read-modify-write of the file
+        'config': None,
+        'signature': None,   # file signature the cached credentials were read from
+        'dummy': None        # hash record checked for unknown usernames
+    }
+
+def print_credentials(title):
+    """Display the fixed credentials in the console"""
+    print("=" * 50)
+    print(title)
+    print("=" * 50)
+    print(f"USERNAME: {DEFAULT_USERNAME}")
+    print(f"PASSWORD: {DEFAULT_PASSWORD}")
+    print(f"RESET CODE: {DEFAULT_RESET_CODE}")
+    print("=" * 50)
+
+def default_credentials():
+    """Credentials with the fixed owner account and reset code"""
+    return {
+        'users': {DEFAULT_USERNAME: dict(new_secret(DEFAULT_PASSWORD), role='owner')},
+        'reset_code': new_secret(DEFAULT_RESET_CODE),
+        'token_secret': base64.b64encode(secrets.token_bytes(32)).decode('utf-8')
+    }
+
+def upgrade_credentials(auth_config):
+    """Bring a credentials file to the multi-user format; returns True if anything changed.
+    
+    The original file held one username with password and reset code hashes
+    made with the fixed salt. Those hashes are kept, so existing logins keep
+    working; they get a random salt the next time the password is changed.
+    """
+    changed = False
+    if 'users' not in auth_config:
+        username = auth_config.pop('username', DEFAULT_USERNAME)
+        password_hash = auth_config.pop('password_hash', None)
+        record = legacy_secret(password_hash) if password_hash else new_secret(DEFAULT_PASSWORD)
+        auth_config['users'] = {username: dict(record, role='owner')}
+        changed = True
+    if 'reset_code' not in auth_config:
+        reset_code_hash = auth_config.pop('reset_code_hash', None)
+        auth_config['reset_code'] = legacy_secret(reset_code_hash) if reset_code_hash else new_secret(DEFAULT_RESET_CODE)
+        changed = True
+    if 'token_secret' not in auth_config:
+        auth_config['token_secret'] = base64.b64encode(secrets.token_bytes(32)).decode('utf-8')
+        changed = True
+    return changed
+
+def read_credentials():
+    """Read credentials from secure storage, creating or upgrading the file if needed"""
     try:
-        if os.path.exists('auth_config.pkl'):
-            with open('auth_config.pkl', 'rb') as f:
-                auth_config = pickle.load(f)
-                # Ensure all required keys exist
-                if 'username' not in auth_config:
-                    auth_config['username'] = "bond007"
-                if 'password_hash' not in auth_config:
-                    auth_config['password_hash'] = hash_password("bond007")
-                if 'reset_code_hash' not in auth_config:
-                    auth_config['reset_code_hash'] = hash_password("bond#")
-                return auth_config
-        else:
+        if not os.path.exists(AUTH_FILE):
             # Create a new credentials file with fixed values
-            auth_config = {
-                'username': "bond007",
-                'password_hash': hash_password("bond007"),
-                'reset_code_hash': hash_password("bond#")
-            }
+            auth_config = default_credentials()
             save_credentials(auth_config)
-            
-            # Display generated credentials in console
-            print("=" * 50)
-            print("SETUP COMPLETE: FIXED CREDENTIALS")
-            print("=" * 50)
-            print(f"USERNAME: bond007")
-            print(f"PASSWORD: bond007") 
-            print(f"RESET CODE: bond#")
-            print("=" * 50)
-            
+            print_credentials("SETUP COMPLETE: FIXED CREDENTIALS")
             return auth_config
-    except Exception as e:
-        # If there's any error, create a new config with fixed values
-        auth_config = {
-            'username': "bond007",
-            'password_hash': hash_password("bond007"),
-            'reset_code_hash': hash_password("bond#")
-        }
-        save_credentials(auth_config)
-        
-        # Display generated credentials in console
-        print("=" * 50)
-        print("ERROR RECOVERY: USING FIXED CREDENTIALS")
-        print("=" * 50)
-        print(f"USERNAME: bond007")
-        print(f"PASSWORD: bond007") 
-        print(f"RESET CODE: bond#")
-        print("=" * 50)
         
+        with open(AUTH_FILE, 'rb') as f:
+            auth_config = pickle.load(f)
+        # Save the upgrade so defaults are only hashed once; the upgraded
+        # credentials work without it, so a failed save is only reported
+        if upgrade_credentials(auth_config):
+            try:
+                save_credentials(auth_config)
+            except OSError as e:
+                print(f"Could not save upgraded credentials: {e}")
         return auth_config
+    except Exception as e:
+        # Never replace the file with defaults: that would drop every account
+        # and bring back the well-known owner password
+        raise RuntimeError(
+            f"could not read {AUTH_FILE} ({e}). Restore it from a copy, or delete it "
+            "to start over with the default owner account."
+        ) from e
+
+def load_credentials():
+    """Load credentials, from the cache unless the file changed since it was read"""
+    state = auth_state()
+    with state['lock']:
+        if state['config'] is None or state['signature'] != file_signature(AUTH_FILE):
+            state['config'] = read_credentials()
+            state['signature'] = file_signature(AUTH_FILE)
+        return copy.deepcopy(state['config'])
 
 def save_credentials(auth_config):
-    """Save credentials to secure storage"""
+    """Save credentials to secure storage; raises OSError if they could not be written"""
+    tmp_file = temp_file_for(AUTH_FILE)
     try:
-        with open('auth_config.pkl', 'wb') as f:
+        with open(tmp_file, 'wb') as f:
             pickle.dump(auth_config, f)
-    except Exception as e:
-        st.error(f"Error saving credentials: {e}")
+        # Atomic, so load_credentials() never sees a half-written file
+        os.replace(tmp_file, AUTH_FILE)
+    except OSError:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
 
-def check_credentials(username, password):
-    """Check if username and password match stored credentials"""
-    try:
+@contextmanager
+def edit_credentials():
+    """Load the credentials for changing and save them afterwards, one writer at a time.
+    
+    A failed save raises OSError out of the with block.
+    """
+    with auth_state()['write_lock']:
         auth_config = load_credentials()
-        hashed_input = hash_password(password)
-        
-        return username == auth_config['username'] and hashed_input == auth_config['password_hash']
-    except KeyError:
-        # If there's a KeyError, the auth config is corrupted, recreate it
-        load_credentials()  # This will recreate the config
-        return False
+        yield auth_config
+        save_credentials(auth_config)
 
-def check_reset_code(reset_code):
-    """Check if reset code is correct"""
-    try:
-        auth_config = load_credentials()
-        hashed_input = hash_password(reset_code)
-        
-        return hashed_input == auth_config['reset_code_hash']
-    except KeyError:
-        # If there's a KeyError, the auth config is corrupted, recreate it
-        load_credentials()  # This will recreate the config
-        return False
+def check_credentials(username, password):
+    """Check a login; returns the user's role, or None if the login is invalid"""
+    state = auth_state()
+    auth_config = load_credentials()
+    user = auth_config['users'].get(username)
+    if user is None:
+        # Still run the hash once so an unknown username takes as long as a wrong password
+        if state['dummy'] is None:
+            state['dummy'] = new_secret(secrets.token_hex(16))
+        verify_secret(state['dummy'], password)
+        return None
+    return user['role'] if verify_secret(user, password) else None
+
+def reset_owner_password(username, reset_code, new_password):
+    """Set a password with the shared reset code.
+    
+    The code is only a recovery route for the shop's sole owner; every other
+    account is reset by an owner on the Manage Users page.
+    """
+    with edit_credentials() as auth_config:
+        if not verify_secret(auth_config['reset_code'], reset_code):
+            raise ValueError("Invalid reset code")
+        user = auth_config['users'].get(username)
+        if user is None or user['role'] != 'owner' or owner_count(auth_config) != 1:
+            raise ValueError("The reset code only recovers the owner account. "
+                             "Ask an owner to reset other passwords under Manage Users.")
+        user.update(new_secret(new_password))
+
+def update_password(username, new_password):
+    """Set a user's password with a fresh salt; returns False for an unknown user"""
+    with edit_credentials() as auth_config:
+        user = auth_config['users'].get(username)
+        if user is None:
+            return False
+        user.update(new_secret(new_password))
+    return True
+
+def add_user(username, password, role):
+    """Create an account; returns False if the username is taken"""
+    with edit_credentials() as auth_config:
+        if username in auth_config['users']:
+            return False
+        auth_config['users'][username] = dict(new_secret(password), role=role)
+    return True
+
+def owner_count(auth_config, except_user=None):
+    """Number of owner accounts, optionally not counting one user"""
+    return sum(1 for name, user in auth_config['users'].items() if user['role'] == 'owner' and name != except_user)
 
-def update_password(new_password):
-    """Update the password"""
+def set_user_role(username, role):
+    """Change a user's role; the last owner can't be demoted"""
+    with edit_credentials() as auth_config:
+        if username not in auth_config['users']:
+            raise ValueError(f"Unknown user {username}")
+        if role != 'owner' and owner_count(auth_config, except_user=username) == 0:
+            raise ValueError("At least one owner account is required")
+        auth_config['users'][username]['role'] = role
+
+def remove_user(username):
+    """Delete an account; the last owner can't be removed"""
+    with edit_credentials() as auth_config:
+        if username not in auth_config['users']:
+            raise ValueError(f"Unknown user {username}")
+        if owner_count(auth_config, except_user=username) == 0:
+            raise ValueError("At least one owner account is required")
+        del auth_config['users'][username]
+
+def token_signature(auth_config, payload):
+    """HMAC of a session token payload.
+    
+    The user's current password hash and session nonce are part of the signed
+    message, so changing a password, logging out (which draws a new nonce) or
+    deleting the account invalidates its outstanding tokens.
+    """
+    username = payload.rsplit('|', 1)[0]
+    user = auth_config['users'].get(username)
+    if user is None:
+        return None
+    message = (payload + '|' + user['password_hash'] + '|' + user.get('session_nonce', '')).encode()
+    return hmac.new(base64.b64decode(auth_config['token_secret']), message, hashlib.sha256).hexdigest()
+
+def issue_session_token(username):
+    """Signed token that lets a reconnecting browser skip the password check"""
+    payload = f"{username}|{int(time.time()) + SESSION_TOKEN_TTL}"
+    signature = token_signature(load_credentials(), payload)
+    return base64.urlsafe_b64encode(payload.encode()).decode('ascii') + '.' + signature
+
+def verify_session_token(token):
+    """Return (username, role) for a valid, unexpired session token, else None"""
     try:
-        auth_config = load_credentials()
-        auth_config['password_hash'] = hash_password(new_password)
-        save_credentials(auth_config)
-    except KeyError:
-        # If there's a KeyError, the auth config is corrupted, recreate it
-        auth_config = load_credentials()  # This will recreate the config
-        auth_config['password_hash'] = hash_password(new_password)
-        save_credentials(auth_config)
+        encoded, signature = token.rsplit('.', 1)
+        payload = base64.urlsafe_b64decode(encoded.encode('ascii')).decode()
+        username, expires = payload.rsplit('|', 1)
+        if int(expires) < time.time():
+            return None
+    except (ValueError, UnicodeDecodeError):
+        return None
+    auth_config = load_credentials()
+    expected = token_signature(auth_config, payload)
+    if expected is None or not hmac.compare_digest(expected, signature):
+        return None
+    return username, auth_config['users'][username]['role']
+
+def revoke_sessions(username):
+    """Invalidate every session token issued to a user"""
+    with edit_credentials() as auth_config:
+        user = auth_config['users'].get(username)
+        if user is not None:
+            user['session_nonce'] = secrets.token_hex(16)
+
+def user_role(username):
+    """Current role of an account, or None if it no longer exists"""
+    user = load_credentials()['users'].get(username)
+    return None if user is None else user['role']
+
+def end_session():
+    """Mark this browser session as logged out"""
+    st.session_state.authenticated = False
+    st.session_state.username = None
+    st.session_state.role = None
+    st.session_state.show_reset = False
+    st.query_params.pop('session', None)
+
+def start_session(username, role):
+    """Mark this browser session as logged in and remember it in the URL"""
+    st.session_state.authenticated = True
+    st.session_state.username = username
+    st.session_state.role = role
+    st.query_params['session'] = issue_session_token(username)
+
+def restore_session():
+    """Log a reconnecting browser back in from its session token"""
+    token = st.query_params.get('session')
+    if not token:
+        return False
+    session = verify_session_token(token)
+    if session is None:
+        del st.query_params['session']
+        return False
+    st.session_state.authenticated = True
+    st.session_state.username, st.session_state.role = session
+    return True
 
 def login_section():
     """Display login form and handle authentication"""
@@ -310,9 +543,9 @@ def login_section():
                     st.error("Please enter both username and password")
                     return False
                     
-                if check_credentials(username, password):
-                    st.session_state.authenticated = True
-                    st.session_state.username = username
+                role = check_credentials(username, password)
+                if role:
+                    start_session(username, role)
                     st.success("Login successful!")
                     time.sleep(1)
                     st.rerun()
@@ -325,18 +558,17 @@ def login_section():
 
 def reset_password_section():
     """Password reset functionality"""
-    auth_config = load_credentials()
-    
     st.markdown("""
     <div class="login-container">
         <div class="login-content">
             <div class="login-header">
                 <h2>Password Reset</h2>
-                <p>Enter your reset code and new password</p>
+                <p>Owner account recovery: enter the owner username, the reset code and a new password</p>
             </div>
     """, unsafe_allow_html=True)
     
     with st.form("reset_password_form"):
+        reset_username = st.text_input("", placeholder="Enter username", key="reset_username")
         reset_code = st.text_input("", type="password", placeholder="Enter reset code", key="reset_code")
         new_password = st.text_input("", type="password", placeholder="Enter new password", key="new_password")
         confirm_password = st.text_input("", type="password", placeholder="Confirm new password", key="confirm_password")
@@ -344,17 +576,20 @@ def reset_password_section():
         col1, col2 = st.columns(2)
         with col1:
             if st.form_submit_button("Reset Password", use_container_width=True):
-                if not all([reset_code, new_password, confirm_password]):
+                if not all([reset_username, reset_code, new_password, confirm_password]):
                     st.error("Please fill all fields")
                 elif new_password != confirm_password:
                     st.error("Passwords do not match")
-                elif not check_reset_code(reset_code):
-                    st.error("Invalid reset code")
                 else:
-                    update_password(new_password)
-                    st.success("Password reset successfully! You can now login with your new password.")
-                    st.session_state.show_reset = False
-                    st.rerun()
+                    try:
+                        reset_owner_password(reset_username, reset_code, new_password)
+                        st.success("Password reset successfully! You can now login with your new password.")
+                        st.session_state.show_reset = False
+                        st.rerun()
+                    except ValueError as e:
+                        st.error(str(e))
+                    except OSError as e:
+                        st.error(f"Error saving credentials: {e}")
         with col2:
             if st.form_submit_button("Back to Login", use_container_width=True):
                 st.session_state.show_reset = False
@@ -363,9 +598,14 @@ def reset_password_section():
 def logout_button():
     """Display logout button"""
     if st.sidebar.button("🚪 Logout", use_container_width=True):
-        st.session_state.authenticated = False
-        st.session_state.username = None
-        st.session_state.show_reset = False
+        # Copies of the URL must not stay logged in, so stay logged in here
+        # too if their tokens could not be revoked
+        try:
+            revoke_sessions(st.session_state.username)
+        except OSError as e:
+            st.sidebar.error(f"Could not log out: {e}")
+            return
+        end_session()
         st.rerun()
 
 # ==============================
@@ -619,663 +859,3109 @@ st.markdown("""
 # ==============================
 # DATA PERSISTENCE FUNCTIONS
 # ==============================
-def load_data():
-    """Load data from persistent storage or initialize if not exists"""
-    try:
-        # Try to load from file first
-        if os.path.exists('mobile_master_data.pkl'):
-            with open('mobile_master_data.pkl', 'rb') as f:
-                data = pickle.load(f)
-            st.session_state.transactions = data.get('transactions', pd.DataFrame(columns=[
-                'Date', 'Time', 'Type', 'Category', 'Model', 'Brand', 'Item', 
-                'Color', 'Storage', 'Quantity', 'Selling_Price', 'Cost_Price', 
-                'Profit', 'Paid_Amount', 'Left_Amount', 'Customer_Name',
-                'Phone', 'CNIC', 'Address', 'Warranty', 'Compatible_With',
-                'Transaction_ID', 'Status', 'Advance_Balance', 'IMEI'
-            ]))
-            st.session_state.expenditures = data.get('expenditures', pd.DataFrame(columns=[
-                'Date', 'Time', 'Category', 'Amount', 'Description'
-            ]))
-            st.session_state.payments = data.get('payments', pd.DataFrame(columns=[
-                'Date', 'Time', 'Customer_Name', 'Phone', 'CNIC', 
-                'Amount', 'Transaction_ID', 'Payment_Type', 'Notes', 'Is_Advance'
-            ]))
-            st.session_state.customer_advances = data.get('customer_advances', pd.DataFrame(columns=[
-                'Customer_Name', 'Phone', 'CNIC', 'Advance_Balance'
-            ]))
+DATA_FILE = 'mobile_master_data.pkl'
+JOURNAL_FILE = 'mobile_master_data.journal'
+SQLITE_FILE = 'mobile_master_data.db'
+SEQUENCE_FILE = 'mobile_master_data.seq'
+SNAPSHOT_DIR = 'mobile_master_data.parquet'
+SNAPSHOT_MANIFEST = os.path.join(SNAPSHOT_DIR, 'manifest.json')
+# The snapshot generation before the current one, kept as a fallback
+PREVIOUS_DATA_FILE = DATA_FILE + '.prev'
+PREVIOUS_MANIFEST = os.path.join(SNAPSHOT_DIR, 'manifest.prev.json')
+# Pickle snapshot header: magic, journal seq (>Q) and SHA-256 of the seq and payload
+SNAPSHOT_MAGIC = b'MSSNAP01'
+SNAPSHOT_HEADER_SIZE = len(SNAPSHOT_MAGIC) + 8 + 32
+# Journal entries with this bit set in their length are followed by a CRC32
+JOURNAL_CRC_FLAG = 0x80000000
+# Damaged journal records are moved here instead of being thrown away
+JOURNAL_DAMAGED_FILE = JOURNAL_FILE + '.damaged'
+# Lock files shared by every process serving the app (see journal_lock)
+JOURNAL_LOCK_FILE = JOURNAL_FILE + '.lock'
+COMPACT_LOCK_FILE = JOURNAL_FILE + '.compact.lock'
+
+# 'journal' (snapshot + append-only journal) or 'sqlite'
+STORAGE_BACKEND = os.environ.get('MOBILE_SHOP_STORAGE', 'journal')
+# Journal snapshot format: 'pickle' (one file) or 'parquet' (month partitions, needs pyarrow)
+SNAPSHOT_FORMAT = os.environ.get('MOBILE_SHOP_SNAPSHOT', 'pickle')
+if SNAPSHOT_FORMAT == 'parquet' and pq is None:
+    print("pyarrow is not installed; using pickle snapshots")
+    SNAPSHOT_FORMAT = 'pickle'
+JOURNAL_COMPACT_THRESHOLD = 200  # journal entries before a background compaction
+PARTITIONED_TABLES = ['transactions', 'expenditures', 'payments', 'stock']
+
+TABLE_COLUMNS = {
+    'transactions': [
+        'Date', 'Time', 'Type', 'Category', 'Model', 'Brand', 'Item', 
+        'Color', 'Storage', 'Quantity', 'Selling_Price', 'Cost_Price', 
+        'Profit', 'Paid_Amount', 'Left_Amount', 'Customer_Name',
+        'Phone', 'CNIC', 'Address', 'Warranty', 'Compatible_With',
+        'Transaction_ID', 'Status', 'Advance_Balance', 'IMEI'
+    ],
+    'expenditures': [
+        'Date', 'Time', 'Category', 'Amount', 'Description'
+    ],
+    'payments': [
+        'Date', 'Time', 'Customer_Name', 'Phone', 'CNIC', 
+        'Amount', 'Transaction_ID', 'Payment_Type', 'Notes', 'Is_Advance'
+    ],
+    'customer_advances': [
+        'Customer_Name', 'Phone', 'CNIC', 'Advance_Balance'
+    ],
+    'stock': [
+        'Date', 'Time', 'Category', 'Brand', 'Model', 'Item', 'Color',
+        'Storage', 'IMEI', 'Quantity', 'Cost_Price', 'Supplier', 'Notes'
+    ]
+}
+
+# Column types enforced whenever a table is loaded or extended. Money and
+# quantities are numeric so sums are vectorized, low-cardinality labels are
+# categoricals, and every other column except Date is a compact string column.
+FLOAT_COLUMNS = ['Selling_Price', 'Cost_Price', 'Profit', 'Paid_Amount', 'Left_Amount', 'Advance_Balance', 'Amount']
+INTEGER_COLUMNS = ['Quantity']
+BOOLEAN_COLUMNS = ['Is_Advance']
+CATEGORY_COLUMNS = ['Type', 'Category', 'Status', 'Brand', 'Payment_Type']
+STRING_DTYPE = 'string[pyarrow]' if pyarrow is not None else 'string'
+
+def column_dtype(column):
+    """Schema dtype of a column, or None for Date (see normalize_dates)"""
+    if column == 'Date':
+        return None
+    if column in FLOAT_COLUMNS:
+        return 'float64'
+    if column in INTEGER_COLUMNS:
+        return 'int64'
+    if column in BOOLEAN_COLUMNS:
+        return 'bool'
+    if column in CATEGORY_COLUMNS:
+        return 'category'
+    return STRING_DTYPE
+
+def convert_column(series, dtype):
+    """Convert a column to its schema dtype"""
+    if dtype == 'float64':
+        return pd.to_numeric(series, errors='coerce').astype('float64')
+    if dtype == 'int64':
+        return pd.to_numeric(series, errors='coerce').fillna(0).astype('int64')
+    if dtype == 'bool':
+        return series.where(series.notna(), False).astype(bool)
+    if dtype == 'category':
+        return series.astype('category')
+    # Missing text becomes '' so values stay safe to use in if-statements
+    return series.astype(STRING_DTYPE).fillna('')
+
+def enforce_schema(data):
+    """Give the columns of every table their schema dtypes.
+    
+    Frames are replaced rather than modified in place, like in normalize_dates().
+    """
+    for table, df in data.items():
+        if df is None:
+            continue
+        converted = {}
+        for column in df.columns:
+            dtype = column_dtype(column)
+            if dtype is not None and df[column].dtype != dtype:
+                converted[column] = convert_column(df[column], dtype)
+        if converted:
+            data[table] = df.assign(**converted)
+    return data
+
+def concat_table(df, new_df):
+    """Append rows to a table without losing its categorical columns.
+    
+    pd.concat falls back to object for categoricals with different categories,
+    so the new categories are added to the existing column first.
+    """
+    updates = {}
+    for column in CATEGORY_COLUMNS:
+        if column not in df.columns or column not in new_df.columns:
+            continue
+        if not (isinstance(df[column].dtype, pd.CategoricalDtype) and isinstance(new_df[column].dtype, pd.CategoricalDtype)):
+            continue
+        missing = new_df[column].cat.categories.difference(df[column].cat.categories)
+        if len(missing):
+            df = df.assign(**{column: df[column].cat.add_categories(missing)})
+        updates[column] = new_df[column].cat.set_categories(df[column].cat.categories)
+    if updates:
+        new_df = new_df.assign(**updates)
+    return pd.concat([df, new_df], ignore_index=True)
+
+def empty_table(table):
+    """Create an empty DataFrame with the columns of the given table"""
+    return enforce_schema({table: pd.DataFrame(columns=TABLE_COLUMNS[table])})[table]
+
+def empty_data():
+    """Create an empty dataset with all tables"""
+    return {table: empty_table(table) for table in TABLE_COLUMNS}
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive OS-level lock on a lock file, shared with other processes"""
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
         else:
-            # Initialize empty DataFrames
-            st.session_state.transactions = pd.DataFrame(columns=[
-                'Date', 'Time', 'Type', 'Category', 'Model', 'Brand', 'Item', 
-                'Color', 'Storage', 'Quantity', 'Selling_Price', 'Cost_Price', 
-                'Profit', 'Paid_Amount', 'Left_Amount', 'Customer_Name',
-                'Phone', 'CNIC', 'Address', 'Warranty', 'Compatible_With',
-                'Transaction_ID', 'Status', 'Advance_Balance', 'IMEI'
-            ])
-            st.session_state.expenditures = pd.DataFrame(columns=[
-                'Date', 'Time', 'Category', 'Amount', 'Description'
-            ])
-            st.session_state.payments = pd.DataFrame(columns=[
-                'Date', 'Time', 'Customer_Name', 'Phone', 'CNIC', 
-                'Amount', 'Transaction_ID', 'Payment_Type', 'Notes', 'Is_Advance'
-            ])
-            st.session_state.customer_advances = pd.DataFrame(columns=[
-                'Customer_Name', 'Phone', 'CNIC', 'Advance_Balance'
-            ])
-        
-        # Convert date columns to datetime for proper filtering - FIXED DATE HANDLING
-        if not st.session_state.transactions.empty and 'Date' in st.session_state.transactions.columns:
-            # Ensure dates are in proper format
-            st.session_state.transactions['Date'] = pd.to_datetime(st.session_state.transactions['Date'], errors='coerce')
-            # Remove any invalid dates
-            st.session_state.transactions = st.session_state.transactions[st.session_state.transactions['Date'].notna()]
-            
-        if not st.session_state.expenditures.empty and 'Date' in st.session_state.expenditures.columns:
-            st.session_state.expenditures['Date'] = pd.to_datetime(st.session_state.expenditures['Date'], errors='coerce')
-            st.session_state.expenditures = st.session_state.expenditures[st.session_state.expenditures['Date'].notna()]
-            
-        if not st.session_state.payments.empty and 'Date' in st.session_state.payments.columns:
-            st.session_state.payments['Date'] = pd.to_datetime(st.session_state.payments['Date'], errors='coerce')
-            st.session_state.payments = st.session_state.payments[st.session_state.payments['Date'].notna()]
-            
-    except Exception as e:
-        st.error(f"Error loading data: {e}")
-        # Reset to empty DataFrames if there's an error
-        st.session_state.transactions = pd.DataFrame(columns=[
-            'Date', 'Time', 'Type', 'Category', 'Model', 'Brand', 'Item', 
-            'Color', 'Storage', 'Quantity', 'Selling_Price', 'Cost_Price', 
-            'Profit', 'Paid_Amount', 'Left_Amount', 'Customer_Name',
-            'Phone', 'CNIC', 'Address', 'Warranty', 'Compatible_With',
-            'Transaction_ID', 'Status', 'Advance_Balance', 'IMEI'
-        ])
-        st.session_state.expenditures = pd.DataFrame(columns=[
-            'Date', 'Time', 'Category', 'Amount', 'Description'
-        ])
-        st.session_state.payments = pd.DataFrame(columns=[
-            'Date', 'Time', 'Customer_Name', 'Phone', 'CNIC', 
-            'Amount', 'Transaction_ID', 'Payment_Type', 'Notes', 'Is_Advance'
-        ])
-        st.session_state.customer_advances = pd.DataFrame(columns=[
-            'Customer_Name', 'Phone', 'CNIC', 'Advance_Balance'
-        ])
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
 
-def save_data():
-    """Save data to persistent storage"""
+def temp_file_for(path):
+    """Temporary file to write before os.replace()-ing it over path, unique per writer"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+@st.cache_resource
+def journal_state():
+    """Process-wide journal bookkeeping shared by every browser session"""
+    return {
+        'lock': threading.Lock(),
+        'seq': None,         # last sequence number written to the journal
+        'signature': None,   # journal file signature after our last write
+        'pending': 0,        # journal entries not yet folded into the snapshot
+        'compacting': False,
+        'damaged': False     # a read skipped damaged records not yet set aside
+    }
+
+@contextmanager
+def journal_lock():
+    """Hold the journal lock of this process and of every other process.
+    
+    Several app servers (or a restarted one next to an old one) may share the
+    data files, so the in-process lock alone is not enough. The counters in
+    journal_state() are re-read from disk whenever another process wrote since
+    our last write.
+    """
+    state = journal_state()
+    with state['lock'], file_lock(JOURNAL_LOCK_FILE):
+        if state['seq'] is None or state['signature'] != file_signature(JOURNAL_FILE):
+            init_journal(state)
+        yield state
+
+def snapshot_file():
+    """File whose replacement commits a new snapshot"""
+    return SNAPSHOT_MANIFEST if SNAPSHOT_FORMAT == 'parquet' else DATA_FILE
+
+def fsync_directory(path):
+    """Make renames in a directory durable (not possible, nor needed, on Windows)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(path or '.', os.O_RDONLY)
     try:
-        # Ensure date columns are in proper format before saving
-        if not st.session_state.transactions.empty and 'Date' in st.session_state.transactions.columns:
-            st.session_state.transactions['Date'] = pd.to_datetime(st.session_state.transactions['Date'], errors='coerce')
-            
-        if not st.session_state.expenditures.empty and 'Date' in st.session_state.expenditures.columns:
-            st.session_state.expenditures['Date'] = pd.to_datetime(st.session_state.expenditures['Date'], errors='coerce')
-            
-        if not st.session_state.payments.empty and 'Date' in st.session_state.payments.columns:
-            st.session_state.payments['Date'] = pd.to_datetime(st.session_state.payments['Date'], errors='coerce')
-            
-        # Save all data to file
-        data = {
-            'transactions': st.session_state.transactions,
-            'expenditures': st.session_state.expenditures,
-            'payments': st.session_state.payments,
-            'customer_advances': st.session_state.customer_advances
-        }
-        
-        with open('mobile_master_data.pkl', 'wb') as f:
-            pickle.dump(data, f)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def read_with_fallback(read, path, previous_path):
+    """Read the current generation of a snapshot file, or the previous one if it is missing or damaged.
+    
+    The journal keeps every entry after the previous generation (see
+    compact_data), so falling back loses nothing.
+    """
+    try:
+        result = read(path)
+        if result is not None:
+            return result
     except Exception as e:
-        st.error(f"Error saving data: {e}")
+        print(f"Snapshot {path} is damaged ({e}); using the previous generation")
+    return read(previous_path)
 
-# ==============================
-# SHOP INFORMATION
-# ==============================
-def shop_info_container():
-    st.markdown("""
-    <div class="shop-info">
-        <h2 style="color: #a442f5; margin-bottom: 0.5rem;">AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI</h2>
-        <p style="margin-bottom: 0.2rem; color: #8c8c8c;">Premium Mobile & Accessories Shop</p>
-        <p style="margin-bottom: 0.2rem;"><strong>Proprietor:</strong> Ahsan khan </p>
-        <p style="margin-bottom: 0.2rem;"><strong>Contact>:</strong> 03363617334</p>
-        <p style="margin-bottom: 0.2rem;"><strong>Contact>:</strong> 03708635099</p>
-        <p style="margin-bottom: 0;"><strong>Address:</strong> Jama Market, Loralai, Balochitan </p>
-    </div>
-    """, unsafe_allow_html=True)
+def snapshot_digest(seq, payload):
+    """SHA-256 over a pickle snapshot's packed journal seq and payload"""
+    digest = hashlib.sha256(seq)
+    digest.update(payload)
+    return digest.digest()
 
-# ==============================
-# HELPER FUNCTIONS
-# ==============================
-def generate_transaction_id():
-    """Generate a unique transaction ID"""
-    if 'transactions' not in st.session_state or st.session_state.transactions.empty:
-        return "TXN-00001"
-    
-    # Check if Transaction_ID column exists
-    if 'Transaction_ID' not in st.session_state.transactions.columns:
-        return "TXN-00001"
+def write_pickle_snapshot_file(f, snapshot):
+    """Write a snapshot to an open file as a pickle behind a checksummed header"""
+    payload = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+    seq = struct.pack('>Q', snapshot['journal_seq'])
+    f.write(SNAPSHOT_MAGIC + seq + snapshot_digest(seq, payload))
+    f.write(payload)
+
+def read_pickle_snapshot(path):
+    """Read and verify a pickle snapshot, or None if the file does not exist"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        content = f.read()
+    if not content.startswith(SNAPSHOT_MAGIC):
+        # Written before snapshots had a header
+        return pickle.loads(content)
+    seq = content[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 8]
+    digest = content[len(SNAPSHOT_MAGIC) + 8:SNAPSHOT_HEADER_SIZE]
+    payload = memoryview(content)[SNAPSHOT_HEADER_SIZE:]
+    if snapshot_digest(seq, payload) != digest:
+        raise ValueError("checksum mismatch")
+    return pickle.loads(payload)
+
+def pickle_snapshot_seq(path):
+    """Journal seq of a pickle snapshot from its header, or None if the file does not exist"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        header = f.read(SNAPSHOT_HEADER_SIZE)
+    if not header.startswith(SNAPSHOT_MAGIC):
+        return read_pickle_snapshot(path).get('journal_seq', 0)
+    return struct.unpack('>Q', header[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 8])[0]
+
+def read_snapshot():
+    """Read the last compacted snapshot, or None if there is none yet"""
+    if SNAPSHOT_FORMAT == 'parquet':
+        manifest = read_manifest()
+        if manifest is not None:
+            return read_partitioned_snapshot(manifest)
+        # Not compacted into partitions yet: start from the pickle snapshot
+    return read_with_fallback(read_pickle_snapshot, DATA_FILE, PREVIOUS_DATA_FILE)
+
+def snapshot_journal_seq():
+    """Last journal sequence number folded into the snapshot"""
+    if SNAPSHOT_FORMAT == 'parquet':
+        manifest = read_manifest()
+        if manifest is not None:
+            return manifest['journal_seq']
+    return read_with_fallback(pickle_snapshot_seq, DATA_FILE, PREVIOUS_DATA_FILE) or 0
+
+# Partitioned snapshots keep one directory per table and month. Each compaction
+# adds a part file holding only the rows journaled since the previous one, so
+# existing parts are never rewritten; manifest.json lists the live files and
+# replacing it commits the snapshot.
+def manifest_checksum(manifest):
+    """SHA-256 of a manifest's contents, excluding the checksum itself"""
+    body = {key: value for key, value in manifest.items() if key != 'checksum'}
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+def read_manifest_file(path):
+    """Read and verify one manifest file, or None if it does not exist"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if 'checksum' in manifest and manifest['checksum'] != manifest_checksum(manifest):
+        raise ValueError("checksum mismatch")
+    return manifest
+
+def read_manifest():
+    """Read the partitioned snapshot manifest, or None if there is none yet"""
+    return read_with_fallback(read_manifest_file, SNAPSHOT_MANIFEST, PREVIOUS_MANIFEST)
+
+def read_parquet_files(paths, columns=None):
+    """Concatenate snapshot files into one DataFrame, memory-mapping each file"""
+    frames = [
+        pq.read_table(
+            os.path.join(SNAPSHOT_DIR, path), columns=columns, memory_map=True, page_checksum_verification=True
+        ).to_pandas()
+        for path in paths
+    ]
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+def write_parquet_file(df, path):
+    """Durably write a DataFrame to a snapshot file"""
+    full_path = os.path.join(SNAPSHOT_DIR, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    table = pyarrow.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    with open(full_path, 'wb') as f:
+        pq.write_table(table, f, write_page_checksum=True)
+        f.flush()
+        os.fsync(f.fileno())
+
+def partition_paths(manifest, table, start=None, end=None):
+    """Part files of a table for the months between two dates (None means unbounded)"""
+    first = start.strftime('%Y-%m') if start else None
+    last = end.strftime('%Y-%m') if end else None
+    months = manifest['partitions'].get(table, {})
+    return [
+        path
+        for month in sorted(months)
+        if (first is None or month >= first) and (last is None or month <= last)
+        for path in months[month]
+    ]
+
+def read_partitioned_snapshot(manifest):
+    """Load every partition listed in a manifest"""
+    snapshot = {'journal_seq': manifest['journal_seq']}
+    for table in PARTITIONED_TABLES:
+        df = read_parquet_files(partition_paths(manifest, table))
+        if df is not None:
+            snapshot[table] = df
+    if manifest.get('customer_advances'):
+        snapshot['customer_advances'] = read_parquet_files([manifest['customer_advances']])
+    return snapshot
+
+def remove_unreferenced_advances():
+    """Delete advances files listed by neither the current nor the fallback manifest.
     
-    # Get only valid transaction IDs (strings that match the pattern)
-    valid_ids = st.session_state.transactions['Transaction_ID'].dropna()
-    valid_ids = valid_ids[valid_ids.apply(lambda x: isinstance(x, str) and x.startswith('TXN-'))]
+    Call with the compaction lock held, so no new advances file is in flight.
+    """
+    referenced = set()
+    for path in (SNAPSHOT_MANIFEST, PREVIOUS_MANIFEST):
+        try:
+            manifest = read_manifest_file(path)
+        except Exception:
+            continue
+        if manifest and manifest.get('customer_advances'):
+            referenced.add(manifest['customer_advances'])
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name.startswith('customer_advances-') and name not in referenced:
+            try:
+                os.remove(os.path.join(SNAPSHOT_DIR, name))
+            except OSError:
+                pass
+
+def write_pickle_snapshot():
+    """Write the full dataset to a temporary pickle snapshot"""
+    data, seq = read_store()
+    snapshot = dict(data)
+    snapshot['journal_seq'] = seq
+    
+    tmp_file = temp_file_for(DATA_FILE)
+    with open(tmp_file, 'wb') as f:
+        write_pickle_snapshot_file(f, snapshot)
+        f.flush()
+        os.fsync(f.fileno())
+    return seq, tmp_file, DATA_FILE, PREVIOUS_DATA_FILE
+
+def write_partitioned_snapshot():
+    """Write part files for the rows journaled since the last snapshot and a new manifest.
     
-    if valid_ids.empty:
-        return "TXN-00001"
+    Returns None if there is nothing to fold in.
+    """
+    manifest = read_manifest()
+    if manifest is None:
+        # First partitioned snapshot (possibly migrating a pickle one): every row is new
+        new_data, seq = read_store()
+        manifest = {'journal_seq': seq, 'partitions': {}, 'customer_advances': None}
+    else:
+        entries, _ = read_journal()
+        entries = [entry for entry in entries if entry['seq'] > manifest['journal_seq']]
+        if not entries:
+            return None
+        seq = entries[-1]['seq']
+        base = empty_data()
+        if manifest.get('customer_advances'):
+            base['customer_advances'] = read_parquet_files([manifest['customer_advances']])
+        new_data = normalize_data(apply_journal_entries(base, entries))
+    
+    partitions = {table: {month: list(paths) for month, paths in months.items()}
+                  for table, months in manifest['partitions'].items()}
+    for table in PARTITIONED_TABLES:
+        df = new_data[table]
+        if df.empty:
+            continue
+        for month, part in df.groupby(df['Date'].dt.strftime('%Y-%m'), sort=True):
+            path = f"{table}/{month}/part-{seq:08d}.parquet"
+            write_parquet_file(part, path)
+            partitions.setdefault(table, {}).setdefault(month, []).append(path)
+    
+    # Advance balances change in place; the table is small, so write it whole
+    advances_path = f"customer_advances-{seq:08d}.parquet"
+    write_parquet_file(new_data['customer_advances'], advances_path)
+    
+    new_manifest = {'journal_seq': seq, 'partitions': partitions, 'customer_advances': advances_path}
+    new_manifest['checksum'] = manifest_checksum(new_manifest)
+    tmp_file = temp_file_for(SNAPSHOT_MANIFEST)
+    with open(tmp_file, 'w') as f:
+        json.dump(new_manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    return seq, tmp_file, SNAPSHOT_MANIFEST, PREVIOUS_MANIFEST
+
+def parse_journal_record(buf, offset):
+    """Parse the journal record starting at offset in the journal's bytes.
     
+    Returns (entry, end), with entry None if the record is complete but
+    damaged, or None if the record runs past the end of the bytes.
+    """
+    start = offset + 4
+    if start > len(buf):
+        return None
+    size = struct.unpack_from('>I', buf, offset)[0]
+    crc = None
+    if size & JOURNAL_CRC_FLAG:
+        size &= ~JOURNAL_CRC_FLAG
+        if start + 4 > len(buf):
+            return None
+        crc = struct.unpack_from('>I', buf, start)[0]
+        start += 4
+    end = start + size
+    if end > len(buf):
+        return None
+    payload = buf[start:end]
+    if crc is not None and zlib.crc32(payload) != crc:
+        return None, end
     try:
-        # Extract the numeric part and find the maximum
-        nums = valid_ids.str.split('-').str[1].astype(int)
-        max_num = nums.max()
-        return f"TXN-{max_num + 1:05d}"
-    except:
-        # Fallback in case of any parsing error
-        return f"TXN-{int(time.time())}"
+        entry = pickle.loads(payload)
+    except Exception:
+        return None, end
+    if not isinstance(entry, dict) or 'seq' not in entry or 'ops' not in entry:
+        return None, end
+    return entry, end
 
-def validate_phone(phone):
-    """Validate Pakistani phone number format"""
-    if not phone:
-        return False
-    pattern = r'^(\+92|0)[0-9]{10}$'
-    return re.match(pattern, phone) is not None
+def next_journal_record(buf, offset):
+    """Offset of the first intact record at or after offset, or None"""
+    for candidate in range(offset, len(buf) - 4):
+        record = parse_journal_record(buf, candidate)
+        if record is not None and record[0] is not None:
+            return candidate
+    return None
 
-def format_cnic(cnic):
-    """Format CNIC to standard format (XXXXX-XXXXXXX-X)"""
-    if not cnic:
-        return ""
+def scan_journal():
+    """Read every intact journal entry, stepping over damaged records.
     
-    # Remove all non-digit characters
-    digits = re.sub(r'\D', '', cnic)
+    Returns the entries, the byte offset where the last intact entry ends and
+    the damaged records as (offset, bytes) pairs. A record that runs past the
+    end of the file with nothing intact after it is the torn tail of an
+    interrupted write; it is not counted as damaged and lies past the offset.
+    """
+    entries = []
+    damaged = []
+    good_offset = 0
+    if not os.path.exists(JOURNAL_FILE):
+        return entries, good_offset, damaged
+    
+    with open(JOURNAL_FILE, 'rb') as f:
+        buf = f.read()
+    offset = 0
+    while offset < len(buf):
+        record = parse_journal_record(buf, offset)
+        if record is not None and record[0] is not None:
+            entry, offset = record
+            entries.append(entry)
+            good_offset = offset
+            continue
+        # Damaged, or a length that runs off the end: carry on at the next
+        # intact record, since the length itself may be what was damaged
+        resume = next_journal_record(buf, offset + 1)
+        if resume is None:
+            if record is not None:
+                # A complete record with a bad checksum is damage, not a torn write
+                damaged.append((offset, buf[offset:]))
+            break
+        damaged.append((offset, buf[offset:resume]))
+        offset = resume
+    return entries, good_offset, damaged
+
+def read_journal():
+    """Read the intact journal entries, skipping damaged records (see scan_journal).
     
-    # If we have 13 digits, format it properly
-    if len(digits) == 13:
-        return f"{digits[:5]}-{digits[5:12]}-{digits[12]}"
-    else:
-        # If not 13 digits, just return the cleaned version
-        return digits
+    Returns the entries and the byte offset where the last intact entry ends.
+    """
+    entries, good_offset, damaged = scan_journal()
+    if damaged:
+        print(f"Journal has {len(damaged)} damaged record(s) at offset(s) {[offset for offset, _ in damaged]}; skipping them")
+        journal_state()['damaged'] = True
+    return entries, good_offset
 
-def validate_cnic(cnic):
-    """Validate Pakistani CNIC format - accept any format but clean it"""
-    if not cnic:  # CNIC is optional
-        return True, ""
+def keep_damaged_records(damaged):
+    """Append damaged journal records to JOURNAL_DAMAGED_FILE, each behind its offset and length"""
+    with open(JOURNAL_DAMAGED_FILE, 'ab') as f:
+        for offset, record in damaged:
+            f.write(struct.pack('>QI', offset, len(record)) + record)
+        f.flush()
+        os.fsync(f.fileno())
+
+def write_journal_entry(f, entry):
+    """Write one length-prefixed, CRC32-checked journal entry to an open file"""
+    payload = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+    f.write(struct.pack('>II', len(payload) | JOURNAL_CRC_FLAG, zlib.crc32(payload)) + payload)
+
+def init_journal(state):
+    """Recover the sequence counter, set damaged records aside and drop any torn tail.
     
-    # Remove all non-digit characters
-    digits = re.sub(r'\D', '', cnic)
+    Call with journal_lock() held.
+    """
+    entries, good_offset, damaged = scan_journal()
+    
+    if damaged:
+        # Rewrite the journal with the intact entries only, the damaged
+        # records having been copied out first
+        print(f"Moving {len(damaged)} damaged journal record(s) to {JOURNAL_DAMAGED_FILE}")
+        keep_damaged_records(damaged)
+        tmp_journal = temp_file_for(JOURNAL_FILE)
+        with open(tmp_journal, 'wb') as f:
+            for entry in entries:
+                write_journal_entry(f, entry)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_journal, JOURNAL_FILE)
+        fsync_directory(os.path.dirname(JOURNAL_FILE))
+    elif os.path.exists(JOURNAL_FILE) and os.path.getsize(JOURNAL_FILE) > good_offset:
+        with open(JOURNAL_FILE, 'r+b') as f:
+            f.truncate(good_offset)
+            f.flush()
+            os.fsync(f.fileno())
+    state['damaged'] = False
+    
+    # Cheap: snapshots record their journal seq in a header or the manifest
+    snapshot_seq = snapshot_journal_seq()
+    seqs = [entry['seq'] for entry in entries]
+    state['seq'] = max([snapshot_seq] + seqs)
+    state['pending'] = sum(1 for seq in seqs if seq > snapshot_seq)
+    state['signature'] = file_signature(JOURNAL_FILE)
+
+def append_journal(ops):
+    """Append one fsync'd journal entry holding all operations of a form submission"""
+    with journal_lock() as state:
+        check_unsold_imeis(ops)
+        entry = {'seq': state['seq'] + 1, 'ops': ops}
+        # If another process wrote since the cache was loaded, the versions
+        # differ and the next get_data() re-reads everyone's entries
+        previous_version = data_store_version()
+        with open(JOURNAL_FILE, 'ab') as f:
+            write_journal_entry(f, entry)
+            f.flush()
+            os.fsync(f.fileno())
+        state['seq'] = entry['seq']
+        state['signature'] = file_signature(JOURNAL_FILE)
+        state['pending'] += 1
+        update_data_store(entry, previous_version)
+        should_compact = state['pending'] >= JOURNAL_COMPACT_THRESHOLD and not state['compacting']
+        if should_compact:
+            state['compacting'] = True
+    
+    if should_compact:
+        threading.Thread(target=compact_in_background, daemon=True).start()
+
+def apply_journal_entries(data, entries):
+    """Replay journal entries on top of a dataset"""
+    apply_advance_ops(data, entries)
+    for table, new_df in appended_rows(data, entries).items():
+        data[table] = concat_table(data[table], new_df)
+    return data
+
+def apply_advance_ops(data, entries):
+    """Apply the advance operations of journal entries to the customer_advances table"""
+    for entry in entries:
+        for op in entry['ops']:
+            if op['op'] == 'advance':
+                data['customer_advances'] = apply_customer_advance(
+                    data['customer_advances'], op['customer_name'], op['phone'], op['cnic'], op['amount'], op.get('keys')
+                )
+
+def appended_rows(data, entries):
+    """The rows journal entries append, as a normalized frame per table"""
+    new_rows = {}
+    for entry in entries:
+        for op in entry['ops']:
+            if op['op'] == 'append':
+                new_rows.setdefault(op['table'], []).append(op['row'])
+    
+    frames = {}
+    for table, rows in new_rows.items():
+        # Normalize just the new rows so the merged columns keep their dtypes;
+        # columns the rows lack are added first so they get '' rather than NaN
+        new_df = pd.DataFrame(rows)
+        new_df = new_df.reindex(columns=new_df.columns.union(data[table].columns, sort=False))
+        frames[table] = normalize_data({table: new_df})[table]
+    return frames
+
+def normalize_dates(data):
+    """Convert date columns to datetime and drop rows with invalid dates.
     
-    # If empty after cleaning, it's valid (optional)
-    if not digits:
-        return True, ""
+    Frames are replaced rather than modified in place because they may be
+    shared with other sessions through the data store.
+    """
+    for table in PARTITIONED_TABLES:
+        df = data.get(table)
+        if df is not None and not df.empty and 'Date' in df.columns:
+            if not pd.api.types.is_datetime64_any_dtype(df['Date']):
+                df = df.assign(Date=pd.to_datetime(df['Date'], errors='coerce'))
+            if df['Date'].isna().any():
+                df = df[df['Date'].notna()]
+            data[table] = df
+    return data
+
+def normalize_data(data):
+    """Clean dates and enforce the column schema of every table"""
+    return enforce_schema(normalize_dates(data))
+
+def read_store():
+    """Rebuild the dataset by loading the snapshot and replaying the journal tail.
     
-    # If we have 13 digits, it's valid
-    if len(digits) == 13:
-        return True, f"{digits[:5]}-{digits[5:12]}-{digits[12]}"
-    else:
-        # Accept any number of digits but just return the cleaned version
-        return True, digits
+    Returns the dataset and the last journal sequence number it reflects.
+    """
+    snapshot = read_snapshot() or {}
+    snapshot_seq = snapshot.get('journal_seq', 0)
+    data = {table: snapshot.get(table, empty_table(table)) for table in TABLE_COLUMNS}
+    
+    entries, _ = read_journal()
+    entries = [entry for entry in entries if entry['seq'] > snapshot_seq]
+    data = apply_journal_entries(data, entries)
+    
+    last_seq = max([snapshot_seq] + [entry['seq'] for entry in entries])
+    return normalize_data(data), last_seq
 
-def get_customer_balance(customer_identifier):
-    """Get customer balance based on phone, CNIC, or name"""
-    if not st.session_state.transactions.empty:
-        # Filter transactions for this customer
-        customer_transactions = st.session_state.transactions[
-            (st.session_state.transactions['Customer_Name'] == customer_identifier) |
-            (st.session_state.transactions['Phone'] == customer_identifier) |
-            (st.session_state.transactions['CNIC'] == customer_identifier)
-        ]
+def compact_data():
+    """Fold the journal into a fresh snapshot and drop the entries it now contains"""
+    # One compaction at a time across processes, so a snapshot is always built
+    # from the newest one and never replaced by an older one
+    with file_lock(COMPACT_LOCK_FILE):
+        snapshot = write_partitioned_snapshot() if SNAPSHOT_FORMAT == 'parquet' else write_pickle_snapshot()
+        if snapshot is None:
+            return
+        seq, tmp_file, snapshot_path, previous_path = snapshot
         
-        # Get advance balance if exists
-        advance_balance = 0
-        if not st.session_state.customer_advances.empty:
-            customer_advance = st.session_state.customer_advances[
-                (st.session_state.customer_advances['Customer_Name'] == customer_identifier) |
-                (st.session_state.customer_advances['Phone'] == customer_identifier) |
-                (st.session_state.customer_advances['CNIC'] == customer_identifier)
-            ]
-            if not customer_advance.empty:
-                advance_balance = customer_advance['Advance_Balance'].sum()
-        
-        if not customer_transactions.empty:
-            total_left = customer_transactions['Left_Amount'].sum()
-            total_paid = customer_transactions['Paid_Amount'].sum()
-            total_amount = customer_transactions['Selling_Price'].sum()
+        with journal_lock() as state:
+            previous_version = data_store_version()
+            # The current snapshot becomes the fallback generation. Both renames
+            # are atomic; between them readers find only the previous file.
+            fallback_seq = snapshot_journal_seq()
+            if os.path.exists(snapshot_path):
+                os.replace(snapshot_path, previous_path)
+            os.replace(tmp_file, snapshot_path)
             
-            # Get payment history
-            if not st.session_state.payments.empty:
-                customer_payments = st.session_state.payments[
-                    (st.session_state.payments['Customer_Name'] == customer_identifier) |
-                    (st.session_state.payments['Phone'] == customer_identifier) |
-                    (st.session_state.payments['CNIC'] == customer_identifier)
-                ]
-                additional_payments = customer_payments['Amount'].sum()
-                total_paid += additional_payments
-                total_left -= additional_payments
+            # Keep every entry after the fallback generation (including those
+            # appended while the snapshot was being written), so it can be
+            # replayed on top of either snapshot
+            entries, _, damaged = scan_journal()
+            if damaged:
+                keep_damaged_records(damaged)
+            remaining = [entry for entry in entries if entry['seq'] > fallback_seq]
+            tmp_journal = temp_file_for(JOURNAL_FILE)
+            with open(tmp_journal, 'wb') as f:
+                for entry in remaining:
+                    write_journal_entry(f, entry)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_journal, JOURNAL_FILE)
+            fsync_directory(os.path.dirname(snapshot_path))
+            fsync_directory(os.path.dirname(JOURNAL_FILE))
+            state['signature'] = file_signature(JOURNAL_FILE)
+            state['pending'] = sum(1 for entry in remaining if entry['seq'] > seq)
             
-            # Apply advance balance
-            if advance_balance > 0:
-                if total_left > 0:
-                    if advance_balance >= total_left:
-                        advance_balance -= total_left
-                        total_left = 0
-                        total_paid = total_amount
-                    else:
-                        total_left -= advance_balance
-                        total_paid += advance_balance
-                        advance_balance = 0
-            
-            return {
-                'total_amount': total_amount,
-                'total_paid': total_paid,
-                'total_left': max(0, total_left),
-                'advance_balance': advance_balance,
-                'transactions': customer_transactions
-            }
-    
-    # Check if customer has only advance balance
-    if not st.session_state.customer_advances.empty:
-        customer_advance = st.session_state.customer_advances[
-            (st.session_state.customer_advances['Customer_Name'] == customer_identifier) |
-            (st.session_state.customer_advances['Phone'] == customer_identifier) |
-            (st.session_state.customer_advances['CNIC'] == customer_identifier)
+            # The compacted files hold the same records, so cached data stays valid
+            store = data_store()
+            with store['lock']:
+                if store['version'] == previous_version:
+                    store['version'] = data_store_version()
+        
+        # Merge this process's pending rows while off the request path
+        with store['lock']:
+            merge_store_buffer(store)
+        
+        if SNAPSHOT_FORMAT == 'parquet':
+            remove_unreferenced_advances()
+
+def read_table_range(table, start=None, end=None, columns=None):
+    """Rows of a dated table between two dates (inclusive; None means unbounded).
+    
+    With partitioned snapshots only the months in range are read from disk,
+    memory-mapped and limited to the requested columns, and the journal tail
+    is replayed on top. Otherwise the rows come from the shared date index.
+    Either way they are returned oldest first.
+    """
+    manifest = None
+    if STORAGE_BACKEND == 'journal' and SNAPSHOT_FORMAT == 'parquet':
+        # Read manifest and journal together so a compaction can't fall in between
+        with journal_lock():
+            manifest = read_manifest()
+            entries, _ = read_journal()
+    
+    if manifest is None:
+        df = date_slice(table, start, end)
+    else:
+        read_columns = None if columns is None else list(dict.fromkeys(['Date'] + list(columns)))
+        frames = [read_parquet_files(partition_paths(manifest, table, start, end), read_columns)]
+        tail_rows = [
+            op['row'] for entry in entries if entry['seq'] > manifest['journal_seq']
+            for op in entry['ops'] if op['op'] == 'append' and op['table'] == table
         ]
-        if not customer_advance.empty:
-            advance_balance = customer_advance['Advance_Balance'].sum()
-            return {
-                'total_amount': 0,
-                'total_paid': 0,
-                'total_left': 0,
-                'advance_balance': advance_balance,
-                'transactions': pd.DataFrame()
-            }
-    
-    return {'total_amount': 0, 'total_paid': 0, 'total_left': 0, 'advance_balance': 0, 'transactions': pd.DataFrame()}
+        if tail_rows:
+            frames.append(pd.DataFrame(tail_rows))
+        frames = [frame for frame in frames if frame is not None]
+        df = pd.concat(frames, ignore_index=True) if frames else empty_table(table)
+        df = normalize_data({table: df})[table]
+        # Partitions only bound the range to whole months
+        df = df.sort_values('Date', kind='stable')
+        lo, hi = date_bounds(table_dates(df), start, end)
+        df = df.iloc[lo:hi]
+    
+    if columns is not None:
+        df = df.reindex(columns=list(columns))
+    return df
 
-def update_customer_advance(customer_name, phone, cnic, amount):
-    """Update customer advance balance"""
-    if not st.session_state.customer_advances.empty:
-        # Check if customer already exists in advances
-        customer_idx = st.session_state.customer_advances[
-            (st.session_state.customer_advances['Customer_Name'] == customer_name) |
-            (st.session_state.customer_advances['Phone'] == phone) |
-            (st.session_state.customer_advances['CNIC'] == cnic)
-        ].index
-        
-        if not customer_idx.empty:
-            # Update existing customer advance
-            st.session_state.customer_advances.loc[customer_idx, 'Advance_Balance'] += amount
-        else:
-            # Add new customer advance
-            new_advance = {
-                'Customer_Name': customer_name,
-                'Phone': phone,
-                'CNIC': cnic,
-                'Advance_Balance': amount
-            }
-            st.session_state.customer_advances = pd.concat(
-                [st.session_state.customer_advances, pd.DataFrame([new_advance])],
-                ignore_index=True
-            )
+def compact_in_background():
+    """Run a compaction off the request thread"""
+    state = journal_state()
+    try:
+        compact_data()
+    except Exception as e:
+        print(f"Error compacting data: {e}")
+    finally:
+        with state['lock']:
+            state['compacting'] = False
+
+@st.cache_resource
+def data_store():
+    """Process-wide parsed copy of the data shared by reruns and browser sessions"""
+    return {
+        'lock': threading.Lock(),
+        'data': None,
+        'version': None,     # file signatures the cached data was read from
+        'generation': 0,     # bumped every time the cached data changes
+        'pending': {},       # table -> rows written since the frames were last merged
+        'indexes': {}        # name -> (generation, derived index), see STORE_INDEXES
+    }
+
+def file_signature(path):
+    """Return (mtime, size) of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Derived indexes over the shared data: name -> (build(data), update(index, change)).
+# update() brings the index forward by one written entry (see buffer_store_entry()
+# for what change holds), patching it in place; it returns False if the index
+# has to be rebuilt instead.
+STORE_INDEXES = {}
+
+# Rows this process writes to the dated tables are kept in small pending frames
+# next to the shared ones, and indexes address rows by position across both.
+# The pending rows are merged into the shared frames once there are
+# STORE_BUFFER_ROWS of them, after a compaction, or when a page reads whole
+# tables through get_data(), so a write doesn't copy the tables it appends to.
+STORE_BUFFER_ROWS = 1000
+
+def data_store_version():
+    """Version key of the data on disk"""
+    if STORAGE_BACKEND == 'sqlite':
+        return sqlite_generation()
+    return (file_signature(snapshot_file()), file_signature(JOURNAL_FILE))
+
+def storage_read():
+    """Read the full dataset from the configured storage backend"""
+    if STORAGE_BACKEND == 'sqlite':
+        return sqlite_read_store()
+    return read_store()
+
+def storage_write(ops):
+    """Persist the operations of one form submission with the configured backend"""
+    if STORAGE_BACKEND == 'sqlite':
+        sqlite_write(ops)
     else:
-        # Add new customer advance
-        new_advance = {
-            'Customer_Name': customer_name,
-            'Phone': phone,
-            'CNIC': cnic,
-            'Advance_Balance': amount
-        }
-        st.session_state.customer_advances = pd.concat(
-            [st.session_state.customer_advances, pd.DataFrame([new_advance])],
-            ignore_index=True
-        )
+        append_journal(ops)
 
-# ==============================
-# FIXED RECEIPT FUNCTIONS
-# ==============================
-def generate_receipt(transaction_data):
-    """Generate a receipt for a transaction - FIXED FORMATTING"""
-    # Format prices properly
-    unit_price = transaction_data['Selling_Price'] / transaction_data['Quantity'] if transaction_data['Quantity'] > 0 else 0
-    
-    # Only show brand/model if they exist and are not None/empty
-    brand_model = ""
-    if transaction_data.get('Brand') and transaction_data.get('Model'):
-        brand_model = f"{transaction_data['Brand']} {transaction_data['Model']}"
-    elif transaction_data.get('Brand'):
-        brand_model = transaction_data['Brand']
-    elif transaction_data.get('Model'):
-        brand_model = transaction_data['Model']
-        
-    # Only show color/storage if they exist and are not None/empty
-    color_storage = ""
-    if transaction_data.get('Color') and transaction_data.get('Storage'):
-        color_storage = f"{transaction_data['Color']} {transaction_data['Storage']}"
-    elif transaction_data.get('Color'):
-        color_storage = transaction_data['Color']
-    elif transaction_data.get('Storage'):
-        color_storage = transaction_data['Storage']
-    
-    receipt_html = f"""
-    <div class="receipt-container">
-        <div class="receipt-header">
-            <h2>AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI</h2>
-            <p>Main Market, Loralai, Pakistan</p>
-            <p>+92 300 1234567</p>
-            <p>{transaction_data['Date']} {transaction_data['Time']}</p>
-            <p>Transaction ID: {transaction_data['Transaction_ID']}</p>
-        </div>
-        
-        <div style="margin-bottom: 15px;">
-            <p><strong>Customer:</strong> {transaction_data['Customer_Name']}</p>
-            <p><strong>Phone:</strong> {transaction_data['Phone']}</p>
-        </div>
-        
-        <div style="border-bottom: 1px dashed #ccc; padding-bottom: 10px; margin-bottom: 10px;">
-            <div class="receipt-item">
-                <span>Item:</span>
-                <span>{transaction_data['Item']}</span>
-            </div>
-            """
-    
-    # Only add brand/model line if it's not empty
-    if brand_model:
-        receipt_html += f"""
-            <div class="receipt-item">
-                <span>Brand/Model:</span>
-                <span>{brand_model}</span>
-            </div>
-        """
-    
-    # Only add color/storage line if it's not empty
-    if color_storage:
-        receipt_html += f"""
-            <div class="receipt-item">
-                <span>Color/Storage:</span>
-                <span>{color_storage}</span>
-            </div>
-        """
-    
-    # Add IMEI if available
-    if transaction_data.get('IMEI'):
-        receipt_html += f"""
-            <div class="receipt-item">
-                <span>IMEI:</span>
-                <span>{transaction_data['IMEI']}</span>
-            </div>
-        """
+def refresh_data_store(store):
+    """Reload the shared data if the files changed (call with the store lock held)"""
+    version = data_store_version()
+    if store['data'] is None or store['version'] != version:
+        store['data'], _ = storage_read()
+        store['version'] = version
+        store['pending'] = {}
+        store['generation'] += 1
+
+def get_data():
+    """Return the whole shared dataset and its generation, reloading only if the files changed.
     
-    receipt_html += f"""
-            <div class="receipt-item">
-                <span>Quantity:</span>
-                <span>{transaction_data['Quantity']}</span>
-            </div>
-            
-            <div class="receipt-item">
-                <span>Unit Price:</span>
-                <span>{unit_price:,.0f} PKR</span>
-            </div>
-        </div>
-        
-        <div class="receipt-total">
-            <span>TOTAL:</span>
-            <span>{transaction_data['Selling_Price']:,.0f} PKR</span>
-        </div>
-        
-        <div class="receipt-item">
-            <span>Paid:</span>
-            <span>{transaction_data['Paid_Amount']:,.0f} PKR</span>
-        </div>
-        
-        <div class="receipt-item">
-            <span>Balance:</span>
-            <span>{transaction_data['Left_Amount']:,.0f} PKR</span>
-        </div>
-        
-        <div style="text-align: center; margin-top: 20px;">
-            <p>Thank you for your purchase!</p>
-            {f"<p>Warranty: {transaction_data.get('Warranty', '')}</p>" if transaction_data.get('Warranty') else ""}
-        </div>
-    </div>
+    Pending rows are merged in first, which copies the tables they belong to;
+    pages that only look rows up go through store_index() instead.
     """
-    return receipt_html
+    store = data_store()
+    with store['lock']:
+        refresh_data_store(store)
+        merge_store_buffer(store)
+        return store['data'], store['generation']
 
-def create_receipt_pdf(transaction_data):
-    """Create a PDF receipt for a transaction - FIXED FORMATTING"""
-    pdf = FPDF()
-    pdf.add_page()
-    
-    # Header
-    pdf.set_font("Arial", 'B', 16)
-    pdf.set_text_color(74, 20, 140)
-    pdf.cell(0, 10, "AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI", 0, 1, 'C')
-    
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(0, 6, "Main Market, Loralai, Pakistan", 0, 1, 'C')
-    pdf.cell(0, 6, "+92 300 1234567", 0, 1, 'C')
-    
-    # Format date and time properly
-    if isinstance(transaction_data['Date'], str):
-        date_str = transaction_data['Date']
-    else:
-        date_str = transaction_data['Date'].strftime('%Y-%m-%d') if hasattr(transaction_data['Date'], 'strftime') else str(transaction_data['Date'])
-    
-    if isinstance(transaction_data['Time'], str):
-        time_str = transaction_data['Time']
-    else:
-        time_str = transaction_data['Time'].strftime('%H:%M:%S') if hasattr(transaction_data['Time'], 'strftime') else str(transaction_data['Time'])
-    
-    pdf.cell(0, 6, f"{date_str} {time_str}", 0, 1, 'C')
-    pdf.cell(0, 6, f"Transaction ID: {transaction_data['Transaction_ID']}", 0, 1, 'C')
-    pdf.ln(5)
-    
-    # Customer info
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 8, "CUSTOMER INFORMATION", 0, 1, 'L')
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(0, 6, f"Name: {transaction_data['Customer_Name']}", 0, 1, 'L')
-    pdf.cell(0, 6, f"Phone: {transaction_data['Phone']}", 0, 1, 'L')
-    if transaction_data.get('CNIC'):
-        pdf.cell(0, 6, f"CNIC: {transaction_data['CNIC']}", 0, 1, 'L')
-    pdf.ln(5)
+def data_generation():
+    """Generation of the shared data, reloading it first if the files changed"""
+    store = data_store()
+    with store['lock']:
+        refresh_data_store(store)
+        return store['generation']
+
+def update_data_store(entry, previous_version):
+    """Record a journal entry just written by this process in the cached data.
     
-    # Item details
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 8, "ITEM DETAILS", 0, 1, 'L')
-    pdf.set_font("Arial", '', 10)
+    Must be called with the journal lock held, right after the entry is written.
+    The cache is only patched if it matched the files before the write;
+    otherwise it is already stale and the next read reloads it.
+    """
+    store = data_store()
+    with store['lock']:
+        if store['data'] is None or store['version'] != previous_version:
+            return
+        buffer_store_entry(store, entry)
+        store['version'] = data_store_version()
+
+def buffer_store_entry(store, entry):
+    """Add a written entry to the cached data and its indexes (call with the store lock held).
+    
+    Rows appended to the dated tables join their pending rows; the small
+    customer_advances table is updated directly. Each index is handed a change
+    holding the entry, the position of the first row it appended to each table
+    ('positions'), those rows as stored ('rows', normalized, so rows without a
+    valid date are gone) and customer_advances before and after it
+    ('old_advances', 'advances').
+    """
+    data = dict(store['data'])
+    pending = dict(store['pending'])
+    positions = {table: store_length((data, pending), table) for table in TABLE_COLUMNS}
+    old_advances = data['customer_advances']
+    
+    apply_advance_ops(data, [entry])
+    rows = appended_rows(data, [entry])
+    for table, df in rows.items():
+        if table in PARTITIONED_TABLES:
+            pending[table] = append_table(table, pending[table], df) if table in pending else df
+        else:
+            data[table] = append_table(table, data[table], df)
     
-    pdf.cell(50, 6, "Item:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{transaction_data['Item']}", 0, 1, 'L')
-    
-    # Only show brand/model if they exist and are not None/empty
-    brand_model = ""
-    if transaction_data.get('Brand') and transaction_data.get('Model'):
-        brand_model = f"{transaction_data['Brand']} {transaction_data['Model']}"
-    elif transaction_data.get('Brand'):
-        brand_model = transaction_data['Brand']
-    elif transaction_data.get('Model'):
-        brand_model = transaction_data['Model']
-        
-    if brand_model:
-        pdf.cell(50, 6, "Brand/Model:", 0, 0, 'L')
-        pdf.cell(0, 6, f"{brand_model}", 0, 1, 'L')
-    
-    # Only show color/storage if they exist and are not None/empty
-    color_storage = ""
-    if transaction_data.get('Color') and transaction_data.get('Storage'):
-        color_storage = f"{transaction_data['Color']} {transaction_data['Storage']}"
-    elif transaction_data.get('Color'):
-        color_storage = transaction_data['Color']
-    elif transaction_data.get('Storage'):
-        color_storage = transaction_data['Storage']
-        
-    if color_storage:
-        pdf.cell(50, 6, "Color/Storage:", 0, 0, 'L')
-        pdf.cell(0, 6, f"{color_storage}", 0, 1, 'L')
-    
-    # Add IMEI if available
-    if transaction_data.get('IMEI'):
-        pdf.cell(50, 6, "IMEI:", 0, 0, 'L')
-        pdf.cell(0, 6, f"{transaction_data['IMEI']}", 0, 1, 'L')
-    
-    pdf.cell(50, 6, "Quantity:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{transaction_data['Quantity']}", 0, 1, 'L')
-    
-    unit_price = transaction_data['Selling_Price'] / transaction_data['Quantity'] if transaction_data['Quantity'] > 0 else 0
-    pdf.cell(50, 6, "Unit Price:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{unit_price:,.0f} PKR", 0, 1, 'L')
+    old_generation = store['generation']
+    store['data'], store['pending'] = data, pending
+    store['generation'] += 1
     
-    pdf.ln(5)
+    # Bring derived indexes forward instead of rebuilding them
+    change = {
+        'entry': entry, 'positions': positions, 'rows': rows,
+        'old_advances': old_advances, 'advances': data['customer_advances']
+    }
+    for name, (generation, index) in list(store['indexes'].items()):
+        if generation != old_generation or name not in STORE_INDEXES:
+            continue
+        _, update = STORE_INDEXES[name]
+        if update(index, change):
+            store['indexes'][name] = (store['generation'], index)
+    
+    if sum(len(df) for df in pending.values()) >= STORE_BUFFER_ROWS:
+        merge_store_buffer(store)
+
+def merge_store_buffer(store):
+    """Merge the pending rows into the shared frames (call with the store lock held).
     
-    # Financial details
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(50, 8, "Total Amount:", 0, 0, 'L')
-    pdf.cell(0, 8, f"{transaction_data['Selling_Price']:,.0f} PKR", 0, 1, 'L')
+    Rows keep their positions, so the generation and the indexes stay valid.
+    """
+    if not store['pending']:
+        return
+    data = dict(store['data'])
+    for table, df in store['pending'].items():
+        data[table] = append_table(table, data[table], df)
+    store['data'] = data
+    store['pending'] = {}
+
+def append_table(table, df, new_df):
+    """Append normalized rows to a table of the store, keeping its column dtypes.
     
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(50, 6, "Amount Paid:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{transaction_data['Paid_Amount']:,.0f} PKR", 0, 1, 'L')
+    Appending to an empty frame can turn columns into object; this only
+    converts what changed, so it is cheap otherwise.
+    """
+    return normalize_data({table: concat_table(df, new_df)})[table]
+
+def rows_kept(change, table):
+    """Whether every row an entry appended to a table was stored; if not, later positions have shifted"""
+    appended = sum(1 for op in change['entry']['ops'] if op['op'] == 'append' and op['table'] == table)
+    return appended == (len(change['rows'][table]) if table in change['rows'] else 0)
+
+def store_length(view, table):
+    """Number of rows of a table in a (data, pending) view of the shared data"""
+    data, pending = view
+    return len(data[table]) + (len(pending[table]) if table in pending else 0)
+
+def store_rows(view, table, positions):
+    """Rows of a table at the given positions of a (data, pending) view, in that order.
     
-    pdf.cell(50, 6, "Balance Due:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{transaction_data['Left_Amount']:,.0f} PKR", 0, 1, 'L')
+    Positions past the end of the view are skipped: indexes are patched in
+    place and can be ahead of a view taken earlier.
+    """
+    data, pending = view
+    df = data[table]
+    positions = np.asarray(positions, dtype=np.int64)
+    positions = positions[positions < store_length(view, table)]
+    in_frame = positions < len(df)
+    if in_frame.all():
+        return df.iloc[positions]
+    rows = concat_table(df.iloc[positions[in_frame]], pending[table].iloc[positions[~in_frame] - len(df)])
+    # Back into the order the positions were given in
+    order = np.concatenate([np.flatnonzero(in_frame), np.flatnonzero(~in_frame)])
+    rows = rows.iloc[np.argsort(order, kind='stable')]
+    rows.index = positions
+    return rows
+
+def table_length(table):
+    """Number of rows of a table in the shared data, pending rows included"""
+    store = data_store()
+    with store['lock']:
+        refresh_data_store(store)
+        return store_length((store['data'], store['pending']), table)
+
+def store_index(name):
+    """Return a derived index of the shared data together with a view of the data it describes.
     
-    pdf.ln(10)
+    Indexes are built on first use for each generation and then brought forward
+    by buffer_store_entry() as this process writes new entries. The view is a
+    (data, pending) pair; look rows up in it with store_rows().
+    """
+    store = data_store()
+    with store['lock']:
+        refresh_data_store(store)
+        generation, index = store['indexes'].get(name, (None, None))
+        if generation != store['generation']:
+            # Building reads whole tables
+            merge_store_buffer(store)
+            build, _ = STORE_INDEXES[name]
+            index = build(store['data'])
+            store['indexes'][name] = (store['generation'], index)
+        return index, (store['data'], store['pending'])
+
+def invalidate_data_store():
+    """Drop the cached data so the next access re-reads the files"""
+    store = data_store()
+    with store['lock']:
+        store['data'] = None
+        store['version'] = None
+        store['pending'] = {}
+
+def queue_journal_op(op):
+    """Queue an operation to be written by the next save_data() call"""
+    queue_journal_ops([op])
+
+def queue_journal_ops(ops):
+    """Queue several operations to be written by the next save_data() call"""
+    if 'pending_ops' not in st.session_state:
+        st.session_state.pending_ops = []
+    st.session_state.pending_ops.extend(ops)
+
+def queue_new_row(table, row):
+    """Queue a new row of a table; it appears in the session tables once saved"""
+    queue_journal_op({'op': 'append', 'table': table, 'row': row})
+
+def load_data():
+    """Bring the shared store up to date with the files and note its generation in this session.
     
-    # Footer
-    pdf.set_font("Arial", 'I', 10)
-    pdf.cell(0, 6, "Thank you for your purchase!", 0, 1, 'C')
-    if transaction_data.get('Warranty'):
-        pdf.cell(0, 6, f"Warranty: {transaction_data['Warranty']}", 0, 1, 'C')
+    Pages read the store itself: rows through store_index(), whole tables
+    through get_data().
+    """
+    try:
+        st.session_state.data_generation = data_generation()
+    except Exception as e:
+        st.error(f"Error loading data: {e}")
+        st.session_state.data_generation = None
+
+def check_journal_damage():
+    """Set aside damaged journal records a read stepped over and warn while any are kept"""
+    if journal_state()['damaged']:
+        with journal_lock() as state:
+            init_journal(state)
+    if os.path.exists(JOURNAL_DAMAGED_FILE):
+        st.sidebar.warning(
+            f"Damaged journal records were skipped and moved to {JOURNAL_DAMAGED_FILE}. "
+            "Records saved after them are intact; check the latest records against a backup."
+        )
+
+def reload_data():
+    """Force a fresh read of the data files"""
+    invalidate_data_store()
+    st.session_state.data_generation = None
+    load_data()
+
+def save_data():
+    """Save the records queued by the current form submission; False if the write failed"""
+    try:
+        ops = st.session_state.get('pending_ops', [])
+        if ops:
+            storage_write(ops)
+            st.session_state.pending_ops = []
+    except Exception as e:
+        st.error(f"Error saving data: {e}")
+        # Don't leave a failed write queued behind the next form submission
+        st.session_state.pending_ops = []
+        return False
+    return True
+
+# ==============================
+# SQLITE STORAGE BACKEND
+# ==============================
+# Pages read from the shared in-memory store (see get_data), so SQLite is read
+# in full only when another process has written. Lookups made while writing
+# go to SQL: advances find their customer through canonical key columns kept
+# next to the app's own columns, which pages never see, and the duplicate-sale
+# check looks IMEIs up in sold_imeis, one row per IMEI sold (an IMEI field can
+# hold two, so an index on it could not answer the check).
+#
+# Date backs date-range queries, Transaction_ID receipt lookups and the ID
+# counter bootstrap, and Phone, CNIC and Customer_Name customer lookups. On
+# customer_advances those three are not indexed: every lookup there goes
+# through Customer_Key and CNIC_Key, which hold the same values normalized.
+SQLITE_INDEXED_COLUMNS = ['Phone', 'CNIC', 'Customer_Name', 'Transaction_ID', 'Date', 'Customer_Key', 'CNIC_Key']
+SQLITE_UNINDEXED_COLUMNS = {'customer_advances': ['Phone', 'CNIC', 'Customer_Name']}
+# Canonical customer_keys() of each advance row, as customer_key_columns() builds them
+SQLITE_KEY_COLUMNS = {'customer_advances': ['Customer_Key', 'CNIC_Key']}
+SQLITE_REAL_COLUMNS = [
+    'Selling_Price', 'Cost_Price', 'Profit', 'Paid_Amount', 'Left_Amount',
+    'Advance_Balance', 'Amount'
+]
+SQLITE_INTEGER_COLUMNS = ['Quantity', 'Is_Advance']
+
+@st.cache_resource
+def sqlite_state():
+    """Process-wide SQLite bookkeeping shared by every browser session"""
+    return {
+        'lock': threading.Lock(),         # serializes writes from this process
+        'schema_lock': threading.Lock(),
+        'ready': False
+    }
+
+def sqlite_connect(path=SQLITE_FILE):
+    """Open a connection in autocommit mode; transactions are started explicitly"""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def sqlite_column_type(column):
+    """SQLite type affinity of a column"""
+    if column in SQLITE_REAL_COLUMNS:
+        return 'REAL'
+    if column in SQLITE_INTEGER_COLUMNS:
+        return 'INTEGER'
+    return 'TEXT'
+
+def sqlite_create_schema(conn):
+    """Create tables, indexes and the generation counter if they do not exist"""
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table, columns in TABLE_COLUMNS.items():
+            column_defs = ', '.join(f'"{column}" {sqlite_column_type(column)}' for column in columns)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, {column_defs})')
+            sqlite_add_key_columns(conn, table)
+            for column in SQLITE_INDEXED_COLUMNS:
+                if column in SQLITE_UNINDEXED_COLUMNS.get(table, []):
+                    conn.execute(f'DROP INDEX IF EXISTS idx_{table}_{column.lower()}')
+                elif column in columns + SQLITE_KEY_COLUMNS.get(table, []):
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{column.lower()} ON {table} ("{column}")')
+        new_sold_imeis = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sold_imeis'").fetchone() is None
+        conn.execute('CREATE TABLE IF NOT EXISTS sold_imeis (IMEI TEXT PRIMARY KEY, Sale_ID INTEGER NOT NULL)')
+        if new_sold_imeis:
+            sqlite_fill_sold_imeis(conn)
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def sqlite_add_key_columns(conn, table):
+    """Add a table's key columns to databases created without them, filling in existing rows"""
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    missing = [column for column in SQLITE_KEY_COLUMNS.get(table, []) if column not in existing]
+    if not missing:
+        return
+    for column in missing:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN "{column}" TEXT')
+    rows = pd.read_sql_query(f'SELECT id, Customer_Name, Phone, CNIC FROM {table}', conn)
+    columns = SQLITE_KEY_COLUMNS[table]
+    assignments = ', '.join(f'"{column}" = ?' for column in columns)
+    conn.executemany(
+        f'UPDATE {table} SET {assignments} WHERE id = ?',
+        zip(*customer_key_columns(rows), rows['id'].tolist())
+    )
+
+def sqlite_fill_sold_imeis(conn):
+    """Record the IMEIs of every stored sale in sold_imeis; an IMEI keeps its first sale, as in the stock index"""
+    placeholders = ', '.join('?' for _ in STOCK_CATEGORIES)
+    rows = conn.execute(
+        f"SELECT id, Type, Category, IMEI FROM transactions WHERE Type = 'Sale' "
+        f"AND Category IN ({placeholders}) AND IMEI IS NOT NULL AND IMEI != '' ORDER BY id",
+        STOCK_CATEGORIES
+    ).fetchall()
+    conn.executemany(
+        'INSERT OR IGNORE INTO sold_imeis (IMEI, Sale_ID) VALUES (?, ?)',
+        [
+            (imei, row_id) for row_id, type_, category, imei_field in rows
+            for imei in sale_imeis({'Type': type_, 'Category': category, 'IMEI': imei_field})
+        ]
+    )
+
+def sqlite_sold_imeis(conn, imeis):
+    """sold_imeis() answered from the database: the sale of each listed IMEI that was sold"""
+    imeis = list(dict.fromkeys(imeis))
+    if not imeis:
+        return {}
+    placeholders = ', '.join('?' for _ in imeis)
+    rows = conn.execute(
+        f'SELECT s.IMEI, t.Transaction_ID, t.Date FROM sold_imeis s JOIN transactions t ON t.id = s.Sale_ID '
+        f'WHERE s.IMEI IN ({placeholders})',
+        imeis
+    ).fetchall()
+    return {imei: {'Transaction_ID': transaction_id, 'Date': sale_date} for imei, transaction_id, sale_date in rows}
+
+def sqlite_open():
+    """Open a connection, creating the schema once per process"""
+    state = sqlite_state()
+    conn = sqlite_connect()
+    if not state['ready']:
+        with state['schema_lock']:
+            if not state['ready']:
+                sqlite_create_schema(conn)
+                state['ready'] = True
+    return conn
+
+def sqlite_value(value):
+    """Convert a DataFrame/form value to something SQLite can store"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (date, datetime, pd.Timestamp)):
+        return pd.Timestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+    if hasattr(value, 'item'):
+        # numpy scalars
+        return value.item()
+    return value
+
+def sqlite_key_values(row):
+    """Key column values of one row, like a row of customer_key_columns()"""
+    phone, cnic = phone_key(row.get('Phone')), cnic_key(row.get('CNIC'))
+    name = name_key(row.get('Customer_Name'))
+    first = 'phone:' + phone if phone else ('name:' + name if name and not cnic else '')
+    return [first, 'cnic:' + cnic if cnic else '']
+
+def sqlite_insert_row(conn, table, row):
+    """Insert a single row into a table, with its key columns; returns its id"""
+    columns = [column for column in TABLE_COLUMNS[table] if column in row]
+    values = [sqlite_value(row[column]) for column in columns]
+    if table in SQLITE_KEY_COLUMNS:
+        columns = columns + SQLITE_KEY_COLUMNS[table]
+        values = values + sqlite_key_values(row)
+    placeholders = ', '.join('?' for _ in columns)
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    return conn.execute(f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})', values).lastrowid
+
+def sqlite_insert_frame(conn, table, df):
+    """Insert every row of a DataFrame into a table, with its key columns"""
+    columns = [column for column in TABLE_COLUMNS[table] if column in df.columns]
+    df = df[columns]
+    if table in SQLITE_KEY_COLUMNS:
+        keys = customer_key_columns(df.reindex(columns=['Customer_Name', 'Phone', 'CNIC']))
+        df = df.assign(**dict(zip(SQLITE_KEY_COLUMNS[table], keys)))
+        columns = columns + SQLITE_KEY_COLUMNS[table]
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    placeholders = ', '.join('?' for _ in columns)
+    rows = (
+        [sqlite_value(value) for value in row]
+        for row in df.itertuples(index=False, name=None)
+    )
+    conn.executemany(f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})', rows)
+
+def sqlite_apply_advance(conn, customer_name, phone, cnic, amount, keys=None):
+    """Add to a customer's advance balance, creating the customer if needed"""
+    # Same matching rule as advance_rows_match(), through the indexed key columns
+    keys = sorted(keys or customer_keys(customer_name, phone, cnic))
+    matches = []
+    if keys:
+        placeholders = ', '.join('?' for _ in keys)
+        matches = conn.execute(
+            f'SELECT id, Advance_Balance FROM customer_advances WHERE Customer_Key IN ({placeholders}) '
+            f'OR CNIC_Key IN ({placeholders}) ORDER BY id',
+            keys + keys
+        ).fetchall()
+    if matches:
+        changes = advance_changes([balance or 0 for _, balance in matches], amount)
+        conn.executemany(
+            'UPDATE customer_advances SET Advance_Balance = Advance_Balance + ? WHERE id = ?',
+            [(sqlite_value(change), row_id) for (row_id, _), change in zip(matches, changes) if change]
+        )
     else:
-        pdf.cell(0, 6, "No warranty provided", 0, 1, 'C')
-    
-    # Add shop name in footer instead of "Mobile Master Pro System"
-    pdf.cell(0, 6, " GN BY > AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI", 0, 1, 'C')
-    
-    return pdf.output(dest='S').encode('latin1')
+        sqlite_insert_row(conn, 'customer_advances', {
+            'Customer_Name': customer_name,
+            'Phone': phone,
+            'CNIC': cnic,
+            'Advance_Balance': amount
+        })
 
-def create_expenditure_pdf(expenditure_data):
-    """Create a PDF for expenditure record"""
-    pdf = FPDF()
-    pdf.add_page()
-    
-    # Header
-    pdf.set_font("Arial", 'B', 16)
-    pdf.set_text_color(74, 20, 140)
-    pdf.cell(0, 10, "AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI", 0, 1, 'C')
-    
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(0, 6, "Main Market, Loralai, Pakistan", 0, 1, 'C')
-    pdf.cell(0, 6, "+92 300 1234567", 0, 1, 'C')
-    
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(0, 10, "EXPENDITURE RECEIPT", 0, 1, 'C')
-    pdf.ln(5)
-    
-    # Date and time
-    if isinstance(expenditure_data['Date'], str):
-        date_str = expenditure_data['Date']
+def sqlite_generation(conn=None):
+    """Return the write generation counter of the database"""
+    if conn is None:
+        with closing(sqlite_open()) as conn:
+            return sqlite_generation(conn)
+    return conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+def sqlite_write(ops):
+    """Apply the operations of one form submission in a single transaction"""
+    state = sqlite_state()
+    with state['lock'], closing(sqlite_open()) as conn:
+        previous_version = sqlite_generation(conn)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            check_unsold_imeis(ops, partial(sqlite_sold_imeis, conn))
+            for op in ops:
+                if op['op'] == 'append':
+                    row_id = sqlite_insert_row(conn, op['table'], op['row'])
+                    if op['table'] == 'transactions':
+                        conn.executemany(
+                            'INSERT INTO sold_imeis (IMEI, Sale_ID) VALUES (?, ?)',
+                            [(imei, row_id) for imei in sale_imeis(op['row'])]
+                        )
+                elif op['op'] == 'advance':
+                    sqlite_apply_advance(conn, op['customer_name'], op['phone'], op['cnic'], op['amount'], op.get('keys'))
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            generation = sqlite_generation(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        update_data_store({'seq': generation, 'ops': ops}, previous_version)
+
+def sqlite_next_transaction_number(count=1):
+    """Atomically advance the transaction ID counter kept in the meta table by count"""
+    with closing(sqlite_open()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'transaction_id'").fetchone()
+            if row is None:
+                # One-time bootstrap from the IDs already stored
+                current = conn.execute(
+                    "SELECT MAX(CAST(SUBSTR(Transaction_ID, 5) AS INTEGER)) FROM transactions "
+                    "WHERE Transaction_ID LIKE 'TXN-%'"
+                ).fetchone()[0] or 0
+                conn.execute("INSERT INTO meta (key, value) VALUES ('transaction_id', ?)", (current + count,))
+            else:
+                current = row[0]
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'transaction_id'", (current + count,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return current + 1
+
+def sqlite_frame(conn, table):
+    """Read one table with the app's columns and column types"""
+    column_list = ', '.join(f'"{column}"' for column in TABLE_COLUMNS[table])
+    df = pd.read_sql_query(f'SELECT {column_list} FROM {table} ORDER BY id', conn)
+    if 'Is_Advance' in df.columns and not df.empty:
+        df['Is_Advance'] = df['Is_Advance'].fillna(0).astype(bool)
+    return df
+
+def sqlite_read_store():
+    """Read every table from the database"""
+    with closing(sqlite_open()) as conn:
+        conn.execute('BEGIN')
+        data = {table: sqlite_frame(conn, table) for table in TABLE_COLUMNS}
+        generation = sqlite_generation(conn)
+        conn.execute('COMMIT')
+    return normalize_data(data), generation
+
+def migrate_to_sqlite():
+    """Import the pickle snapshot and journal into the SQLite database"""
+    data, _ = read_store()
+    
+    with closing(sqlite_open()) as conn:
+        existing = sum(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in TABLE_COLUMNS)
+        if existing:
+            print(f"{SQLITE_FILE} already contains {existing} rows, nothing imported.")
+            return
+        
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for table, df in data.items():
+                sqlite_insert_frame(conn, table, df)
+                print(f"{table}: {len(df)} rows imported")
+            sqlite_fill_sold_imeis(conn)
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    
+    print(f"Migration complete. Set MOBILE_SHOP_STORAGE=sqlite to use {SQLITE_FILE}.")
+
+# ==============================
+# BACKUPS
+# ==============================
+# A backup is a small JSON manifest listing content-addressed objects: one
+# compressed CSV per table and month, and one for the advances table. Objects
+# are named by the SHA-256 of their uncompressed content, so a month that has
+# not changed since an earlier backup is stored only once.
+BACKUP_DIR = 'backups'
+BACKUP_OBJECTS_DIR = os.path.join(BACKUP_DIR, 'objects')
+BACKUP_LOCK_FILE = os.path.join(BACKUP_DIR, 'backup.lock')
+BACKUP_CODEC = 'zst' if zstandard is not None else 'gz'
+BACKUP_INTERVAL = 24 * 3600  # seconds between automatic backups
+BACKUP_KEEP_DAILY = 7        # keep the newest backup of each of the last 7 days with backups
+BACKUP_KEEP_MONTHLY = 12     # and of each of the last 12 months
+
+@st.cache_resource
+def backup_state():
+    """Process-wide bookkeeping for automatic backups"""
+    return {
+        'lock': threading.Lock(),
+        'running': False,
+        'last': None         # time of the last backup
+    }
+
+def compress_backup_object(content, codec):
+    """Compress an object's content"""
+    if codec == 'zst':
+        return zstandard.ZstdCompressor(level=10).compress(content)
+    return gzip.compress(content, compresslevel=6, mtime=0)
+
+def decompress_backup_object(content, codec):
+    """Decompress an object's content"""
+    if codec == 'zst':
+        if zstandard is None:
+            raise RuntimeError("the zstandard package is needed to read this backup")
+        return zstandard.ZstdDecompressor().decompress(content)
+    return gzip.decompress(content)
+
+def backup_object_path(name):
+    """Path of a stored object, fanned out by the first two digest characters"""
+    return os.path.join(BACKUP_OBJECTS_DIR, name[:2], name)
+
+def store_backup_object(content):
+    """Store an object unless it is already there; returns its name and the bytes written"""
+    digest = hashlib.sha256(content).hexdigest()
+    for codec in ('zst', 'gz'):
+        if os.path.exists(backup_object_path(f"{digest}.{codec}")):
+            return f"{digest}.{codec}", 0
+    
+    name = f"{digest}.{BACKUP_CODEC}"
+    path = backup_object_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    compressed = compress_backup_object(content, BACKUP_CODEC)
+    tmp_file = temp_file_for(path)
+    with open(tmp_file, 'wb') as f:
+        f.write(compressed)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+    return name, len(compressed)
+
+def read_backup_object(name):
+    """Read and verify a stored object"""
+    digest, codec = name.rsplit('.', 1)
+    with open(backup_object_path(name), 'rb') as f:
+        content = decompress_backup_object(f.read(), codec)
+    if hashlib.sha256(content).hexdigest() != digest:
+        raise ValueError(f"backup object {name} is damaged")
+    return content
+
+def backup_chunks(table, df):
+    """Split a table into the chunks stored as objects: one per month for dated tables"""
+    if table in PARTITIONED_TABLES and not df.empty:
+        for _, chunk in df.groupby(df['Date'].dt.strftime('%Y-%m'), sort=True):
+            yield chunk
     else:
-        date_str = expenditure_data['Date'].strftime('%Y-%m-%d') if hasattr(expenditure_data['Date'], 'strftime') else str(expenditure_data['Date'])
-    
-    if isinstance(expenditure_data['Time'], str):
-        time_str = expenditure_data['Time']
+        yield df
+
+def encode_backup_chunk(df):
+    """CSV of a chunk; unlike a pickle, the same rows always give the same bytes"""
+    return df.to_csv(index=False).encode('utf-8')
+
+def decode_backup_chunk(content):
+    """Read a chunk back; enforce_schema() restores the column types"""
+    df = pd.read_csv(BytesIO(content), dtype=str, keep_default_na=False)
+    for column in BOOLEAN_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column] == 'True'
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            # Missing labels were written as empty fields
+            df[column] = df[column].mask(df[column] == '')
+    return df
+
+def backup_names():
+    """Names of the backups on disk, oldest first"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(name[:-len('.json')] for name in os.listdir(BACKUP_DIR) if name.startswith('backup-') and name.endswith('.json'))
+
+def read_backup_manifest(name):
+    """Read the manifest of a backup"""
+    with open(os.path.join(BACKUP_DIR, f"{name}.json"), 'r') as f:
+        return json.load(f)
+
+def create_backup():
+    """Back up the current data, writing only objects that are not stored yet; returns the backup name"""
+    data, _ = get_data()
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with file_lock(BACKUP_LOCK_FILE):
+        now = datetime.now()
+        name = now.strftime('backup-%Y%m%d-%H%M%S')
+        suffix = 1
+        while os.path.exists(os.path.join(BACKUP_DIR, f"{name}.json")):
+            suffix += 1
+            name = now.strftime('backup-%Y%m%d-%H%M%S') + f"-{suffix}"
+        
+        manifest = {'created': now.isoformat(timespec='seconds'), 'tables': {}, 'rows': {}, 'stored_bytes': 0}
+        for table, df in data.items():
+            objects = []
+            for chunk in backup_chunks(table, df):
+                object_name, written = store_backup_object(encode_backup_chunk(chunk))
+                objects.append(object_name)
+                manifest['stored_bytes'] += written
+            manifest['tables'][table] = objects
+            manifest['rows'][table] = len(df)
+        
+        # The manifest is written last, so a backup only exists once all its objects do
+        path = os.path.join(BACKUP_DIR, f"{name}.json")
+        tmp_file = temp_file_for(path)
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    
+    backup_state()['last'] = time.time()
+    return name
+
+def prune_backups():
+    """Apply the retention policy, then delete objects no remaining backup uses"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with file_lock(BACKUP_LOCK_FILE):
+        names = backup_names()
+        days, months = {}, {}
+        for name in names:
+            # Oldest first, so the newest backup of each day/month wins
+            stamp = name[len('backup-'):]
+            days[stamp[:8]] = name
+            months[stamp[:6]] = name
+        keep = set(names[-1:])
+        keep.update(days[day] for day in sorted(days)[-BACKUP_KEEP_DAILY:])
+        keep.update(months[month] for month in sorted(months)[-BACKUP_KEEP_MONTHLY:])
+        
+        referenced = set()
+        for name in names:
+            if name in keep:
+                for objects in read_backup_manifest(name)['tables'].values():
+                    referenced.update(objects)
+            else:
+                os.remove(os.path.join(BACKUP_DIR, f"{name}.json"))
+        
+        for directory, _, files in os.walk(BACKUP_OBJECTS_DIR):
+            for file_name in files:
+                if file_name not in referenced:
+                    os.remove(os.path.join(directory, file_name))
+
+def load_backup(name):
+    """Read and verify every table of a backup"""
+    manifest = read_backup_manifest(name)
+    data = {}
+    for table in TABLE_COLUMNS:
+        frames = [decode_backup_chunk(read_backup_object(object_name)) for object_name in manifest['tables'].get(table, [])]
+        data[table] = pd.concat(frames, ignore_index=True) if frames else empty_table(table)
+    return normalize_data(data)
+
+def restore_journal_store(data):
+    """Make a dataset the snapshot, with an empty journal"""
+    with file_lock(COMPACT_LOCK_FILE), journal_lock() as state:
+        snapshot = dict(data)
+        snapshot['journal_seq'] = state['seq']
+        tmp_file = temp_file_for(DATA_FILE)
+        with open(tmp_file, 'wb') as f:
+            write_pickle_snapshot_file(f, snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        # Commit the new snapshot before removing anything. Partitions take
+        # precedence over it until they are gone, so a crash in between leaves
+        # the old data whole rather than half of each.
+        os.replace(tmp_file, DATA_FILE)
+        fsync_directory(os.path.dirname(DATA_FILE))
+        
+        # Partitions and the fallback generation describe the replaced data.
+        # The partition directory is renamed away in one step and deleted after.
+        stale_dir = SNAPSHOT_DIR + '.stale'
+        shutil.rmtree(stale_dir, ignore_errors=True)
+        if os.path.exists(SNAPSHOT_DIR):
+            os.replace(SNAPSHOT_DIR, stale_dir)
+            fsync_directory(os.path.dirname(DATA_FILE))
+            shutil.rmtree(stale_dir, ignore_errors=True)
+        if os.path.exists(PREVIOUS_DATA_FILE):
+            os.remove(PREVIOUS_DATA_FILE)
+        
+        tmp_journal = temp_file_for(JOURNAL_FILE)
+        open(tmp_journal, 'wb').close()
+        os.replace(tmp_journal, JOURNAL_FILE)
+        fsync_directory(os.path.dirname(DATA_FILE))
+        state['signature'] = file_signature(JOURNAL_FILE)
+        state['pending'] = 0
+
+def restore_sqlite_store(data):
+    """Replace every table of the database with a dataset in one transaction"""
+    state = sqlite_state()
+    with state['lock'], closing(sqlite_open()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for table, df in data.items():
+                conn.execute(f'DELETE FROM {table}')
+                sqlite_insert_frame(conn, table, df)
+            conn.execute('DELETE FROM sold_imeis')
+            sqlite_fill_sold_imeis(conn)
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+def restore_backup(name):
+    """Replace the stored data with a backup, backing up the current data first"""
+    # Read and verify everything before touching the store
+    data = load_backup(name)
+    create_backup()
+    if STORAGE_BACKEND == 'sqlite':
+        restore_sqlite_store(data)
     else:
-        time_str = expenditure_data['Time'].strftime('%H:%M:%S') if hasattr(expenditure_data['Time'], 'strftime') else str(expenditure_data['Time'])
-    
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(0, 6, f"Date: {date_str} {time_str}", 0, 1, 'L')
-    pdf.ln(5)
+        restore_journal_store(data)
+    invalidate_data_store()
+
+def backup_in_background():
+    """Run an automatic backup off the request thread"""
+    state = backup_state()
+    try:
+        create_backup()
+        prune_backups()
+    except Exception as e:
+        print(f"Error backing up data: {e}")
+    finally:
+        with state['lock']:
+            state['running'] = False
+
+def schedule_backup():
+    """Start an automatic backup if the last one is older than BACKUP_INTERVAL"""
+    state = backup_state()
+    with state['lock']:
+        if state['running']:
+            return
+        if state['last'] is None:
+            names = backup_names()
+            state['last'] = os.path.getmtime(os.path.join(BACKUP_DIR, f"{names[-1]}.json")) if names else 0
+        if time.time() - state['last'] < BACKUP_INTERVAL:
+            return
+        state['running'] = True
+        state['last'] = time.time()
+    threading.Thread(target=backup_in_background, daemon=True).start()
+
+# ==============================
+# CUSTOMER INDEX
+# ==============================
+# Customers are identified by canonical phone and CNIC keys, so +923001234567
+# and 0300-1234567 are the same person. Rows that share a phone or CNIC,
+# directly or through other rows, belong to one customer; rows with neither
+# are grouped by name. A customer's ID is derived from its first key (phones
+# before CNICs before names), so it only changes when a customer turns out to
+# be the same person as another one or gains a phone number.
+CUSTOMER_KEY_PRIORITY = {'phone': 0, 'cnic': 1, 'name': 2}
+CUSTOMER_INDEX_REBUILD_OPS = 1000  # larger writes (bulk imports) are regrouped in one vectorized pass
+
+def customer_key(value):
+    """Strip a free-text field, treating missing values as ''"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    return str(value).strip()
+
+def phone_key(phone):
+    """Canonical phone number: Pakistani numbers as 03XXXXXXXXX, anything else just its digits"""
+    digits = re.sub(r'\D', '', customer_key(phone))
+    if digits.startswith('0092'):
+        digits = digits[2:]
+    if digits.startswith('92') and len(digits) == 12:
+        return '0' + digits[2:]
+    if digits.startswith('3') and len(digits) == 10:
+        return '0' + digits
+    return digits
+
+def cnic_key(cnic):
+    """Canonical CNIC: its digits, whatever the formatting"""
+    return re.sub(r'\D', '', customer_key(cnic))
+
+def name_key(customer_name):
+    """Canonical name: case-folded with single spaces"""
+    return re.sub(r'\s+', ' ', customer_key(customer_name)).casefold()
+
+def text_series(values):
+    """A column as strings with missing values as ''"""
+    return values.astype('string').fillna('')
+
+def phone_keys(phones):
+    """Vectorized phone_key()"""
+    digits = text_series(phones).str.replace(r'\D', '', regex=True).str.replace(r'^0092', '92', regex=True)
+    digits = digits.mask(digits.str.startswith('92') & (digits.str.len() == 12), '0' + digits.str[2:])
+    return digits.mask(digits.str.startswith('3') & (digits.str.len() == 10), '0' + digits)
+
+def cnic_keys(cnics):
+    """Vectorized cnic_key()"""
+    return text_series(cnics).str.replace(r'\D', '', regex=True)
+
+def name_keys(names):
+    """Vectorized name_key()"""
+    return text_series(names).str.replace(r'\s+', ' ', regex=True).str.strip().str.casefold()
+
+def customer_keys(customer_name, phone, cnic):
+    """Identity keys of a row: its phone and CNIC, or its name if it has neither"""
+    keys = set()
+    if phone_key(phone):
+        keys.add('phone:' + phone_key(phone))
+    if cnic_key(cnic):
+        keys.add('cnic:' + cnic_key(cnic))
+    if not keys and name_key(customer_name):
+        keys.add('name:' + name_key(customer_name))
+    return keys
+
+def customer_key_columns(df):
+    """Vectorized customer_keys(): two key columns per row, '' where a row has fewer keys"""
+    phones = phone_keys(df['Phone'])
+    cnics = cnic_keys(df['CNIC'])
+    names = name_keys(df['Customer_Name'])
+    first = ('phone:' + phones).where(phones != '', ('name:' + names).where((cnics == '') & (names != ''), ''))
+    second = ('cnic:' + cnics).where(cnics != '', '')
+    return first, second
+
+def key_order(key):
+    """Sort order of identity keys; a customer's first key names it"""
+    kind, _, value = key.partition(':')
+    return (CUSTOMER_KEY_PRIORITY[kind], value)
+
+def customer_id(anchor):
+    """Stable customer ID derived from a customer's first key"""
+    return 'CUS-' + hashlib.sha1(anchor.encode('utf-8')).hexdigest()[:10].upper()
+
+def amount_value(value):
+    """Treat missing amounts as zero, like DataFrame.sum() does"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return 0
+    return value
+
+def new_customer_entry(anchor):
+    """Empty aggregates of a customer"""
+    return {
+        'anchor': anchor,
+        'keys': set(),
+        'names': set(),
+        'total_amount': 0,
+        'total_paid': 0,
+        'total_left': 0,
+        'payments': 0,
+        'advance': 0,
+        'rows': []          # positions of the customer's rows in the transactions table
+    }
+
+def merge_customers(index, keys):
+    """Join keys into one customer, merging every customer that already has one of them; returns its ID"""
+    customers = index['customers']
+    ids = {index['keys'][key] for key in keys if key in index['keys']}
+    new_keys = [key for key in keys if key not in index['keys']]
+    if len(ids) == 1 and not new_keys:
+        return next(iter(ids))
+    anchor = min([customers[old_id]['anchor'] for old_id in ids] + new_keys, key=key_order)
+    new_id = customer_id(anchor)
+    
+    # Fold the other customers into the one that keeps its ID, or else the one
+    # with the most rows, so only the smaller side has to be re-pointed
+    old_entries = {old_id: customers.pop(old_id) for old_id in ids}
+    if new_id in old_entries:
+        base_id = new_id
+    else:
+        base_id = max(old_entries, key=lambda old_id: len(old_entries[old_id]['rows']), default=None)
+    merged = old_entries.pop(base_id) if base_id is not None else new_customer_entry(anchor)
+    moved = list(old_entries.items())
+    if base_id is not None and base_id != new_id:
+        moved.append((base_id, merged))
+    for old in old_entries.values():
+        for field in ('total_amount', 'total_paid', 'total_left', 'payments', 'advance'):
+            merged[field] += old[field]
+        merged['names'] |= old['names']
+        merged['keys'] |= old['keys']
+        merged['rows'].extend(old['rows'])
+    if old_entries:
+        merged['rows'].sort()
+    merged['anchor'] = anchor
+    merged['keys'].update(new_keys)
+    customers[new_id] = merged
+    
+    for key in new_keys:
+        index['keys'][key] = new_id
+    for old_id, old in moved:
+        for key in old['keys']:
+            index['keys'][key] = new_id
+        for name in old['names']:
+            index['names'][name_key(name)].discard(old_id)
+            index['names'][name_key(name)].add(new_id)
+    return new_id
+
+def add_customer_name(index, customer, customer_name):
+    """Record a name the customer was entered under, for lookups by name"""
+    if name_key(customer_name):
+        index['customers'][customer]['names'].add(customer_key(customer_name))
+        index['names'].setdefault(name_key(customer_name), set()).add(customer)
+
+def index_transaction(index, position, row):
+    """Add a transactions row to its customer's aggregates"""
+    keys = customer_keys(row.get('Customer_Name'), row.get('Phone'), row.get('CNIC'))
+    if not keys:
+        return
+    customer = merge_customers(index, keys)
+    add_customer_name(index, customer, row.get('Customer_Name'))
+    entry = index['customers'][customer]
+    entry['total_amount'] += amount_value(row.get('Selling_Price'))
+    entry['total_paid'] += amount_value(row.get('Paid_Amount'))
+    entry['total_left'] += amount_value(row.get('Left_Amount'))
+    entry['rows'].append(position)
+
+def index_payment(index, row):
+    """Add a payments row to its customer's aggregates"""
+    keys = customer_keys(row.get('Customer_Name'), row.get('Phone'), row.get('CNIC'))
+    if not keys:
+        return
+    customer = merge_customers(index, keys)
+    add_customer_name(index, customer, row.get('Customer_Name'))
+    index['customers'][customer]['payments'] += amount_value(row.get('Amount'))
+
+def index_advance(index, customer_name, phone, cnic, amount):
+    """Add an advance amount to the aggregates of the customer of a customer_advances row"""
+    keys = customer_keys(customer_name, phone, cnic)
+    if not keys:
+        return
+    customer = merge_customers(index, keys)
+    add_customer_name(index, customer, customer_name)
+    index['customers'][customer]['advance'] += amount_value(amount)
+
+def customer_anchors(first, second):
+    """Vectorized merge_customers(): the first key of each row's customer, '' for rows without keys.
     
-    # Expenditure details
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 8, "EXPENDITURE DETAILS", 0, 1, 'L')
-    pdf.set_font("Arial", '', 10)
+    Rows and keys form a graph; every key starts labelled with its own sort
+    position and labels are lowered across rows until each connected group
+    carries the position of its first key.
+    """
+    rows = np.concatenate([np.flatnonzero(first != ''), np.flatnonzero(second != '')])
+    edge_keys = pd.concat([first[first != ''], second[second != '']], ignore_index=True)
+    if edge_keys.empty:
+        return pd.Series('', index=first.index)
+    
+    ordered = sorted(edge_keys.unique(), key=key_order)
+    codes = pd.Categorical(edge_keys, categories=ordered).codes
+    labels = np.arange(len(ordered))
+    while True:
+        row_labels = np.full(len(first), len(ordered))
+        np.minimum.at(row_labels, rows, labels[codes])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, codes, row_labels[rows])
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    
+    anchors = np.append(np.array(ordered, dtype=object), '')
+    return pd.Series(anchors[row_labels], index=first.index)
+
+def build_customer_index(data):
+    """Group the whole history into customers and aggregate their balances, vectorized"""
+    columns = ['Customer_Name', 'Phone', 'CNIC']
+    tables = [
+        data['transactions'].reindex(columns=columns + ['Selling_Price', 'Paid_Amount', 'Left_Amount']),
+        data['payments'].reindex(columns=columns + ['Amount']),
+        data['customer_advances'].reindex(columns=columns + ['Advance_Balance'])
+    ]
+    rows = pd.concat(
+        [df.assign(Table=number, Position=np.arange(len(df))) for number, df in enumerate(tables)],
+        ignore_index=True
+    )
+    first, second = customer_key_columns(rows)
+    rows['Anchor'] = customer_anchors(first, second)
+    rows['Key_1'], rows['Key_2'], rows['Name'] = first, second, text_series(rows['Customer_Name']).str.strip()
+    rows = rows[rows['Anchor'] != '']
+    
+    anchors = rows['Anchor'].unique()
+    ids = dict(zip(anchors, (customer_id(anchor) for anchor in anchors)))
+    rows = rows.assign(Customer_ID=rows['Anchor'].map(ids))
+    index = {'keys': {}, 'names': {}, 'customers': {ids[anchor]: new_customer_entry(anchor) for anchor in anchors}}
+    customers = index['customers']
+    
+    for key_column in ('Key_1', 'Key_2'):
+        keyed = rows[rows[key_column] != '']
+        index['keys'].update(zip(keyed[key_column], keyed['Customer_ID']))
+        for customer, keys in keyed.groupby('Customer_ID')[key_column].unique().items():
+            customers[customer]['keys'].update(keys)
+    
+    named = rows[rows['Name'] != '']
+    for customer, names in named.groupby('Customer_ID')['Name'].unique().items():
+        customers[customer]['names'].update(names)
+    for key, group in named.assign(Name_Key=name_keys(named['Name'])).groupby('Name_Key')['Customer_ID'].unique().items():
+        index['names'][key] = set(group)
+    
+    transactions = rows[rows['Table'] == 0]
+    totals = transactions.groupby('Customer_ID')[['Selling_Price', 'Paid_Amount', 'Left_Amount']].sum()
+    for customer, total_amount, total_paid, total_left in totals.itertuples(name=None):
+        customers[customer].update(total_amount=total_amount, total_paid=total_paid, total_left=total_left)
+    for customer, positions in transactions.groupby('Customer_ID')['Position'].agg(list).items():
+        customers[customer]['rows'] = positions
+    for customer, amount in rows[rows['Table'] == 1].groupby('Customer_ID')['Amount'].sum().items():
+        customers[customer]['payments'] = amount
+    for customer, amount in rows[rows['Table'] == 2].groupby('Customer_ID')['Advance_Balance'].sum().items():
+        customers[customer]['advance'] = amount
+    
+    return index
+
+def update_customer_index(index, change):
+    """Apply the operations of a journal entry to the customer index"""
+    entry = change['entry']
+    if len(entry['ops']) > CUSTOMER_INDEX_REBUILD_OPS:
+        return False
+    position = change['positions']['transactions']
+    advances = change['old_advances']
+    
+    for op in entry['ops']:
+        if op['op'] == 'append':
+            if op['table'] == 'transactions':
+                index_transaction(index, position, op['row'])
+                position += 1
+            elif op['table'] == 'payments':
+                index_payment(index, op['row'])
+        elif op['op'] == 'advance':
+            # Same matching rule as apply_customer_advance(); every matched row
+            # belongs to the one customer the keys were resolved to
+            matches = advance_rows_match(advances, op.get('keys') or customer_keys(op['customer_name'], op['phone'], op['cnic']))
+            if matches:
+                row = advances.iloc[matches[0]]
+                index_advance(index, row['Customer_Name'], row['Phone'], row['CNIC'], op['amount'])
+            else:
+                index_advance(index, op['customer_name'], op['phone'], op['cnic'], op['amount'])
+            advances = apply_customer_advance(advances, op['customer_name'], op['phone'], op['cnic'], op['amount'], op.get('keys'))
     
-    pdf.cell(50, 6, "Category:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{expenditure_data['Category']}", 0, 1, 'L')
+    # Row positions are only valid if no rows were dropped while normalizing
+    return rows_kept(change, 'transactions')
+
+STORE_INDEXES['customers'] = (build_customer_index, update_customer_index)
+
+def find_customers(identifier):
+    """IDs of the customers an ID, phone, CNIC or name refers to"""
+    index, _ = store_index('customers')
+    identifier = customer_key(identifier)
+    if identifier in index['customers']:
+        return [identifier]
+    
+    found = set(index['names'].get(name_key(identifier), ()))
+    for key in ('phone:' + phone_key(identifier), 'cnic:' + cnic_key(identifier)):
+        if key in index['keys']:
+            found.add(index['keys'][key])
+    return sorted(found)
+
+def customer_identity_keys(customer_name, phone, cnic):
+    """Every identity key of the customer a name, phone and CNIC belong to, as the customers index knows them"""
+    keys = customer_keys(customer_name, phone, cnic)
+    index, _ = store_index('customers')
+    for customer in {index['keys'][key] for key in keys if key in index['keys']}:
+        keys |= index['customers'][customer]['keys']
+    return keys
+
+def customer_master(customers=None):
+    """One row per customer with the names, phones and CNICs it was entered under.
     
-    pdf.cell(50, 6, "Amount:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{expenditure_data['Amount']:,.0f} PKR", 0, 1, 'L')
+    customers, if given, lists the IDs to include, in order; otherwise every
+    customer is included.
+    """
+    index, _ = store_index('customers')
+    if customers is None:
+        customers = list(index['customers'])
+    rows = []
+    for customer in customers:
+        entry = index['customers'].get(customer)
+        if entry is None:
+            continue
+        keys = sorted(entry['keys'], key=key_order)
+        totals = customer_totals([entry])
+        rows.append({
+            'Customer_ID': customer,
+            'Customer_Name': ' / '.join(sorted(entry['names'])),
+            'Phone': ', '.join(key[len('phone:'):] for key in keys if key.startswith('phone:')),
+            'CNIC': ', '.join(format_cnic(key[len('cnic:'):]) for key in keys if key.startswith('cnic:')),
+            'Transactions': len(entry['rows']),
+            'Total_Sales': entry['total_amount'],
+            'Balance_Due': totals['total_left'],
+            'Advance_Balance': totals['advance_balance']
+        })
+    return pd.DataFrame(rows, columns=[
+        'Customer_ID', 'Customer_Name', 'Phone', 'CNIC', 'Transactions', 'Total_Sales', 'Balance_Due', 'Advance_Balance'
+    ])
+
+def customers_csv(customers):
+    """CSV of the customer master rows of some customers, built when the download button is clicked"""
+    return frame_csv(customer_master(customers))
+
+# ==============================
+# INVENTORY
+# ==============================
+# Stock-in records are rows of the 'stock' table; sales are never written to
+# it. The 'stock' index keeps, per IMEI, the stock row and the sale it went
+# out with, and per SKU the quantity stocked minus the quantity sold. Both
+# are brought forward op by op as rows are appended, so lookups and the
+# duplicate-sale check are dictionary reads. The forms check early for a
+# friendly message; the storage writers check again under their write lock,
+# which is what stops two sessions or processes selling one IMEI.
+IMEI_PATTERN = re.compile(r'\d{14,16}')
+STOCK_CATEGORIES = ['Mobile', 'Accessories']
+
+def imei_numbers(value):
+    """IMEIs in a free-text IMEI field (a dual-SIM handset has two)"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return []
+    return IMEI_PATTERN.findall(str(value))
+
+def sale_imeis(row):
+    """IMEIs a transaction row sells: those of a mobile or accessory sale"""
+    if row.get('Type') != 'Sale' or row.get('Category') not in STOCK_CATEGORIES:
+        return []
+    return imei_numbers(row.get('IMEI'))
+
+def stock_sku(category, brand, model, color, storage, item):
+    """Stock-keeping unit of a stock or sale row: handsets by brand/model/color/storage, accessories by item/brand/model"""
+    if category == 'Mobile':
+        parts = (brand, model, color, storage)
+    else:
+        parts = (item, brand, model)
+    return (metric_key(category),) + tuple(customer_key(part).lower() for part in parts)
+
+def stock_entry(index, sku):
+    """Return the counters of a SKU, creating them if needed"""
+    if sku not in index['skus']:
+        index['skus'][sku] = {'label': None, 'stocked': 0, 'sold': 0}
+    return index['skus'][sku]
+
+def index_stock_row(index, position, row):
+    """Add a stock-in row to the inventory index"""
+    category = row.get('Category')
+    entry = stock_entry(index, stock_sku(
+        category, row.get('Brand'), row.get('Model'), row.get('Color'), row.get('Storage'), row.get('Item')
+    ))
+    if entry['label'] is None:
+        parts = [row.get('Item')] if category != 'Mobile' else [row.get('Brand'), row.get('Model'), row.get('Color'), row.get('Storage')]
+        entry['label'] = ' '.join(customer_key(part) for part in parts if customer_key(part))
+    entry['stocked'] += int(amount_value(row.get('Quantity')) or 0)
+    for imei in imei_numbers(row.get('IMEI')):
+        index['imeis'].setdefault(imei, {'stock': None, 'sold': None})['stock'] = position
+
+def index_sale_row(index, position, row):
+    """Count a sale against its SKU and mark its IMEIs as sold"""
+    if row.get('Type') != 'Sale' or row.get('Category') not in STOCK_CATEGORIES:
+        return
+    entry = stock_entry(index, stock_sku(
+        row.get('Category'), row.get('Brand'), row.get('Model'), row.get('Color'), row.get('Storage'), row.get('Item')
+    ))
+    entry['sold'] += int(amount_value(row.get('Quantity')) or 0)
+    for imei in imei_numbers(row.get('IMEI')):
+        imei_entry = index['imeis'].setdefault(imei, {'stock': None, 'sold': None})
+        if imei_entry['sold'] is None:
+            imei_entry['sold'] = position
+
+def build_stock_index(data):
+    """Index stock-in rows and sales by IMEI and SKU"""
+    index = {'imeis': {}, 'skus': {}}
     
-    pdf.ln(5)
+    columns = ['Category', 'Brand', 'Model', 'Color', 'Storage', 'Item', 'IMEI', 'Quantity']
+    stock = data['stock'].reindex(columns=columns)
+    for position, values in enumerate(stock.itertuples(index=False, name=None)):
+        index_stock_row(index, position, dict(zip(columns, values)))
     
-    pdf.cell(50, 6, "Description:", 0, 0, 'L')
-    pdf.multi_cell(0, 6, f"{expenditure_data['Description']}")
+    columns = ['Type'] + columns
+    transactions = data['transactions'].reindex(columns=columns)
+    for position, values in enumerate(transactions.itertuples(index=False, name=None)):
+        index_sale_row(index, position, dict(zip(columns, values)))
     
-    pdf.ln(10)
+    return index
+
+def update_stock_index(index, change):
+    """Apply the rows of a journal entry to the inventory index"""
+    positions = {table: change['positions'][table] for table in ('stock', 'transactions')}
+    for op in change['entry']['ops']:
+        if op['op'] != 'append' or op['table'] not in positions:
+            continue
+        if op['table'] == 'stock':
+            index_stock_row(index, positions['stock'], op['row'])
+        else:
+            index_sale_row(index, positions['transactions'], op['row'])
+        positions[op['table']] += 1
     
-    # Footer
-    pdf.set_font("Arial", 'I', 10)
-    pdf.cell(0, 6, "Expenditure recorded by AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI", 0, 1, 'C')
+    # Row positions are only valid if no rows were dropped while normalizing
+    return all(rows_kept(change, table) for table in positions)
+
+STORE_INDEXES['stock'] = (build_stock_index, update_stock_index)
+
+def find_imei(imei):
+    """Stock row and sale of an IMEI (each None if there is none)"""
+    index, view = store_index('stock')
+    entry = index['imeis'].get(imei)
+    if entry is None:
+        return {'stock': None, 'sold': None}
+    return {
+        'stock': None if entry['stock'] is None else store_rows(view, 'stock', [entry['stock']]).iloc[0].to_dict(),
+        'sold': None if entry['sold'] is None else store_rows(view, 'transactions', [entry['sold']]).iloc[0].to_dict()
+    }
+
+def sold_imeis(imeis):
+    """The IMEIs among the given ones that were already sold, with their sales"""
+    index, view = store_index('stock')
+    sold = {}
+    for imei in imeis:
+        entry = index['imeis'].get(imei)
+        if entry is not None and entry['sold'] is not None:
+            sold[imei] = store_rows(view, 'transactions', [entry['sold']]).iloc[0].to_dict()
+    return sold
+
+def stocked_imeis(imeis):
+    """The IMEIs among the given ones that already have a stock-in record"""
+    index, _ = store_index('stock')
+    return [imei for imei in imeis if index['imeis'].get(imei, {}).get('stock') is not None]
+
+def stock_on_hand(category, brand, model, color, storage, item):
+    """Quantity in stock of a SKU, or None if it was never stocked"""
+    index, _ = store_index('stock')
+    entry = index['skus'].get(stock_sku(category, brand, model, color, storage, item))
+    if entry is None or not entry['stocked']:
+        return None
+    return entry['stocked'] - entry['sold']
+
+def stock_summary():
+    """Stocked, sold and on-hand quantities of every SKU that has stock-in records"""
+    index, _ = store_index('stock')
+    rows = [
+        {
+            'Category': sku[0],
+            'Item': entry['label'],
+            'Stocked': entry['stocked'],
+            'Sold': entry['sold'],
+            'In Stock': entry['stocked'] - entry['sold']
+        }
+        for sku, entry in list(index['skus'].items()) if entry['stocked']
+    ]
+    return pd.DataFrame(rows, columns=['Category', 'Item', 'Stocked', 'Sold', 'In Stock'])
+
+def check_sale_stock(category, brand, model, color, storage, item, quantity, imei=''):
+    """Validate a sale against the inventory; returns (error, warning), either may be None"""
+    sold = sold_imeis(imei_numbers(imei))
+    if sold:
+        imei, sale = next(iter(sold.items()))
+        return f"IMEI {imei} was already sold ({sale['Transaction_ID']}, {pd.Timestamp(sale['Date']).strftime('%Y-%m-%d')}).", None
+    on_hand = stock_on_hand(category, brand, model, color, storage, item)
+    if on_hand is not None and on_hand < quantity:
+        return None, f"Only {max(on_hand, 0)} of this item recorded in stock."
+    return None, None
+
+def check_unsold_imeis(ops, find_sold=sold_imeis):
+    """Raise ValueError if the sales among a write's operations would sell an IMEI twice.
     
-    return pdf.output(dest='S').encode('latin1')
+    Must be called with the storage write lock held, after find_sold (by
+    default the shared store) has caught up with every earlier write.
+    """
+    imeis = [
+        imei for op in ops
+        if op['op'] == 'append' and op['table'] == 'transactions'
+        for imei in sale_imeis(op['row'])
+    ]
+    if not imeis:
+        return
+    sold = find_sold(imeis)
+    if sold:
+        imei, sale = next(iter(sold.items()))
+        raise ValueError(f"IMEI {imei} was already sold ({sale['Transaction_ID']}, {pd.Timestamp(sale['Date']).strftime('%Y-%m-%d')}).")
+    repeated = next((imei for imei, count in Counter(imeis).items() if count > 1), None)
+    if repeated:
+        raise ValueError(f"IMEI {repeated} is in more than one sale.")
 
-def create_payment_pdf(payment_data):
-    """Create a PDF for payment record"""
-    pdf = FPDF()
-    pdf.add_page()
+# ==============================
+# DATE INDEX
+# ==============================
+# Rows stay in the order they were written (the other indexes address them by
+# position), so each dated table gets its date order here instead: the sorted
+# timestamps and the row positions they belong to. A date range is then two
+# binary searches and a slice of row positions.
+def date_bounds(dates, start=None, end=None):
+    """Positions in a sorted datetime64 array covering two dates (inclusive); None means unbounded"""
+    lo = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start), 'ns'), side='left')
+    hi = len(dates) if end is None else np.searchsorted(
+        dates, np.datetime64(pd.Timestamp(end) + pd.Timedelta(days=1), 'ns'), side='left'
+    )
+    return lo, max(lo, hi)
+
+def table_dates(df):
+    """Date column of a table as a datetime64[ns] array"""
+    if df.empty or 'Date' not in df.columns:
+        return np.array([], dtype='datetime64[ns]')
+    return df['Date'].to_numpy(dtype='datetime64[ns]')
+
+def build_date_index(data):
+    """Sort the rows of every dated table by date"""
+    index = {}
+    for table in PARTITIONED_TABLES:
+        dates = table_dates(data[table])
+        order = np.argsort(dates, kind='stable')
+        index[table] = {'dates': dates[order], 'order': order}
+    return index
+
+def update_date_index(index, change):
+    """Extend the date order with appended rows, as long as they are not older than the indexed ones"""
+    for table in PARTITIONED_TABLES:
+        if not rows_kept(change, table):
+            # Rows were dropped while normalizing, positions have shifted
+            return False
+        if table not in change['rows'] or change['rows'][table].empty:
+            continue
+        position = change['positions'][table]
+        dates = table_dates(change['rows'][table])
+        current = index[table]
+        if (dates[1:] < dates[:-1]).any() or (len(current['dates']) and dates[0] < current['dates'][-1]):
+            # A back-dated row: cheaper to sort again than to insert into the middle
+            return False
+        index[table] = {
+            'dates': np.concatenate([current['dates'], dates]),
+            'order': np.concatenate([current['order'], np.arange(position, position + len(dates))])
+        }
+    return True
+
+STORE_INDEXES['dates'] = (build_date_index, update_date_index)
+
+def newest_first(table, df, mask=None):
+    """Positions of a dated table's rows, newest first; only the rows where mask is True if given"""
+    index, (data, _) = store_index('dates')
+    if data[table] is df:
+        order = index[table]['order']
+        if len(order) > len(df):
+            # Leave out rows still pending or written since df was read
+            order = order[order < len(df)]
+        order = order[::-1]
+    else:
+        # df comes from another generation of the data than the index
+        order = np.argsort(table_dates(df), kind='stable')[::-1]
+    return order if mask is None else order[mask[order]]
+
+def date_slice(table, start=None, end=None):
+    """Rows of a dated table between two dates (inclusive), oldest first; None means unbounded"""
+    index, view = store_index('dates')
+    lo, hi = date_bounds(index[table]['dates'], start, end)
+    return store_rows(view, table, index[table]['order'][lo:hi])
+
+# ==============================
+# DASHBOARD METRICS
+# ==============================
+def metric_key(value):
+    """Use None for missing categories/types so they work as dict keys"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value
+
+def metric_day(value):
+    """Calendar day of a Date value, or None if it is not a valid date"""
+    day = pd.to_datetime(value, errors='coerce')
+    return None if pd.isna(day) else day.date()
+
+def add_day(metrics, day):
+    """Keep the sorted list of days that have rollups"""
+    position = bisect.bisect_left(metrics['days'], day)
+    if position == len(metrics['days']) or metrics['days'][position] != day:
+        metrics['days'].insert(position, day)
+
+def add_sales_rollup(metrics, day, category, type_, selling, profit, left):
+    """Add one transaction's amounts to its (day, category, type) rollup"""
+    add_day(metrics, day)
+    rollups = metrics['sales'].setdefault(day, {})
+    key = (metric_key(category), metric_key(type_))
+    if key not in rollups:
+        rollups[key] = {'selling': 0, 'profit': 0, 'left': 0}
+    rollup = rollups[key]
+    rollup['selling'] += amount_value(selling)
+    rollup['profit'] += amount_value(profit)
+    rollup['left'] += amount_value(left)
+
+def add_expenditure_rollup(metrics, day, amount):
+    """Add one expenditure to its day's total"""
+    add_day(metrics, day)
+    metrics['expenditures'][day] = metrics['expenditures'].get(day, 0) + amount_value(amount)
+
+def build_metrics_index(data):
+    """Roll transactions up per day/category/type and expenditures per day.
     
-    # Header
-    pdf.set_font("Arial", 'B', 16)
-    pdf.set_text_color(74, 20, 140)
-    pdf.cell(0, 10, "AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI", 0, 1, 'C')
+    Rollups are keyed by day, with the days kept sorted so that a period is a
+    binary-searched slice of 'days'.
+    """
+    metrics = {'days': [], 'sales': {}, 'expenditures': {}}
     
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(0, 6, "Main Market, Loralai, Pakistan", 0, 1, 'C')
-    pdf.cell(0, 6, "+92 300 1234567", 0, 1, 'C')
+    transactions = data['transactions']
+    if not transactions.empty:
+        # Amounts are float64 and Category/Type categoricals (see enforce_schema)
+        amounts = transactions[['Selling_Price', 'Profit', 'Left_Amount']]
+        grouped = amounts.groupby(
+            [transactions['Date'].dt.normalize(), transactions['Category'], transactions['Type']], dropna=False, observed=True
+        ).sum()
+        for (day, category, type_), (selling, profit, left) in zip(grouped.index, grouped.itertuples(index=False, name=None)):
+            add_sales_rollup(metrics, day.date(), category, type_, selling, profit, left)
+    
+    expenditures = data['expenditures']
+    if not expenditures.empty:
+        grouped = expenditures['Amount'].groupby(expenditures['Date'].dt.normalize()).sum()
+        for day, amount in grouped.items():
+            add_expenditure_rollup(metrics, day.date(), amount)
+    
+    return metrics
+
+def update_metrics_index(metrics, change):
+    """Add the rows of a journal entry to the rollups"""
+    for op in change['entry']['ops']:
+        if op['op'] != 'append':
+            continue
+        row = op['row']
+        day = metric_day(row.get('Date'))
+        if day is None:
+            # normalize_dates() drops rows without a valid date
+            continue
+        if op['table'] == 'transactions':
+            add_sales_rollup(
+                metrics, day, row.get('Category'), row.get('Type'),
+                row.get('Selling_Price'), row.get('Profit'), row.get('Left_Amount')
+            )
+        elif op['table'] == 'expenditures':
+            add_expenditure_rollup(metrics, day, row.get('Amount'))
+    return True
+
+STORE_INDEXES['metrics'] = (build_metrics_index, update_metrics_index)
+
+def day_window(days, start, end):
+    """Slice of a sorted list of days between two dates (inclusive); None means unbounded"""
+    lo = 0 if start is None else bisect.bisect_left(days, start)
+    hi = len(days) if end is None else bisect.bisect_right(days, end)
+    return days[lo:hi]
+
+def metric_totals(start=None, end=None):
+    """Sum the rollups between two dates (inclusive); None means unbounded"""
+    metrics, _ = store_index('metrics')
+    totals = {
+        'sales': 0,          # Selling_Price of Type == 'Sale'
+        'selling': 0,        # Selling_Price of every transaction
+        'profit': 0,
+        'left': 0,
+        'expenditure': 0,
+        'category_sales': {}
+    }
+    for day in day_window(metrics['days'], start, end):
+        for (category, type_), rollup in list(metrics['sales'].get(day, {}).items()):
+            if type_ == 'Sale':
+                totals['sales'] += rollup['selling']
+            totals['selling'] += rollup['selling']
+            totals['profit'] += rollup['profit']
+            totals['left'] += rollup['left']
+            totals['category_sales'][category] = totals['category_sales'].get(category, 0) + rollup['selling']
+        totals['expenditure'] += metrics['expenditures'].get(day, 0)
+    return totals
+
+def daily_profit_series():
+    """Profit per day, as plotted on the dashboard"""
+    metrics, _ = store_index('metrics')
+    daily = {}
+    for day in list(metrics['days']):
+        rollups = metrics['sales'].get(day)
+        if rollups:
+            daily[day] = sum(rollup['profit'] for rollup in list(rollups.values()))
+    return pd.Series(daily, name='Profit').sort_index()
+
+def frame_csv(df, order=None):
+    """CSV bytes of a table (only the rows at positions order, if given), for download buttons that build it on click"""
+    if order is not None:
+        df = df.iloc[order]
+    return df.to_csv(index=False).encode('utf-8')
+
+def table_csv(table):
+    """CSV of a whole table, read when the download button is clicked"""
+    data, _ = get_data()
+    return frame_csv(data[table])
+
+def period_transactions_csv(period):
+    """CSV of the transactions in a report period"""
+    start, end, _ = period_range(period, datetime.now().date())
+    return frame_csv(read_table_range('transactions', start, end))
+
+def period_range(period, today):
+    """Start date, end date and description of a report period"""
+    if period == 'daily':
+        return today, today, f"for {today.strftime('%Y-%m-%d')}"
+    elif period == 'weekly':
+        start_of_week = today - timedelta(days=today.weekday())
+        end_of_week = start_of_week + timedelta(days=6)
+        return start_of_week, end_of_week, f"for week {start_of_week.strftime('%Y-%m-%d')} to {end_of_week.strftime('%Y-%m-%d')}"
+    elif period == 'monthly':
+        start_of_month = today.replace(day=1)
+        end_of_month = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+        return start_of_month, end_of_month, f"for {today.strftime('%B %Y')}"
+    elif period == 'yearly':
+        start_of_year = today.replace(month=1, day=1)
+        end_of_year = today.replace(month=12, day=31)
+        return start_of_year, end_of_year, f"for year {today.year}"
+    # All time
+    return None, None, "for all time"
+
+# ==============================
+# SEARCH
+# ==============================
+# Each row is indexed as one lower-cased string: for every column a separator,
+# a tag identifying the column, then the value. Both are private-use characters
+# that cannot be typed into a search box, so plain terms only match values and
+# "field:value" terms can be anchored to their column.
+SEARCH_SEPARATOR = '\ue000'
+
+# Short names accepted before ':' in addition to the lower-cased column names
+SEARCH_FIELD_ALIASES = {
+    'name': 'Customer_Name',
+    'customer': 'Customer_Name',
+    'id': 'Transaction_ID',
+    'txn': 'Transaction_ID',
+    'price': 'Selling_Price',
+    'paid': 'Paid_Amount',
+    'left': 'Left_Amount',
+    'balance': 'Advance_Balance',
+    'desc': 'Description',
+    'payment': 'Payment_Type'
+}
+
+def search_tag(table, column):
+    """Private-use character tagging a column in the search strings"""
+    return chr(0xE001 + TABLE_COLUMNS[table].index(column))
+
+def search_text(value):
+    """Lower-cased text of a single value"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    if isinstance(value, (date, datetime, pd.Timestamp)):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, float) and value.is_integer():
+        # Whole amounts read as "1500", whether stored as int or float64
+        return str(int(value))
+    return str(value).lower()
+
+def search_row_text(table, row):
+    """Search string of one row given as a dict"""
+    return ''.join(
+        SEARCH_SEPARATOR + search_tag(table, column) + search_text(row.get(column))
+        for column in TABLE_COLUMNS[table]
+    )
+
+def search_table_text(table, df):
+    """Search strings of a whole table, built column by column"""
+    text = np.full(len(df), '', dtype=object)
+    for column in TABLE_COLUMNS[table]:
+        if column not in df.columns:
+            values = ''
+        elif column == 'Date' and pd.api.types.is_datetime64_any_dtype(df[column]):
+            values = df[column].dt.strftime('%Y-%m-%d').fillna('').to_numpy(dtype=object)
+        elif pd.api.types.is_float_dtype(df[column]):
+            values = df[column].map(search_text, na_action='ignore').fillna('').to_numpy(dtype=object)
+        else:
+            values = df[column].astype(str).str.lower().where(df[column].notna(), '').to_numpy(dtype=object)
+        text = text + (SEARCH_SEPARATOR + search_tag(table, column)) + values
+    return text.tolist()
+
+def build_search_index(data):
+    """Search strings for every table"""
+    return {table: {'text': search_table_text(table, df), 'series': None} for table, df in data.items()}
+
+def update_search_index(index, change):
+    """Add the search strings of newly written rows"""
+    advances_changed = False
+    for op in change['entry']['ops']:
+        if op['op'] == 'append':
+            index[op['table']]['text'].append(search_row_text(op['table'], op['row']))
+            index[op['table']]['series'] = None
+        elif op['op'] == 'advance':
+            advances_changed = True
+    
+    if advances_changed:
+        # Balances change in place; the advances table is small, so re-index it
+        index['customer_advances'] = {
+            'text': search_table_text('customer_advances', change['advances']),
+            'series': None
+        }
     
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(0, 10, "PAYMENT RECEIPT", 0, 1, 'C')
-    pdf.ln(5)
+    return all(rows_kept(change, table) for table in TABLE_COLUMNS)
+
+STORE_INDEXES['search'] = (build_search_index, update_search_index)
+
+def parse_search_query(table, query):
+    """Split a query into plain terms and (column, value) terms, e.g. 'phone:0300 samsung'"""
+    columns = {column.lower(): column for column in TABLE_COLUMNS[table]}
+    terms = []
+    field_terms = []
+    for token in query.lower().split():
+        field, _, value = token.partition(':')
+        column = columns.get(field) or SEARCH_FIELD_ALIASES.get(field)
+        if value and column in TABLE_COLUMNS[table]:
+            field_terms.append((column, value))
+        else:
+            terms.append(token)
+    return terms, field_terms
+
+def search_rows(table, query):
+    """Return a table and the boolean mask of its rows matching every term of the query"""
+    data, _ = get_data()
+    df = data[table]
+    index, _ = store_index('search')
+    table_index = index[table]
+    
+    text = table_index['series']
+    if text is None or len(text) != len(table_index['text']):
+        text = pd.Series(table_index['text'], dtype=object)
+        table_index['series'] = text
+    # Rows added after this copy of the data was taken are not in it yet
+    text = text.iloc[:len(df)]
+    
+    mask = pd.Series(True, index=text.index)
+    terms, field_terms = parse_search_query(table, query)
+    for term in terms:
+        mask &= text.str.contains(term, regex=False)
+    for column, value in field_terms:
+        pattern = re.escape(SEARCH_SEPARATOR + search_tag(table, column)) + f'[^{SEARCH_SEPARATOR}]*' + re.escape(value)
+        mask &= text.str.contains(pattern, regex=True)
+    
+    return df, mask.to_numpy()
+
+def search_table(table, query):
+    """Return the rows of a table matching every term of the query"""
+    df, mask = search_rows(table, query)
+    return df[mask]
+
+# ==============================
+# SHOP INFORMATION
+# ==============================
+def shop_info_container():
+    st.markdown("""
+    <div class="shop-info">
+        <h2 style="color: #a442f5; margin-bottom: 0.5rem;">AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI</h2>
+        <p style="margin-bottom: 0.2rem; color: #8c8c8c;">Premium Mobile & Accessories Shop</p>
+        <p style="margin-bottom: 0.2rem;"><strong>Proprietor:</strong> Ahsan khan </p>
+        <p style="margin-bottom: 0.2rem;"><strong>Contact>:</strong> 03363617334</p>
+        <p style="margin-bottom: 0.2rem;"><strong>Contact>:</strong> 03708635099</p>
+        <p style="margin-bottom: 0;"><strong>Address:</strong> Jama Market, Loralai, Balochitan </p>
+    </div>
+    """, unsafe_allow_html=True)
+
+def page_fragment(page):
+    """Run a page as a fragment, so its widgets rerun only the page rather than the whole app"""
+    @st.fragment
+    @wraps(page)
+    def fragment():
+        # Main only loads data on full reruns; pick up other sessions' writes here
+        load_data()
+        page()
+        if st.session_state.page in SALE_PAGES:
+            # Part of the fragment so it appears as soon as the page saves a sale
+            transaction_receipt()
+    return fragment
+
+def transaction_receipt():
+    """Show the receipt of the transaction this session just saved, if any"""
+    st.markdown("---")
     
-    # Date and time
-    if isinstance(payment_data['Date'], str):
-        date_str = payment_data['Date']
-    else:
-        date_str = payment_data['Date'].strftime('%Y-%m-%d') if hasattr(payment_data['Date'], 'strftime') else str(payment_data['Date'])
+    if st.session_state.get('last_transaction'):
+        st.subheader("Transaction Receipt")
+        receipt_data = st.session_state.last_transaction
+        st.markdown(generate_receipt(receipt_data), unsafe_allow_html=True)
+        
+        pdf_download_button(
+            "📄 Download PDF Receipt",
+            create_receipt_pdf,
+            receipt_data,
+            f"receipt_{receipt_data['Transaction_ID']}.pdf"
+        )
+        print_receipt_button('receipt', receipt_data, "print_last_receipt")
+
+# ==============================
+# HELPER FUNCTIONS
+# ==============================
+@st.cache_resource
+def sequence_lock():
+    """Process-wide lock around the transaction ID counter"""
+    return threading.Lock()
+
+def max_transaction_number(transactions):
+    """Highest numeric part of the TXN-##### IDs in a transactions table"""
+    if transactions.empty or 'Transaction_ID' not in transactions.columns:
+        return 0
+    nums = transactions['Transaction_ID'].astype('string').str.extract(r'^TXN-(\d+)$')[0].dropna()
+    return int(nums.astype('int64').max()) if not nums.empty else 0
+
+def read_sequence():
+    """Read the last allocated transaction number, or None if the counter is missing"""
+    try:
+        with open(SEQUENCE_FILE, 'r') as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_sequence(value):
+    """Durably replace the stored transaction counter"""
+    tmp_file = temp_file_for(SEQUENCE_FILE)
+    with open(tmp_file, 'w') as f:
+        f.write(str(value))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, SEQUENCE_FILE)
+
+def next_transaction_number(count=1):
+    """Allocate count consecutive transaction numbers from the persistent counter.
     
-    if isinstance(payment_data['Time'], str):
-        time_str = payment_data['Time']
-    else:
-        time_str = payment_data['Time'].strftime('%H:%M:%S') if hasattr(payment_data['Time'], 'strftime') else str(payment_data['Time'])
+    Returns the first number of the block.
+    """
+    if STORAGE_BACKEND == 'sqlite':
+        return sqlite_next_transaction_number(count)
+    
+    with sequence_lock(), file_lock(SEQUENCE_FILE + '.lock'):
+        current = read_sequence()
+        if current is None:
+            # One-time bootstrap from the IDs already stored
+            data, _ = get_data()
+            current = max_transaction_number(data['transactions'])
+        write_sequence(current + count)
+        return current + 1
+
+def generate_transaction_id():
+    """Generate a unique transaction ID; raises if the counter cannot be read or written"""
+    return f"TXN-{next_transaction_number():05d}"
+
+PHONE_PATTERN = r'^(\+92|0)[0-9]{10}$'
+
+def validate_phone(phone):
+    """Validate Pakistani phone number format"""
+    if not phone:
+        return False
+    return re.match(PHONE_PATTERN, phone) is not None
+
+def format_cnic(cnic):
+    """Format CNIC to standard format (XXXXX-XXXXXXX-X)"""
+    if not cnic:
+        return ""
     
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(0, 6, f"Date: {date_str} {time_str}", 0, 1, 'L')
-    pdf.ln(5)
+    # Remove all non-digit characters
+    digits = re.sub(r'\D', '', cnic)
     
-    # Payment details
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 8, "PAYMENT DETAILS", 0, 1, 'L')
-    pdf.set_font("Arial", '', 10)
+    # If we have 13 digits, format it properly
+    if len(digits) == 13:
+        return f"{digits[:5]}-{digits[5:12]}-{digits[12]}"
+    else:
+        # If not 13 digits, just return the cleaned version
+        return digits
+
+def validate_cnic(cnic):
+    """Validate Pakistani CNIC format - accept any format but clean it"""
+    if not cnic:  # CNIC is optional
+        return True, ""
     
-    pdf.cell(50, 6, "Customer Name:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{payment_data['Customer_Name']}", 0, 1, 'L')
+    # Remove all non-digit characters
+    digits = re.sub(r'\D', '', cnic)
     
-    pdf.cell(50, 6, "Phone:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{payment_data['Phone']}", 0, 1, 'L')
+    # If empty after cleaning, it's valid (optional)
+    if not digits:
+        return True, ""
     
-    if payment_data.get('CNIC'):
-        pdf.cell(50, 6, "CNIC:", 0, 0, 'L')
-        pdf.cell(0, 6, f"{payment_data['CNIC']}", 0, 1, 'L')
+    # If we have 13 digits, it's valid
+    if len(digits) == 13:
+        return True, f"{digits[:5]}-{digits[5:12]}-{digits[12]}"
+    else:
+        # Accept any number of digits but just return the cleaned version
+        return True, digits
+
+def customer_totals(entries):
+    """Combined balance of one or more customers' aggregates, with advances spent on what they owe"""
+    total_amount = sum(entry['total_amount'] for entry in entries)
+    # Include payment history
+    total_paid = sum(entry['total_paid'] + entry['payments'] for entry in entries)
+    total_left = sum(entry['total_left'] - entry['payments'] for entry in entries)
+    advance_balance = sum(entry['advance'] for entry in entries)
+    
+    # Apply advance balance
+    if advance_balance > 0 and any(entry['rows'] for entry in entries):
+        if total_left > 0:
+            if advance_balance >= total_left:
+                advance_balance -= total_left
+                total_left = 0
+                total_paid = total_amount
+            else:
+                total_left -= advance_balance
+                total_paid += advance_balance
+                advance_balance = 0
+    
+    return {
+        'total_amount': total_amount,
+        'total_paid': total_paid,
+        'total_left': max(0, total_left),
+        'advance_balance': advance_balance
+    }
+
+def get_customer_balance(customer_identifier):
+    """Get customer balance based on customer ID, phone, CNIC, or name"""
+    index, view = store_index('customers')
+    customers = [customer for customer in find_customers(customer_identifier) if customer in index['customers']]
     
-    pdf.cell(50, 6, "Amount:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{payment_data['Amount']:,.0f} PKR", 0, 1, 'L')
+    if not customers:
+        return {'total_amount': 0, 'total_paid': 0, 'total_left': 0, 'advance_balance': 0, 'transactions': pd.DataFrame(), 'customer_id': None}
     
-    pdf.cell(50, 6, "Payment Type:", 0, 0, 'L')
-    pdf.cell(0, 6, f"{payment_data['Payment_Type']}", 0, 1, 'L')
+    entries = [index['customers'][customer] for customer in customers]
+    results = customer_totals(entries)
+    results['customer_id'] = customers[0] if len(customers) == 1 else None
     
-    if payment_data.get('Transaction_ID'):
-        pdf.cell(50, 6, "Transaction ID:", 0, 0, 'L')
-        pdf.cell(0, 6, f"{payment_data['Transaction_ID']}", 0, 1, 'L')
+    if not any(entry['rows'] for entry in entries):
+        # Customer has only an advance balance (or payments)
+        results.update(total_amount=0, total_paid=0, total_left=0, transactions=pd.DataFrame())
+        return results
     
-    pdf.ln(5)
+    rows = sorted(row for entry in entries for row in entry['rows'])
+    results['transactions'] = store_rows(view, 'transactions', rows)
+    return results
+
+def advance_rows_match(customer_advances, keys):
+    """Positions of the customer_advances rows of a customer's identity keys, oldest first.
     
-    if payment_data.get('Notes'):
-        pdf.cell(50, 6, "Notes:", 0, 0, 'L')
-        pdf.multi_cell(0, 6, f"{payment_data['Notes']}")
+    Rows match on the canonical phone or CNIC (or the name when neither was
+    given). An empty list means a new customer.
+    """
+    if customer_advances.empty or not keys:
+        return []
+    first, second = customer_key_columns(customer_advances)
+    return np.flatnonzero((first.isin(keys) | second.isin(keys)).to_numpy()).tolist()
+
+def advance_changes(balances, amount):
+    """Split a change to a customer's advance over their advance rows.
     
-    pdf.ln(10)
+    A credit goes to the first row. A debit is taken from the rows in order,
+    each down to zero, and anything beyond their total from the first row.
+    """
+    changes = [0] * len(balances)
+    if amount >= 0:
+        changes[0] = amount
+        return changes
+    remaining = -amount
+    for position, balance in enumerate(balances):
+        taken = min(remaining, max(amount_value(balance), 0))
+        changes[position] -= taken
+        remaining -= taken
+    changes[0] -= remaining
+    return changes
+
+def apply_customer_advance(customer_advances, customer_name, phone, cnic, amount, keys=None):
+    """Return the advances table with the amount added to the customer's advance balance.
     
-    # Footer
-    pdf.set_font("Arial", 'I', 10)
-    pdf.cell(0, 6, "Payment recorded in Mobile Master Pro System", 0, 1, 'C')
+    keys are the identity keys the advance was resolved to when it was queued
+    (see update_customer_advance); entries written without them match on the
+    row's own name, phone and CNIC.
+    """
+    matches = advance_rows_match(customer_advances, keys or customer_keys(customer_name, phone, cnic))
+    if matches:
+        # Update existing customer advances on a copy; the table may be shared
+        customer_advances = customer_advances.copy()
+        labels = customer_advances.index[matches]
+        changes = advance_changes(customer_advances.loc[labels, 'Advance_Balance'].tolist(), amount)
+        customer_advances.loc[labels, 'Advance_Balance'] += changes
+        return customer_advances
+    
+    # Add new customer advance
+    new_advance = {
+        'Customer_Name': customer_name,
+        'Phone': phone,
+        'CNIC': cnic,
+        'Advance_Balance': amount
+    }
+    return pd.concat(
+        [customer_advances, pd.DataFrame([new_advance])],
+        ignore_index=True
+    )
+
+def update_customer_advance(customer_name, phone, cnic, amount):
+    """Queue a change to a customer's advance balance.
     
+    The customer is resolved through the customers index now, so the change
+    lands on the advance rows of every phone and CNIC the customer is known
+    by, which is the balance the forms read.
+    """
+    queue_journal_op({
+        'op': 'advance',
+        'customer_name': customer_name,
+        'phone': phone,
+        'cnic': cnic,
+        'amount': amount,
+        'keys': sorted(customer_identity_keys(customer_name, phone, cnic))
+    })
+
+# ==============================
+# PDF CACHE
+# ==============================
+# Rendered PDFs are stored on disk under a hash of the record's fields and the
+# template version, so an edited record simply gets a new key and its old PDF
+# ages out of the cache. Bump PDF_TEMPLATE_VERSION whenever a layout changes.
+PDF_CACHE_DIR = 'pdf_cache'
+PDF_CACHE_MAX_BYTES = 64 * 1024 * 1024
+PDF_TEMPLATE_VERSION = 2
+
+@st.cache_resource
+def pdf_cache_state():
+    """Process-wide size bookkeeping for the PDF cache"""
+    return {
+        'lock': threading.Lock(),
+        'size': None,        # bytes on disk, measured on first write
+    }
+
+def pdf_cache_key(kind, record):
+    """Content hash identifying the PDF of one record"""
+    fields = sorted((str(k), str(v)) for k, v in record.items())
+    payload = repr((kind, PDF_TEMPLATE_VERSION, fields)).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+def pdf_cache_files():
+    """(mtime, size, path) of every cached PDF"""
+    files = []
+    with os.scandir(PDF_CACHE_DIR) as entries:
+        for entry in entries:
+            if entry.name.endswith('.pdf'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    return files
+
+def evict_pdf_cache(state):
+    """Drop least recently used PDFs until the cache is back under its cap"""
+    files = sorted(pdf_cache_files())
+    size = sum(f[1] for f in files)
+    for mtime, file_size, path in files:
+        if size <= PDF_CACHE_MAX_BYTES * 0.9:
+            break
+        try:
+            os.remove(path)
+            size -= file_size
+        except OSError:
+            pass
+    state['size'] = size
+
+def store_cached_pdf(path, pdf_data):
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    temp_path = temp_file_for(path)
+    with open(temp_path, 'wb') as f:
+        f.write(pdf_data)
+    os.replace(temp_path, path)
+
+    state = pdf_cache_state()
+    with state['lock']:
+        if state['size'] is None:
+            state['size'] = sum(f[1] for f in pdf_cache_files())
+        else:
+            state['size'] += len(pdf_data)
+        if state['size'] > PDF_CACHE_MAX_BYTES:
+            evict_pdf_cache(state)
+
+def cached_pdf(kind):
+    """Serve a PDF builder's output from the on-disk cache when possible"""
+    def decorator(create_pdf):
+        @wraps(create_pdf)
+        def wrapper(record):
+            path = os.path.join(PDF_CACHE_DIR, f"{kind}_{pdf_cache_key(kind, record)}.pdf")
+            try:
+                with open(path, 'rb') as f:
+                    pdf_data = f.read()
+                os.utime(path)  # mark as recently used
+                return pdf_data
+            except OSError:
+                pass
+
+            pdf_data = create_pdf(record)
+            try:
+                store_cached_pdf(path, pdf_data)
+            except OSError:
+                pass  # the cache is only an optimization
+            return pdf_data
+        return wrapper
+    return decorator
+
+# ==============================
+# RECEIPT TEMPLATES
+# ==============================
+# Receipts are described once, as lists of lines, and compiled at startup into
+# per-line functions of a record. The HTML preview, the PDFs and plain text
+# are all drawn from the same compiled lines. Values are written as
+# '{Field:format}'; a line whose '{Field?}' values are all empty is left out,
+# and a note may give the text to show instead.
+SHOP_NAME = "AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI"
+RECEIPT_TEXT_WIDTH = 42  # characters per line of plain-text receipts (80mm paper)
+
+SHOP_HEADER = [
+    ('title', SHOP_NAME),
+    ('line', "Main Market, Loralai, Pakistan"),
+    ('line', "+92 300 1234567"),
+]
+
+RECEIPT_TEMPLATE_SPECS = {
+    'receipt': SHOP_HEADER + [
+        ('line', "{Date:date} {Time:time}"),
+        ('line', "Transaction ID: {Transaction_ID}"),
+        ('gap', 5),
+        ('heading', "CUSTOMER INFORMATION"),
+        ('row', "Name", "{Customer_Name}"),
+        ('row', "Phone", "{Phone}"),
+        ('row', "CNIC", "{CNIC?}"),
+        ('gap', 5),
+        ('heading', "ITEM DETAILS"),
+        ('row', "Item", "{Item}"),
+        ('row', "Brand/Model", "{Brand?} {Model?}"),
+        ('row', "Color/Storage", "{Color?} {Storage?}"),
+        ('row', "IMEI", "{IMEI?}"),
+        ('row', "Quantity", "{Quantity}"),
+        ('row', "Unit Price", "{Unit_Price:money}"),
+        ('gap', 5),
+        ('total', "Total Amount", "{Selling_Price:money}"),
+        ('row', "Amount Paid", "{Paid_Amount:money}"),
+        ('row', "Balance Due", "{Left_Amount:money}"),
+        ('gap', 10),
+        ('note', "Thank you for your purchase!"),
+        ('note', "Warranty: {Warranty?}", "No warranty provided"),
+        ('note', f"GN BY > {SHOP_NAME}"),
+    ],
+    'expenditure': SHOP_HEADER + [
+        ('subtitle', "EXPENDITURE RECEIPT"),
+        ('gap', 5),
+        ('row', "Date", "{Date:date} {Time:time}"),
+        ('gap', 5),
+        ('heading', "EXPENDITURE DETAILS"),
+        ('row', "Category", "{Category}"),
+        ('row', "Amount", "{Amount:money}"),
+        ('gap', 5),
+        ('text', "Description", "{Description}"),
+        ('gap', 10),
+        ('note', f"Expenditure recorded by {SHOP_NAME}"),
+    ],
+    'payment': SHOP_HEADER + [
+        ('subtitle', "PAYMENT RECEIPT"),
+        ('gap', 5),
+        ('row', "Date", "{Date:date} {Time:time}"),
+        ('gap', 5),
+        ('heading', "PAYMENT DETAILS"),
+        ('row', "Customer Name", "{Customer_Name}"),
+        ('row', "Phone", "{Phone}"),
+        ('row', "CNIC", "{CNIC?}"),
+        ('row', "Amount", "{Amount:money}"),
+        ('row', "Payment Type", "{Payment_Type}"),
+        ('row', "Transaction ID", "{Transaction_ID?}"),
+        ('gap', 5),
+        ('text', "Notes", "{Notes?}"),
+        ('gap', 10),
+        ('note', f"Payment recorded by {SHOP_NAME}"),
+    ],
+}
+
+def blank_value(value):
+    """True for missing values and empty strings"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return True
+    return str(value).strip() == ''
+
+def receipt_date(value):
+    """Date of a record as YYYY-MM-DD"""
+    return value.strftime('%Y-%m-%d') if hasattr(value, 'strftime') else str(value)
+
+def receipt_time(value):
+    """Time of a record as HH:MM:SS"""
+    return value.strftime('%H:%M:%S') if hasattr(value, 'strftime') else str(value)
+
+RECEIPT_FORMATS = {
+    '': lambda value: '' if blank_value(value) else str(value),
+    'money': lambda value: f"{amount_value(value):,.0f} PKR",
+    'date': receipt_date,
+    'time': receipt_time,
+}
+
+def record_field(name, record):
+    return record.get(name)
+
+def unit_price(record):
+    quantity = amount_value(record.get('Quantity'))
+    return amount_value(record.get('Selling_Price')) / quantity if quantity > 0 else 0
+
+# Values computed from a record rather than read from one of its fields
+RECEIPT_DERIVED_FIELDS = {
+    'Unit_Price': unit_price,
+}
+
+def compile_receipt_value(template):
+    """Compile '{Field:format}' text into a function returning (text, omit) for a record"""
+    parts = []
+    for literal, field, format_name, _ in string.Formatter().parse(template):
+        if field is None:
+            parts.append((literal, None, None, False))
+        else:
+            getter = RECEIPT_DERIVED_FIELDS.get(field.rstrip('?'), partial(record_field, field.rstrip('?')))
+            parts.append((literal, getter, RECEIPT_FORMATS[format_name or ''], field.endswith('?')))
+    has_optional = any(optional for _, _, _, optional in parts)
+    
+    def render(record):
+        pieces = []
+        filled = False
+        for literal, getter, format_value, optional in parts:
+            pieces.append(literal)
+            if getter is None:
+                continue
+            value = getter(record)
+            if blank_value(value):
+                continue
+            filled = filled or optional
+            pieces.append(format_value(value))
+        # Empty values leave their separators behind
+        text = re.sub(' {2,}', ' ', ''.join(pieces)).strip()
+        return text, has_optional and not filled
+    return render
+
+def gap_line(size, record):
+    return str(size), False
+
+def compile_receipt_template(spec):
+    """Compile a template spec into (kind, label, render, otherwise) lines"""
+    lines = []
+    for line in spec:
+        kind = line[0]
+        if kind == 'gap':
+            lines.append((kind, None, partial(gap_line, line[1]), None))
+        elif kind in ('row', 'total', 'text'):
+            lines.append((kind, line[1], compile_receipt_value(line[2]), None))
+        else:
+            lines.append((kind, None, compile_receipt_value(line[1]), line[2] if len(line) > 2 else None))
+    return lines
+
+RECEIPT_TEMPLATES = {kind: compile_receipt_template(spec) for kind, spec in RECEIPT_TEMPLATE_SPECS.items()}
+
+def receipt_lines(kind, record):
+    """The (kind, label, text) lines of one record's receipt"""
+    lines = []
+    for line_kind, label, render, otherwise in RECEIPT_TEMPLATES[kind]:
+        text, omit = render(record)
+        if omit:
+            if otherwise is None:
+                continue
+            text = otherwise
+        lines.append((line_kind, label, text))
+    return lines
+
+def draw_receipt_pdf(pdf, lines):
+    """Lay out one receipt on a new page of a PDF"""
+    pdf.add_page()
+    for kind, label, text in lines:
+        if kind == 'title':
+            pdf.set_font("Arial", 'B', 16)
+            pdf.set_text_color(74, 20, 140)
+            pdf.cell(0, 10, text, 0, 1, 'C')
+        elif kind == 'subtitle':
+            pdf.set_font("Arial", 'B', 14)
+            pdf.cell(0, 10, text, 0, 1, 'C')
+        elif kind == 'line':
+            pdf.set_font("Arial", '', 10)
+            pdf.cell(0, 6, text, 0, 1, 'C')
+        elif kind == 'heading':
+            pdf.set_font("Arial", 'B', 12)
+            pdf.cell(0, 8, text, 0, 1, 'L')
+        elif kind == 'row':
+            pdf.set_font("Arial", '', 10)
+            pdf.cell(50, 6, f"{label}:", 0, 0, 'L')
+            pdf.cell(0, 6, text, 0, 1, 'L')
+        elif kind == 'total':
+            pdf.set_font("Arial", 'B', 12)
+            pdf.cell(50, 8, f"{label}:", 0, 0, 'L')
+            pdf.cell(0, 8, text, 0, 1, 'L')
+        elif kind == 'text':
+            pdf.set_font("Arial", '', 10)
+            pdf.cell(50, 6, f"{label}:", 0, 0, 'L')
+            pdf.multi_cell(0, 6, text)
+        elif kind == 'note':
+            pdf.set_font("Arial", 'I', 10)
+            pdf.cell(0, 6, text, 0, 1, 'C')
+        elif kind == 'gap':
+            pdf.ln(float(text))
+
+def receipt_html(lines):
+    """HTML preview of one receipt"""
+    parts = ['<div class="receipt-container">']
+    in_header = False
+    for kind, label, text in lines:
+        text = html.escape(text)
+        if kind in ('title', 'subtitle', 'line') and not in_header:
+            parts.append('<div class="receipt-header">')
+            in_header = True
+        elif kind not in ('title', 'subtitle', 'line') and in_header:
+            parts.append('</div>')
+            in_header = False
+        
+        if kind == 'title':
+            parts.append(f'<h2>{text}</h2>')
+        elif kind == 'subtitle':
+            parts.append(f'<h3>{text}</h3>')
+        elif kind == 'line':
+            parts.append(f'<p>{text}</p>')
+        elif kind == 'heading':
+            parts.append(f'<p><strong>{text}</strong></p>')
+        elif kind in ('row', 'text'):
+            parts.append(f'<div class="receipt-item"><span>{html.escape(label)}:</span><span>{text}</span></div>')
+        elif kind == 'total':
+            parts.append(f'<div class="receipt-item receipt-total"><span>{html.escape(label)}:</span><span>{text}</span></div>')
+        elif kind == 'note':
+            parts.append(f'<p style="text-align: center;">{text}</p>')
+        elif kind == 'gap':
+            parts.append(f'<div style="height: {float(text) * 2:.0f}px;"></div>')
+    if in_header:
+        parts.append('</div>')
+    parts.append('</div>')
+    return ''.join(parts)
+
+def receipt_text_lines(lines, width=RECEIPT_TEXT_WIDTH):
+    """Lay receipt lines out in fixed-width text, yielding (kind, text) per printed line"""
+    for kind, label, text in lines:
+        if kind in ('title', 'subtitle', 'line', 'note'):
+            for part in textwrap.wrap(text, width) or ['']:
+                yield kind, part.center(width).rstrip()
+            if kind == 'title':
+                yield 'rule', '=' * width
+        elif kind == 'heading':
+            yield kind, text.upper()
+        elif kind in ('row', 'total'):
+            if kind == 'total':
+                yield 'rule', '-' * width
+            label = f"{label}:"
+            if len(label) + 1 + len(text) <= width:
+                yield kind, label + text.rjust(width - len(label))
+            else:
+                yield kind, label
+                for part in textwrap.wrap(text, width):
+                    yield kind, part.rjust(width)
+        elif kind == 'text':
+            yield 'heading', f"{label}:"
+            for paragraph in text.splitlines() or ['']:
+                for part in textwrap.wrap(paragraph, width) or ['']:
+                    yield kind, part
+        elif kind == 'gap':
+            yield kind, ''
+
+def receipt_text(lines, width=RECEIPT_TEXT_WIDTH):
+    """Plain-text receipt, for printers and messages"""
+    return '\n'.join(text for _, text in receipt_text_lines(lines, width)) + '\n'
+
+def render_receipts(kind, records, output='html'):
+    """Render many records with one template; a list of HTML or text strings"""
+    render = receipt_html if output == 'html' else receipt_text
+    return [render(receipt_lines(kind, record)) for record in records]
+
+def render_receipt_pdf(kind, record):
+    """One record as its own PDF document"""
+    pdf = FPDF()
+    draw_receipt_pdf(pdf, receipt_lines(kind, record))
     return pdf.output(dest='S').encode('latin1')
 
+def generate_receipt(transaction_data):
+    """HTML preview of a transaction receipt"""
+    return render_receipts('receipt', [transaction_data])[0]
+
+@cached_pdf('receipt')
+def create_receipt_pdf(transaction_data):
+    """Create a PDF receipt for a transaction"""
+    return render_receipt_pdf('receipt', transaction_data)
+
+@cached_pdf('expenditure')
+def create_expenditure_pdf(expenditure_data):
+    """Create a PDF for expenditure record"""
+    return render_receipt_pdf('expenditure', expenditure_data)
+
+@cached_pdf('payment')
+def create_payment_pdf(payment_data):
+    """Create a PDF for payment record"""
+    return render_receipt_pdf('payment', payment_data)
+
 def create_dashboard_report(period='daily'):
     """Create a comprehensive dashboard report PDF with period filter"""
     pdf = FPDF()
@@ -1300,61 +3986,26 @@ def create_dashboard_report(period='daily'):
     pdf.ln(5)
     
     # Calculate key metrics based on period
-    transactions = st.session_state.transactions
-    expenditures = st.session_state.expenditures
-    
     today = datetime.now().date()
+    start, end, period_text = period_range(period, today)
+    period_totals = metric_totals(start, end)
+    overall_totals = metric_totals()
     
-    # Filter data based on period
-    if period == 'daily':
-        filtered_transactions = transactions[transactions['Date'].dt.date == today]
-        filtered_expenditures = expenditures[expenditures['Date'].dt.date == today]
-        period_text = f"for {today.strftime('%Y-%m-%d')}"
-    elif period == 'weekly':
-        start_of_week = today - timedelta(days=today.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-        filtered_transactions = transactions[(transactions['Date'].dt.date >= start_of_week) & 
-                                           (transactions['Date'].dt.date <= end_of_week)]
-        filtered_expenditures = expenditures[(expenditures['Date'].dt.date >= start_of_week) & 
-                                           (expenditures['Date'].dt.date <= end_of_week)]
-        period_text = f"for week {start_of_week.strftime('%Y-%m-%d')} to {end_of_week.strftime('%Y-%m-%d')}"
-    elif period == 'monthly':
-        start_of_month = today.replace(day=1)
-        end_of_month = today.replace(day=calendar.monthrange(today.year, today.month)[1])
-        filtered_transactions = transactions[(transactions['Date'].dt.date >= start_of_month) & 
-                                           (transactions['Date'].dt.date <= end_of_month)]
-        filtered_expenditures = expenditures[(expenditures['Date'].dt.date >= start_of_month) & 
-                                           (expenditures['Date'].dt.date <= end_of_month)]
-        period_text = f"for {today.strftime('%B %Y')}"
-    elif period == 'yearly':
-        start_of_year = today.replace(month=1, day=1)
-        end_of_year = today.replace(month=12, day=31)
-        filtered_transactions = transactions[(transactions['Date'].dt.date >= start_of_year) & 
-                                           (transactions['Date'].dt.date <= end_of_year)]
-        filtered_expenditures = expenditures[(expenditures['Date'].dt.date >= start_of_year) & 
-                                           (expenditures['Date'].dt.date <= end_of_year)]
-        period_text = f"for year {today.year}"
-    else:
-        # All time
-        filtered_transactions = transactions
-        filtered_expenditures = expenditures
-        period_text = "for all time"
-    
-    # Today's metrics
-    period_sales = filtered_transactions[filtered_transactions['Type'] == 'Sale']['Selling_Price'].sum()
-    period_profit = filtered_transactions['Profit'].sum()
-    period_expenditure = filtered_expenditures['Amount'].sum()
+    # Period metrics
+    period_sales = period_totals['sales']
+    period_profit = period_totals['profit']
+    period_expenditure = period_totals['expenditure']
     
     # Overall metrics
-    total_sales = transactions['Selling_Price'].sum()
-    total_profit = transactions['Profit'].sum()
-    total_expenditure = expenditures['Amount'].sum()
-    pending_payments = transactions['Left_Amount'].sum()
+    total_sales = overall_totals['selling']
+    total_profit = overall_totals['profit']
+    total_expenditure = overall_totals['expenditure']
+    pending_payments = overall_totals['left']
     
     # Category breakdown
-    mobile_sales = filtered_transactions[filtered_transactions['Category'] == 'Mobile']['Selling_Price'].sum()
-    accessories_sales = filtered_transactions[filtered_transactions['Category'] == 'Accessories']['Selling_Price'].sum()
-    service_sales = filtered_transactions[filtered_transactions['Category'] == 'Repair']['Selling_Price'].sum()
+    mobile_sales = period_totals['category_sales'].get('Mobile', 0)
+    accessories_sales = period_totals['category_sales'].get('Accessories', 0)
+    service_sales = period_totals['category_sales'].get('Repair', 0)
     
     # Period Summary
     pdf.set_font("Arial", 'B', 12)
@@ -1413,9 +4064,161 @@ def create_dashboard_report(period='daily'):
     
     return pdf.output(dest='S').encode('latin1')
 
+# ==============================
+# THERMAL PRINTING
+# ==============================
+# Receipts go straight to a 58mm or 80mm ESC/POS printer, laid out from the
+# same compiled template lines as the text receipt. MOBILE_SHOP_PRINTER names
+# the printer: 'tcp://host:9100' for a network printer, or a device or file
+# path such as /dev/usb/lp0. Jobs are sent by one background spooler thread
+# that retries while the printer is off or out of paper, so a slow printer
+# never holds up the counter.
+PRINTER_TARGET = os.environ.get('MOBILE_SHOP_PRINTER', '')
+PRINTER_PAPER_MM = int(os.environ.get('MOBILE_SHOP_PRINTER_PAPER', '80'))
+PRINTER_COLUMNS = {58: 32, 80: 48}  # characters per line in the printer's standard font
+PRINTER_WIDTH = PRINTER_COLUMNS.get(PRINTER_PAPER_MM, RECEIPT_TEXT_WIDTH)
+PRINTER_TIMEOUT = 5        # seconds to connect to / write to a network printer
+PRINT_RETRIES = 4          # attempts per job before it is marked failed
+PRINT_RETRY_DELAY = 2      # seconds before the first retry, doubled after each one
+PRINT_JOBS_KEPT = 50       # finished jobs kept for the status display
+
+ESC_INIT = b'\x1b@'                 # ESC @: reset the printer
+ESC_CODEPAGE = b'\x1bt\x00'         # ESC t 0: PC437 character table
+ESC_FEED_AND_CUT = b'\x1dVA\x04'    # GS V 65 4: feed 4 lines, then partial cut
+ESC_STYLES = {
+    # kind: (ESC E bold, GS ! size); 0x01 is double height, keeping the line width
+    'title': (1, 0x01),
+    'subtitle': (1, 0x00),
+    'heading': (1, 0x00),
+    'total': (1, 0x01),
+}
+ESC_PLAIN = (0, 0x00)
+
+def escpos_receipt(kind, record, width=PRINTER_WIDTH):
+    """ESC/POS bytes for one receipt of the given template kind"""
+    out = [ESC_INIT, ESC_CODEPAGE]
+    current = ESC_PLAIN
+    for line_kind, text in receipt_text_lines(receipt_lines(kind, record), width):
+        style = ESC_STYLES.get(line_kind, ESC_PLAIN)
+        if style != current:
+            out.append(b'\x1bE' + bytes([style[0]]) + b'\x1d!' + bytes([style[1]]))
+            current = style
+        out.append(text.encode('cp437', errors='replace') + b'\n')
+    if current != ESC_PLAIN:
+        out.append(b'\x1bE\x00\x1d!\x00')
+    out.append(ESC_FEED_AND_CUT)
+    return b''.join(out)
+
+def send_to_printer(target, data):
+    """Write raw bytes to a tcp://host:port printer or to a device/file path"""
+    if target.startswith('tcp://'):
+        host, _, port = target[len('tcp://'):].rpartition(':')
+        with socket.create_connection((host, int(port)), timeout=PRINTER_TIMEOUT) as conn:
+            conn.sendall(data)
+    else:
+        with open(target, 'ab') as f:
+            f.write(data)
+
+@st.cache_resource
+def print_spooler():
+    """Process-wide print queue, its worker thread and recent job statuses"""
+    return {
+        'lock': threading.Lock(),
+        'queue': queue.Queue(),
+        'thread': None,
+        'jobs': {},          # job id -> status, oldest first
+        'next_id': 1
+    }
+
+def run_print_job(spooler, job):
+    """Send one job, retrying with backoff, and record how it went"""
+    for attempt in range(1, PRINT_RETRIES + 1):
+        try:
+            send_to_printer(job['target'], job['data'])
+        except (OSError, ValueError) as e:
+            with spooler['lock']:
+                job.update(attempts=attempt, error=str(e),
+                           status='retrying' if attempt < PRINT_RETRIES else 'failed')
+            if attempt < PRINT_RETRIES:
+                time.sleep(PRINT_RETRY_DELAY * 2 ** (attempt - 1))
+        else:
+            with spooler['lock']:
+                job.update(attempts=attempt, error=None, status='printed')
+            return
+
+def print_worker(spooler):
+    """Spooler thread: print queued jobs one at a time, in order"""
+    while True:
+        job = spooler['queue'].get()
+        try:
+            run_print_job(spooler, job)
+        except Exception as e:
+            with spooler['lock']:
+                job.update(status='failed', error=str(e))
+        finally:
+            spooler['queue'].task_done()
+
+def queue_print(kind, record, target=None, width=None):
+    """Render a receipt and queue it for the printer; returns the job id"""
+    target = target or PRINTER_TARGET
+    if not target:
+        raise ValueError("No printer configured (set MOBILE_SHOP_PRINTER)")
+    data = escpos_receipt(kind, record, width or PRINTER_WIDTH)
+    spooler = print_spooler()
+    with spooler['lock']:
+        job_id = spooler['next_id']
+        spooler['next_id'] += 1
+        job = {'id': job_id, 'name': record.get('Transaction_ID') or kind,
+               'target': target, 'data': data, 'status': 'queued', 'attempts': 0, 'error': None}
+        spooler['jobs'][job_id] = job
+        finished = [i for i, j in spooler['jobs'].items() if j['status'] in ('printed', 'failed')]
+        for old in finished[:max(0, len(spooler['jobs']) - PRINT_JOBS_KEPT)]:
+            del spooler['jobs'][old]
+        if spooler['thread'] is None or not spooler['thread'].is_alive():
+            spooler['thread'] = threading.Thread(target=print_worker, args=(spooler,), daemon=True)
+            spooler['thread'].start()
+    spooler['queue'].put(job)
+    return job_id
+
+def print_job_status(job_id):
+    """Status of a print job: queued, retrying, printed or failed (None if forgotten)"""
+    spooler = print_spooler()
+    with spooler['lock']:
+        job = spooler['jobs'].get(job_id)
+        return {k: v for k, v in job.items() if k != 'data'} if job else None
+
+def wait_for_prints(timeout=None):
+    """Block until the spooler has finished every queued job"""
+    spooler = print_spooler()
+    deadline = None if timeout is None else time.time() + timeout
+    while spooler['queue'].unfinished_tasks:
+        if deadline is not None and time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def print_receipt_button(kind, record, key):
+    """Button that sends a receipt to the thermal printer, with the job's status"""
+    if not PRINTER_TARGET:
+        return
+    if st.button("🖨️ Print Receipt", key=key):
+        try:
+            st.session_state[f"{key}_job"] = queue_print(kind, record)
+        except Exception as e:
+            st.error(f"Error printing receipt: {e}")
+    job = print_job_status(st.session_state.get(f"{key}_job"))
+    if job:
+        if job['status'] == 'printed':
+            st.caption(f"🖨️ {job['name']} printed")
+        elif job['status'] == 'failed':
+            st.error(f"Error printing receipt: {job['error']}")
+        else:
+            st.caption(f"🖨️ {job['name']} {job['status']} (attempt {job['attempts']} of {PRINT_RETRIES})")
+
 # ==============================
 # FORM FUNCTIONS
 # ==============================
+@page_fragment
 def add_mobile_sale_form():
     st.markdown('<div class="section-title">📱 Add New Mobile Sale</div>', unsafe_allow_html=True)
     
@@ -1481,10 +4284,23 @@ def add_mobile_sale_form():
                     st.error("Please enter a valid CNIC")
                     return
                 
+                # An IMEI can only be sold once; short stock is only a warning
+                # since stock-in records may not be kept for every handset
+                stock_error, stock_warning = check_sale_stock('Mobile', brand, model, color, storage, '', quantity, imei)
+                if stock_error:
+                    st.error(stock_error)
+                    return
+                if stock_warning:
+                    st.warning(stock_warning)
+                
                 total_selling_price = selling_price * quantity
                 profit = total_selling_price - (cost_price * quantity)
                 left_amount = total_selling_price - paid_amount
-                transaction_id = generate_transaction_id()
+                try:
+                    transaction_id = generate_transaction_id()
+                except Exception as e:
+                    st.error(f"Error allocating transaction ID: {e}")
+                    return
                 
                 new_transaction = {
                     'Date': sale_date,
@@ -1531,16 +4347,16 @@ def add_mobile_sale_form():
                     update_customer_advance(customer_name, phone, formatted_cnic, -advance_applied)
 
                 # Add the new transaction
-                new_row_df = pd.DataFrame([new_transaction])
-                st.session_state.transactions = pd.concat([st.session_state.transactions, new_row_df], ignore_index=True)
+                queue_new_row('transactions', new_transaction)
                 
                 # Save data and display success message
-                save_data()
-                st.success("✅ Mobile sale recorded successfully!")
-                
-                # Store the last transaction for receipt generation
-                st.session_state.last_transaction = new_transaction
+                if save_data():
+                    st.success("✅ Mobile sale recorded successfully!")
+                    
+                    # Store the last transaction for receipt generation
+                    st.session_state.last_transaction = new_transaction
 
+@page_fragment
 def add_accessories_sale_form():
     st.markdown('<div class="section-title">🎧 Add New Accessories Sale</div>', unsafe_allow_html=True)
     
@@ -1598,10 +4414,18 @@ def add_accessories_sale_form():
                     st.error("Please enter a valid CNIC")
                     return
                 
+                _, stock_warning = check_sale_stock('Accessories', brand, model, '', '', item_name, quantity)
+                if stock_warning:
+                    st.warning(stock_warning)
+                
                 total_selling_price = selling_price * quantity
                 profit = total_selling_price - (cost_price * quantity)
                 left_amount = total_selling_price - paid_amount
-                transaction_id = generate_transaction_id()
+                try:
+                    transaction_id = generate_transaction_id()
+                except Exception as e:
+                    st.error(f"Error allocating transaction ID: {e}")
+                    return
                 
                 new_transaction = {
                     'Date': sale_date,
@@ -1645,12 +4469,12 @@ def add_accessories_sale_form():
                     new_transaction['Paid_Amount'] = paid_amount + advance_applied
                     update_customer_advance(customer_name, phone, formatted_cnic, -advance_applied)
 
-                new_row_df = pd.DataFrame([new_transaction])
-                st.session_state.transactions = pd.concat([st.session_state.transactions, new_row_df], ignore_index=True)
-                save_data()
-                st.success("✅ Accessories sale recorded successfully!")
-                st.session_state.last_transaction = new_transaction
+                queue_new_row('transactions', new_transaction)
+                if save_data():
+                    st.success("✅ Accessories sale recorded successfully!")
+                    st.session_state.last_transaction = new_transaction
 
+@page_fragment
 def add_repair_form():
     st.markdown('<div class="section-title">🔧 Add New Repair Service</div>', unsafe_allow_html=True)
     
@@ -1704,7 +4528,11 @@ def add_repair_form():
                 
                 profit = selling_price - service_cost
                 left_amount = selling_price - paid_amount
-                transaction_id = generate_transaction_id()
+                try:
+                    transaction_id = generate_transaction_id()
+                except Exception as e:
+                    st.error(f"Error allocating transaction ID: {e}")
+                    return
 
                 new_transaction = {
                     'Date': repair_date,
@@ -1748,12 +4576,12 @@ def add_repair_form():
                     new_transaction['Paid_Amount'] = paid_amount + advance_applied
                     update_customer_advance(customer_name, phone, formatted_cnic, -advance_applied)
 
-                new_row_df = pd.DataFrame([new_transaction])
-                st.session_state.transactions = pd.concat([st.session_state.transactions, new_row_df], ignore_index=True)
-                save_data()
-                st.success("✅ Repair service recorded successfully!")
-                st.session_state.last_transaction = new_transaction
+                queue_new_row('transactions', new_transaction)
+                if save_data():
+                    st.success("✅ Repair service recorded successfully!")
+                    st.session_state.last_transaction = new_transaction
 
+@page_fragment
 def add_expenditure_form():
     st.markdown('<div class="section-title">💸 Add New Expenditure</div>', unsafe_allow_html=True)
     with st.form("add_expenditure_form", clear_on_submit=True):
@@ -1780,11 +4608,11 @@ def add_expenditure_form():
                     'Description': exp_description
                 }
                 
-                new_row_df = pd.DataFrame([new_expenditure])
-                st.session_state.expenditures = pd.concat([st.session_state.expenditures, new_row_df], ignore_index=True)
-                save_data()
-                st.success("✅ Expenditure recorded successfully!")
+                queue_new_row('expenditures', new_expenditure)
+                if save_data():
+                    st.success("✅ Expenditure recorded successfully!")
 
+@page_fragment
 def record_payment_form():
     st.markdown('<div class="section-title">💰 Record Customer Payment / Advance</div>', unsafe_allow_html=True)
     with st.form("record_payment_form", clear_on_submit=True):
@@ -1824,7 +4652,7 @@ def record_payment_form():
                 if is_advance:
                     # Update customer advance balance
                     update_customer_advance(customer_name, phone, formatted_cnic, payment_amount)
-                    st.success(f"✅ Advance of {payment_amount:,.0f} PKR recorded for {customer_name}.")
+                    message = f"✅ Advance of {payment_amount:,.0f} PKR recorded for {customer_name}."
                 else:
                     # Record as a payment towards a transaction
                     payment_data = {
@@ -1839,45 +4667,394 @@ def record_payment_form():
                         'Notes': notes,
                         'Is_Advance': is_advance
                     }
-                    new_row_df = pd.DataFrame([payment_data])
-                    st.session_state.payments = pd.concat([st.session_state.payments, new_row_df], ignore_index=True)
-                    st.success(f"✅ Payment of {payment_amount:,.0f} PKR recorded for {customer_name}.")
+                    queue_new_row('payments', payment_data)
+                    message = f"✅ Payment of {payment_amount:,.0f} PKR recorded for {customer_name}."
                 
-                save_data()
+                if save_data():
+                    st.success(message)
+
+# ==============================
+# RECORD LISTS
+# ==============================
+# Record lists only render the rows of the current page, taken newest first
+# from the date index instead of sorting the table, and their PDFs and CSVs
+# are passed to st.download_button as callables so they are built on click.
+PAGE_SIZE_OPTIONS = [10, 25, 50, 100]
+
+def paginate(df, key, noun="records", order=None):
+    """Render page controls for df and return the rows on the current page.
+    
+    order, if given, holds the positions of the rows to page through, in display order.
+    """
+    total = len(df) if order is None else len(order)
+    size_key = f"{key}_page_size"
+    page_key = f"{key}_page"
+
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox("Per page", PAGE_SIZE_OPTIONS, key=size_key)
+    page_count = max(1, -(-total // page_size))
+    # Keep the stored page valid when filters shrink the list
+    if st.session_state.get(page_key, 1) > page_count:
+        st.session_state[page_key] = page_count
+    with col2:
+        page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key=page_key)
+
+    start = (int(page) - 1) * page_size
+    end = min(start + page_size, total)
+    with col3:
+        st.caption(f"Showing {start + 1}-{end} of {total} {noun} (page {int(page)} of {page_count})")
+    return df.iloc[start:end] if order is None else df.iloc[order[start:end]]
+
+def pdf_download_button(label, create_pdf, record, file_name, key=None):
+    """Download button that only renders the record's PDF when clicked"""
+    st.download_button(
+        label=label,
+        data=partial(create_pdf, record),
+        file_name=file_name,
+        mime="application/pdf",
+        key=key,
+        use_container_width=True
+    )
+
+def receipt_file_name(idx, transaction):
+    return f"receipt_{transaction['Transaction_ID']}.pdf"
+
+def expenditure_file_name(idx, expenditure):
+    return f"expenditure_{expenditure['Date'].strftime('%Y%m%d')}_{idx}.pdf"
+
+def payment_file_name(idx, payment):
+    return f"payment_{payment['Date'].strftime('%Y%m%d')}_{idx}.pdf"
+
+# ==============================
+# BULK EXPORT
+# ==============================
+# ZIP exports run only when asked for. PDFs are rendered one at a time in the
+# script thread and each one is written straight into a temporary ZIP file on
+# disk instead of an in-memory buffer. There is no worker pool: Streamlit
+# replaces __main__ on every rerun, so workers can't look the renderers up by
+# reference, and forking the server would copy locks other threads hold.
+def export_pdf_zip(df, create_pdf, file_name, progress=None):
+    """Write one PDF per row into a temporary ZIP file and return its path"""
+    total = len(df)
+    items = ((file_name(idx, row), row.to_dict()) for idx, row in df.iterrows())
+    step = max(1, total // 100)
+
+    fd, path = tempfile.mkstemp(prefix='mobile_shop_export_', suffix='.zip')
+    try:
+        with os.fdopen(fd, 'wb') as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for done, (name, record) in enumerate(items, start=1):
+                zip_file.writestr(name, create_pdf(record))
+                if progress and (done % step == 0 or done == total):
+                    progress(done, total)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def read_export(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def discard_export(export):
+    if export and os.path.exists(export['path']):
+        os.remove(export['path'])
+
+def bulk_export_button(label, df, order, filters, create_pdf, file_name, zip_name, key):
+    """Prepare a ZIP of PDFs for the rows of df at positions order on request, then offer it for download"""
+    # An export is reused until the data or the filters that picked the rows change
+    signature = (st.session_state.get('data_generation'), filters)
+    export = st.session_state.get(key)
+
+    if not export or export['signature'] != signature or not os.path.exists(export['path']):
+        if not st.button(f"⚙️ Prepare {label}", key=f"{key}_prepare", use_container_width=True):
+            return
+        discard_export(export)
+        st.session_state.pop(key, None)
+
+        df = df.iloc[order]
+        progress_bar = st.progress(0.0, text=f"Rendering {len(df)} PDFs...")
+        def progress(done, total):
+            progress_bar.progress(done / total, text=f"Rendered {done} of {total} PDFs")
+        try:
+            path = export_pdf_zip(df, create_pdf, file_name, progress)
+        except Exception as e:
+            progress_bar.empty()
+            st.error(f"Error creating export: {e}")
+            return
+        progress_bar.empty()
+        export = {'path': path, 'signature': signature}
+        st.session_state[key] = export
+
+    st.download_button(
+        label=f"📦 Download {label}",
+        data=partial(read_export, export['path']),
+        file_name=zip_name,
+        mime="application/zip",
+        key=f"{key}_download",
+        use_container_width=True
+    )
+
+# ==============================
+# BULK IMPORT
+# ==============================
+# Sheets are read and validated chunk by chunk with vectorized versions of the
+# form checks. Valid rows get one block of transaction IDs, customer advances
+# are applied once per customer, and everything is saved in a single write.
+IMPORT_CHUNK_ROWS = 5000
+SALES_NUMERIC_COLUMNS = ['Quantity', 'Selling_Price', 'Cost_Price', 'Profit', 'Paid_Amount', 'Left_Amount']
+
+def import_column_name(name, table):
+    """Map a sheet header like 'selling price' to the table column it names"""
+    key = re.sub(r'[\s\-]+', '_', str(name).strip()).lower()
+    for column in TABLE_COLUMNS[table]:
+        if column.lower() == key:
+            return column
+    return None
+
+def read_csv_chunks(file):
+    """Yield a CSV file as DataFrames of raw strings"""
+    yield from pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=IMPORT_CHUNK_ROWS)
+
+def read_xlsx_chunks(file):
+    """Yield the first worksheet of an .xlsx file as DataFrames of raw strings"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportError("Reading .xlsx files requires the openpyxl package")
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = ['' if value is None else str(value) for value in next(rows, ())]
+        chunk = []
+        for row in rows:
+            chunk.append(['' if value is None else str(value) for value in row[:len(header)]])
+            if len(chunk) >= IMPORT_CHUNK_ROWS:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+def read_import_chunks(file):
+    if file.name.lower().endswith('.xlsx'):
+        return read_xlsx_chunks(file)
+    return read_csv_chunks(file)
+
+def import_frame(chunk, table):
+    """Rename a chunk's headers to table columns and add the missing columns as blanks"""
+    renamed = {}
+    for name in chunk.columns:
+        column = import_column_name(name, table)
+        if column and column not in renamed.values():
+            renamed[name] = column
+    df = chunk[list(renamed)].rename(columns=renamed)
+    df = df.reindex(columns=TABLE_COLUMNS[table], fill_value='')
+    return df.fillna('').astype(str).apply(lambda column: column.str.strip())
+
+def valid_phone_mask(phones):
+    """Vectorized validate_phone()"""
+    return phones.str.match(PHONE_PATTERN)
+
+def format_cnic_series(cnics):
+    """Vectorized validate_cnic(): 13 digits become XXXXX-XXXXXXX-X, anything else just its digits"""
+    digits = cnics.str.replace(r'\D', '', regex=True)
+    formatted = digits.str[:5] + '-' + digits.str[5:12] + '-' + digits.str[12:]
+    return formatted.where(digits.str.len() == 13, digits)
+
+def import_dates(values):
+    """Parse a column of sheet dates row by row, NaT where a date can't be read.
+    
+    A single pd.to_datetime() call guesses one format from the first rows and
+    rejects every row written another way. Here dates starting with the year
+    (2025-02-01, as the app's CSVs and Excel cells have them) are read year
+    first, and any other date day first, as dates are written in Pakistan
+    (01/02/2025 is 1 February).
+    """
+    year_first = values.str.match(r'\d{4}\D')
+    dates = pd.to_datetime(values.where(year_first), errors='coerce', format='mixed')
+    day_first = ~year_first & (values != '')
+    if day_first.any():
+        dates[day_first] = pd.to_datetime(values[day_first], errors='coerce', format='mixed', dayfirst=True)
+    return dates
+
+def rejection_reasons(checks, index):
+    """First failed check of each row as text, '' for valid rows"""
+    conditions = [~ok for ok, _ in checks]
+    reasons = [reason for _, reason in checks]
+    return pd.Series(np.select(conditions, reasons, default=''), index=index)
+
+def prepare_sales_chunk(chunk, default_category):
+    """Validate and complete one chunk of imported sales; returns (valid, rejected)"""
+    df = import_frame(chunk, 'transactions')
+    numbers = df[SALES_NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce')
+    dates = import_dates(df['Date'])
+
+    reasons = rejection_reasons([
+        (dates.notna(), 'Invalid date'),
+        (df['Customer_Name'] != '', 'Missing customer name'),
+        (valid_phone_mask(df['Phone']), 'Invalid phone number'),
+        (numbers['Selling_Price'] > 0, 'Selling price must be greater than 0'),
+        (~(numbers['Paid_Amount'] > numbers['Selling_Price']), 'Paid amount is greater than selling price')
+    ], df.index)
+    valid = reasons == ''
+    rejected = chunk[(~valid).to_numpy()].assign(Reason=reasons[~valid].to_numpy())
+
+    df = df[valid].copy()
+    numbers = numbers[valid]
+    df['Date'] = dates[valid]
+    df['Time'] = df['Time'].where(df['Time'] != '', '00:00:00')
+    df['Category'] = df['Category'].where(df['Category'] != '', default_category)
+    df['Type'] = df['Type'].where(df['Type'] != '', np.where(df['Category'] == 'Repair', 'Service', 'Sale'))
+    df['Item'] = df['Item'].where(df['Item'] != '', (df['Brand'] + ' ' + df['Model']).str.strip())
+    df['CNIC'] = format_cnic_series(df['CNIC'])
+
+    df['Quantity'] = numbers['Quantity'].fillna(1)
+    df['Selling_Price'] = numbers['Selling_Price']
+    df['Cost_Price'] = numbers['Cost_Price'].fillna(0)
+    df['Paid_Amount'] = numbers['Paid_Amount'].fillna(0)
+    # Same formulas as the sale forms when the sheet does not provide them
+    df['Profit'] = numbers['Profit'].fillna(df['Selling_Price'] - df['Cost_Price'] * df['Quantity'])
+    df['Left_Amount'] = numbers['Left_Amount'].fillna(df['Selling_Price'] - df['Paid_Amount'])
+    df['Advance_Balance'] = 0
+    return df, rejected
+
+def prepare_expenditures_chunk(chunk, default_category):
+    """Validate one chunk of imported expenditures; returns (valid, rejected)"""
+    df = import_frame(chunk, 'expenditures')
+    amounts = pd.to_numeric(df['Amount'], errors='coerce')
+    dates = import_dates(df['Date'])
+    df['Category'] = df['Category'].where(df['Category'] != '', default_category)
+
+    reasons = rejection_reasons([
+        (dates.notna(), 'Invalid date'),
+        (df['Category'] != '', 'Missing category'),
+        (amounts > 0, 'Amount must be greater than 0'),
+        (df['Description'] != '', 'Missing description')
+    ], df.index)
+    valid = reasons == ''
+    rejected = chunk[(~valid).to_numpy()].assign(Reason=reasons[~valid].to_numpy())
+
+    df = df[valid].copy()
+    df['Date'] = dates[valid]
+    df['Time'] = df['Time'].where(df['Time'] != '', '00:00:00')
+    df['Amount'] = amounts[valid]
+    return df, rejected
+
+def apply_import_advances(sales):
+    """Spend each customer's advance on their imported sales in sheet order.
+
+    Matches entering the sales one by one through the sale forms, but looks up
+    each customer's balance once and returns one advance op per customer.
+    """
+    ops = []
+    left = sales['Left_Amount'].clip(lower=0)
+    # Rows are grouped by customer, so differently written phones share one advance
+    phones = phone_keys(sales['Phone'])
+    customer_ids = {}
+    available = {}
+    for phone in phones.unique():
+        balance = get_customer_balance(phone)
+        customer_ids[phone] = balance['customer_id'] or phone
+        if balance['advance_balance'] > 0:
+            available[customer_ids[phone]] = balance['advance_balance']
+    if not available:
+        return sales, ops
+    customers = phones.map(customer_ids)
+
+    # Advance still available before each row = balance - earlier rows' dues
+    earlier = left.groupby(customers).cumsum() - left
+    remaining = (customers.map(available).fillna(0) - earlier).clip(lower=0)
+    applied = np.minimum(left, remaining)
+
+    sales = sales.assign(
+        Left_Amount=sales['Left_Amount'] - applied,
+        Paid_Amount=sales['Paid_Amount'] + applied
+    )
+    totals = applied.groupby(customers).sum()
+    first_rows = sales.assign(Customer=customers).drop_duplicates('Customer').set_index('Customer')
+    for customer, amount in totals[totals > 0].items():
+        customer_name, phone, cnic = first_rows.loc[customer, ['Customer_Name', 'Phone', 'CNIC']]
+        ops.append({
+            'op': 'advance',
+            'customer_name': customer_name,
+            'phone': phone,
+            'cnic': cnic,
+            'amount': -amount,
+            'keys': sorted(customer_identity_keys(customer_name, phone, cnic))
+        })
+    return sales, ops
+
+def import_records(file, kind, default_category, progress=None):
+    """Read, validate and save a sales or expenditures sheet in one write.
+
+    Returns the number of imported rows and a DataFrame of rejected rows.
+    """
+    table = 'transactions' if kind == 'Sales' else 'expenditures'
+    prepare = prepare_sales_chunk if kind == 'Sales' else prepare_expenditures_chunk
+
+    valid_chunks = []
+    rejected_chunks = []
+    rows_read = 0
+    for chunk in read_import_chunks(file):
+        valid, rejected = prepare(chunk, default_category)
+        valid_chunks.append(valid)
+        rejected_chunks.append(rejected)
+        rows_read += len(chunk)
+        if progress:
+            progress(rows_read)
+
+    records = pd.concat(valid_chunks, ignore_index=True) if valid_chunks else empty_table(table)
+    rejected = pd.concat(rejected_chunks, ignore_index=True) if rejected_chunks else pd.DataFrame()
+    if records.empty:
+        return 0, rejected
+
+    ops = []
+    if table == 'transactions':
+        first = next_transaction_number(len(records))
+        records['Transaction_ID'] = [f"TXN-{number:05d}" for number in range(first, first + len(records))]
+        records, ops = apply_import_advances(records)
+        records['Status'] = np.where(records['Left_Amount'] == 0, 'Completed', 'Pending')
+
+    columns = list(records.columns)
+    # Column lists zipped into dicts: much faster than to_dict('records') on string columns
+    rows = (dict(zip(columns, values)) for values in zip(*(records[column].tolist() for column in columns)))
+    queue_journal_ops([{'op': 'append', 'table': table, 'row': row} for row in rows] + ops)
+    if not save_data():
+        return 0, rejected
+    return len(records), rejected
 
 # ==============================
 # MAIN PAGES
 # ==============================
+@page_fragment
 def dashboard_page():
     st.markdown('<div class="section-title">📊 Dashboard Overview</div>', unsafe_allow_html=True)
     
-    # Check if data exists
-    if 'transactions' not in st.session_state:
-        st.info("No data available to display. Please record some transactions.")
-        return
-        
-    transactions = st.session_state.transactions
-    expenditures = st.session_state.expenditures
-    
     # Use today's date for daily calculations
     today = datetime.now().date()
     
-    # Calculate key metrics
-    today_sales = transactions[(transactions['Date'].dt.date == today) & (transactions['Type'] == 'Sale')]['Selling_Price'].sum()
-    today_profit = transactions[(transactions['Date'].dt.date == today)]['Profit'].sum()
-    today_expenditure = expenditures[expenditures['Date'].dt.date == today]['Amount'].sum()
+    # Calculate key metrics from the daily rollups
+    today_totals = metric_totals(today, today)
+    overall_totals = metric_totals()
     
-    total_sales = transactions['Selling_Price'].sum()
-    total_profit = transactions['Profit'].sum()
-    total_expenditure = expenditures['Amount'].sum()
+    today_sales = today_totals['sales']
+    today_profit = today_totals['profit']
+    today_expenditure = today_totals['expenditure']
+    
+    total_sales = overall_totals['selling']
+    total_profit = overall_totals['profit']
+    total_expenditure = overall_totals['expenditure']
     
     # Calculate pending payments
-    pending_payments = transactions['Left_Amount'].sum()
+    pending_payments = overall_totals['left']
     
     # Calculate mobile vs accessories sales
-    mobile_sales = transactions[transactions['Category'] == 'Mobile']['Selling_Price'].sum()
-    accessories_sales = transactions[transactions['Category'] == 'Accessories']['Selling_Price'].sum()
-    service_sales = transactions[transactions['Category'] == 'Repair']['Selling_Price'].sum()
+    mobile_sales = overall_totals['category_sales'].get('Mobile', 0)
+    accessories_sales = overall_totals['category_sales'].get('Accessories', 0)
+    service_sales = overall_totals['category_sales'].get('Repair', 0)
     
     # Create metric cards
     col1, col2, col3 = st.columns(3)
@@ -1969,9 +5146,8 @@ def dashboard_page():
         st.bar_chart(sales_data.set_index('Category'))
     
     st.subheader("Daily Profit & Loss Analysis")
-    if not transactions.empty:
-        daily_profit = transactions.groupby(transactions['Date'].dt.date)['Profit'].sum()
-        st.line_chart(daily_profit)
+    if table_length('transactions'):
+        st.line_chart(daily_profit_series())
     else:
         st.info("No sales data available for daily analysis.")
     
@@ -1986,29 +5162,38 @@ def dashboard_page():
         key="report_period"
     )
     
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     with col1:
-        # Download dashboard report
-        report_data = create_dashboard_report(period=report_period.lower().replace(" ", "_"))
+        # Download dashboard report, built when the button is clicked
         st.download_button(
             label=f"📄 Download {report_period} Report (PDF)",
-            data=report_data,
+            data=partial(create_dashboard_report, period=report_period.lower().replace(" ", "_")),
             file_name=f"{report_period.lower().replace(' ', '_')}_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
             mime="application/pdf",
             use_container_width=True
         )
     
     with col2:
-        # Download CSV data
-        csv_data = transactions.to_csv(index=False).encode('utf-8')
+        # Download CSV data, written when the button is clicked
         st.download_button(
             label="📊 Download All Data (CSV)",
-            data=csv_data,
+            data=partial(table_csv, 'transactions'),
             file_name=f"business_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
             mime="text/csv",
             use_container_width=True
         )
+    
+    with col3:
+        # Only the selected period's rows, read when the button is clicked
+        st.download_button(
+            label=f"📅 Download {report_period} Data (CSV)",
+            data=partial(period_transactions_csv, report_period.lower().replace(" ", "_")),
+            file_name=f"{report_period.lower().replace(' ', '_')}_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
 
+@page_fragment
 def customer_balance_page():
     st.markdown('<div class="section-title">👤 Customer Balances</div>', unsafe_allow_html=True)
     
@@ -2037,6 +5222,8 @@ def customer_balance_page():
                 </div>
             </div>
             """, unsafe_allow_html=True)
+            if results['customer_id']:
+                st.caption(f"Customer ID: {results['customer_id']}")
             
             if results['advance_balance'] > 0:
                 st.markdown(f"""
@@ -2051,8 +5238,9 @@ def customer_balance_page():
             
             st.subheader("Transaction History")
             if not results['transactions'].empty:
-                # Display transactions with download buttons
-                for idx, transaction in results['transactions'].iterrows():
+                # Display the current page of transactions with download buttons
+                page_transactions = paginate(results['transactions'], "balance_history", "transactions")
+                for idx, transaction in page_transactions.iterrows():
                     with st.expander(f"Transaction {transaction['Transaction_ID']} - {transaction['Date'].strftime('%Y-%m-%d')}"):
                         col1, col2 = st.columns([3, 1])
                         with col1:
@@ -2061,12 +5249,11 @@ def customer_balance_page():
                             st.write(f"**Paid:** {transaction['Paid_Amount']:,.0f} PKR")
                             st.write(f"**Balance:** {transaction['Left_Amount']:,.0f} PKR")
                         with col2:
-                            pdf_data = create_receipt_pdf(transaction.to_dict())
-                            st.download_button(
-                                label="📄 Download Receipt",
-                                data=pdf_data,
-                                file_name=f"receipt_{transaction['Transaction_ID']}.pdf",
-                                mime="application/pdf",
+                            pdf_download_button(
+                                "📄 Download Receipt",
+                                create_receipt_pdf,
+                                transaction.to_dict(),
+                                receipt_file_name(idx, transaction),
                                 key=f"receipt_{idx}"
                             )
             else:
@@ -2074,38 +5261,45 @@ def customer_balance_page():
         else:
             st.warning(f"No customer found with the identifier '{search_term}'.")
 
+@page_fragment
 def data_view_page():
     st.markdown('<div class="section-title">🗃️ View & Download Data</div>', unsafe_allow_html=True)
 
+    # The tables are listed and filtered whole, so read them with pending rows merged in
+    data, _ = get_data()
+    
     # Tabs for different data types
-    tab1, tab2, tab3, tab4 = st.tabs(["Transactions", "Expenditures", "Payments", "Customer Advances"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Transactions", "Expenditures", "Payments", "Customer Advances", "Customers"])
 
     with tab1:
         st.subheader("Sales & Service Transactions")
-        transactions = st.session_state.transactions.sort_values(by='Date', ascending=False)
+        transactions = data['transactions']
         
         # Add search and filter functionality
         col_search, col_filter = st.columns([2, 1])
         with col_search:
-            search_query = st.text_input("Search transactions", placeholder="Search by customer, item, ID...")
+            search_query = st.text_input("Search transactions", placeholder="Search by customer, item, ID... or phone:0300 imei:35")
         with col_filter:
             filter_type = st.selectbox("Filter by type", ["All", "Sale", "Service"])
         
-        # Apply filters
-        filtered_transactions = transactions
+        # Apply filters as a row mask, shown newest first
+        mask = None
         if search_query:
-            filtered_transactions = filtered_transactions[
-                filtered_transactions.apply(lambda row: search_query.lower() in str(row).lower(), axis=1)
-            ]
+            transactions, mask = search_rows('transactions', search_query)
         if filter_type != "All":
-            filtered_transactions = filtered_transactions[filtered_transactions['Type'] == filter_type]
+            type_mask = (transactions['Type'] == filter_type).to_numpy()
+            mask = type_mask if mask is None else mask & type_mask
+        order = newest_first('transactions', transactions, mask)
         
-        st.dataframe(filtered_transactions)
-        
-        if not filtered_transactions.empty:
+        if len(order) == 0:
+            st.info("No transactions found.")
+        else:
+            page_transactions = paginate(transactions, "txn_receipts", "transactions", order)
+            st.dataframe(page_transactions)
+            
             # Add download buttons for each transaction
             st.subheader("Download Receipts")
-            for idx, transaction in filtered_transactions.iterrows():
+            for idx, transaction in page_transactions.iterrows():
                 with st.expander(f"Transaction {transaction['Transaction_ID']} - {transaction['Date'].strftime('%Y-%m-%d') if hasattr(transaction['Date'], 'strftime') else transaction['Date']}"):
                     col1, col2 = st.columns([3, 1])
                     with col1:
@@ -2113,14 +5307,12 @@ def data_view_page():
                         st.write(f"**Item:** {transaction['Item']}")
                         st.write(f"**Amount:** {transaction['Selling_Price']:,.0f} PKR")
                     with col2:
-                        pdf_data = create_receipt_pdf(transaction.to_dict())
-                        st.download_button(
-                            label="📄 Download Receipt",
-                            data=pdf_data,
-                            file_name=f"receipt_{transaction['Transaction_ID']}.pdf",
-                            mime="application/pdf",
-                            key=f"txn_receipt_{idx}",
-                            use_container_width=True
+                        pdf_download_button(
+                            "📄 Download Receipt",
+                            create_receipt_pdf,
+                            transaction.to_dict(),
+                            receipt_file_name(idx, transaction),
+                            key=f"txn_receipt_{idx}"
                         )
             
             # Bulk download option
@@ -2129,48 +5321,37 @@ def data_view_page():
             with col1:
                 st.download_button(
                     label="📥 Download Transactions CSV",
-                    data=filtered_transactions.to_csv(index=False).encode('utf-8'),
+                    data=partial(frame_csv, transactions, order),
                     file_name="transactions.csv",
                     mime="text/csv",
                     use_container_width=True
                 )
             with col2:
-                # Create a zip file with all receipts
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for idx, transaction in filtered_transactions.iterrows():
-                        pdf_data = create_receipt_pdf(transaction.to_dict())
-                        zip_file.writestr(f"receipt_{transaction['Transaction_ID']}.pdf", pdf_data)
-                
-                zip_buffer.seek(0)
-                st.download_button(
-                    label="📦 Download All Receipts (ZIP)",
-                    data=zip_buffer,
-                    file_name="all_receipts.zip",
-                    mime="application/zip",
-                    use_container_width=True
-                )
+                # Zip file with all receipts, prepared on request
+                bulk_export_button("All Receipts (ZIP)", transactions, order, (search_query, filter_type), create_receipt_pdf, receipt_file_name, "all_receipts.zip", "txn_export")
 
     with tab2:
         st.subheader("Expenditure Records")
-        expenditures = st.session_state.expenditures.sort_values(by='Date', ascending=False)
+        expenditures = data['expenditures']
         
         # Add search functionality
-        exp_search = st.text_input("Search expenditures", placeholder="Search by category, description...")
+        exp_search = st.text_input("Search expenditures", placeholder="Search by category, description... or category:rent")
         
-        # Apply filters
-        filtered_expenditures = expenditures
+        # Apply filters as a row mask, shown newest first
+        mask = None
         if exp_search:
-            filtered_expenditures = filtered_expenditures[
-                filtered_expenditures.apply(lambda row: exp_search.lower() in str(row).lower(), axis=1)
-            ]
+            expenditures, mask = search_rows('expenditures', exp_search)
+        order = newest_first('expenditures', expenditures, mask)
         
-        st.dataframe(filtered_expenditures)
-        
-        if not filtered_expenditures.empty:
+        if len(order) == 0:
+            st.info("No expenditures found.")
+        else:
+            page_expenditures = paginate(expenditures, "exp_records", "expenditures", order)
+            st.dataframe(page_expenditures)
+            
             # Add download buttons for each expenditure
             st.subheader("Download Expenditure Records")
-            for idx, expenditure in filtered_expenditures.iterrows():
+            for idx, expenditure in page_expenditures.iterrows():
                 with st.expander(f"Expenditure - {expenditure['Date'].strftime('%Y-%m-%d') if hasattr(expenditure['Date'], 'strftime') else expenditure['Date']}"):
                     col1, col2 = st.columns([3, 1])
                     with col1:
@@ -2178,14 +5359,12 @@ def data_view_page():
                         st.write(f"**Amount:** {expenditure['Amount']:,.0f} PKR")
                         st.write(f"**Description:** {expenditure['Description']}")
                     with col2:
-                        pdf_data = create_expenditure_pdf(expenditure.to_dict())
-                        st.download_button(
-                            label="📄 Download Record",
-                            data=pdf_data,
-                            file_name=f"expenditure_{expenditure['Date'].strftime('%Y%m%d')}_{idx}.pdf",
-                            mime="application/pdf",
-                            key=f"exp_{idx}",
-                            use_container_width=True
+                        pdf_download_button(
+                            "📄 Download Record",
+                            create_expenditure_pdf,
+                            expenditure.to_dict(),
+                            expenditure_file_name(idx, expenditure),
+                            key=f"exp_{idx}"
                         )
             
             # Bulk download option
@@ -2194,48 +5373,37 @@ def data_view_page():
             with col1:
                 st.download_button(
                     label="📥 Download Expenditures CSV",
-                    data=filtered_expenditures.to_csv(index=False).encode('utf-8'),
+                    data=partial(frame_csv, expenditures, order),
                     file_name="expenditures.csv",
                     mime="text/csv",
                     use_container_width=True
                 )
             with col2:
-                # Create a zip file with all expenditure records
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for idx, expenditure in filtered_expenditures.iterrows():
-                        pdf_data = create_expenditure_pdf(expenditure.to_dict())
-                        zip_file.writestr(f"expenditure_{expenditure['Date'].strftime('%Y%m%d')}_{idx}.pdf", pdf_data)
-                
-                zip_buffer.seek(0)
-                st.download_button(
-                    label="📦 Download All Records (ZIP)",
-                    data=zip_buffer,
-                    file_name="all_expenditures.zip",
-                    mime="application/zip",
-                    use_container_width=True
-                )
+                # Zip file with all expenditure records, prepared on request
+                bulk_export_button("All Records (ZIP)", expenditures, order, (exp_search,), create_expenditure_pdf, expenditure_file_name, "all_expenditures.zip", "exp_export")
 
     with tab3:
         st.subheader("Payment Records")
-        payments = st.session_state.payments.sort_values(by='Date', ascending=False)
+        payments = data['payments']
         
         # Add search functionality
-        pay_search = st.text_input("Search payments", placeholder="Search by customer, type...")
+        pay_search = st.text_input("Search payments", placeholder="Search by customer, type... or phone:0300")
         
-        # Apply filters
-        filtered_payments = payments
+        # Apply filters as a row mask, shown newest first
+        mask = None
         if pay_search:
-            filtered_payments = filtered_payments[
-                filtered_payments.apply(lambda row: pay_search.lower() in str(row).lower(), axis=1)
-            ]
+            payments, mask = search_rows('payments', pay_search)
+        order = newest_first('payments', payments, mask)
         
-        st.dataframe(filtered_payments)
-        
-        if not filtered_payments.empty:
+        if len(order) == 0:
+            st.info("No payments found.")
+        else:
+            page_payments = paginate(payments, "pay_records", "payments", order)
+            st.dataframe(page_payments)
+            
             # Add download buttons for each payment
             st.subheader("Download Payment Records")
-            for idx, payment in filtered_payments.iterrows():
+            for idx, payment in page_payments.iterrows():
                 with st.expander(f"Payment - {payment['Date'].strftime('%Y-%m-%d') if hasattr(payment['Date'], 'strftime') else payment['Date']}"):
                     col1, col2 = st.columns([3, 1])
                     with col1:
@@ -2245,14 +5413,12 @@ def data_view_page():
                         if payment.get('Notes'):
                             st.write(f"**Notes:** {payment['Notes']}")
                     with col2:
-                        pdf_data = create_payment_pdf(payment.to_dict())
-                        st.download_button(
-                            label="📄 Download Receipt",
-                            data=pdf_data,
-                            file_name=f"payment_{payment['Date'].strftime('%Y%m%d')}_{idx}.pdf",
-                            mime="application/pdf",
-                            key=f"pay_{idx}",
-                            use_container_width=True
+                        pdf_download_button(
+                            "📄 Download Receipt",
+                            create_payment_pdf,
+                            payment.to_dict(),
+                            payment_file_name(idx, payment),
+                            key=f"pay_{idx}"
                         )
             
             # Bulk download option
@@ -2261,31 +5427,18 @@ def data_view_page():
             with col1:
                 st.download_button(
                     label="📥 Download Payments CSV",
-                    data=filtered_payments.to_csv(index=False).encode('utf-8'),
+                    data=partial(frame_csv, payments, order),
                     file_name="payments.csv",
                     mime="text/csv",
                     use_container_width=True
                 )
             with col2:
-                # Create a zip file with all payment records
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for idx, payment in filtered_payments.iterrows():
-                        pdf_data = create_payment_pdf(payment.to_dict())
-                        zip_file.writestr(f"payment_{payment['Date'].strftime('%Y%m%d')}_{idx}.pdf", pdf_data)
-                
-                zip_buffer.seek(0)
-                st.download_button(
-                    label="📦 Download All Receipts (ZIP)",
-                    data=zip_buffer,
-                    file_name="all_payments.zip",
-                    mime="application/zip",
-                    use_container_width=True
-                )
+                # Zip file with all payment records, prepared on request
+                bulk_export_button("All Receipts (ZIP)", payments, order, (pay_search,), create_payment_pdf, payment_file_name, "all_payments.zip", "pay_export")
             
     with tab4:
         st.subheader("Customer Advance Balances")
-        customer_advances = st.session_state.customer_advances
+        customer_advances = data['customer_advances']
         
         # Add search functionality
         adv_search = st.text_input("Search advances", placeholder="Search by customer name, phone...")
@@ -2293,20 +5446,319 @@ def data_view_page():
         # Apply filters
         filtered_advances = customer_advances
         if adv_search:
-            filtered_advances = filtered_advances[
-                filtered_advances.apply(lambda row: adv_search.lower() in str(row).lower(), axis=1)
-            ]
-        
-        st.dataframe(filtered_advances)
+            filtered_advances = search_table('customer_advances', adv_search)
         
-        if not filtered_advances.empty:
+        if filtered_advances.empty:
+            st.info("No customer advances found.")
+        else:
+            st.dataframe(paginate(filtered_advances, "adv_records", "customers"))
             st.download_button(
                 label="📥 Download Customer Advances CSV",
-                data=filtered_advances.to_csv(index=False).encode('utf-8'),
+                data=partial(frame_csv, filtered_advances),
                 file_name="customer_advances.csv",
                 mime="text/csv",
                 use_container_width=True
             )
+    
+    with tab5:
+        st.subheader("Customers")
+        st.caption("Rows with the same phone number or CNIC, however formatted, are one customer.")
+        
+        customer_search = st.text_input("Search customers", placeholder="Search by customer ID, name, phone or CNIC")
+        # Page through customer IDs and build master rows only for the page shown
+        if customer_search:
+            customers = find_customers(customer_search)
+        else:
+            index, _ = store_index('customers')
+            customers = list(index['customers'])
+        
+        if not customers:
+            st.info("No customers found.")
+        else:
+            page_customers = paginate(pd.Series(customers), "customer_records", "customers")
+            st.dataframe(customer_master(page_customers.tolist()), hide_index=True)
+            st.download_button(
+                label="📥 Download Customers CSV",
+                data=partial(customers_csv, customers),
+                file_name="customers.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+
+@page_fragment
+def inventory_page():
+    st.markdown('<div class="section-title">📦 Inventory</div>', unsafe_allow_html=True)
+    
+    tab1, tab2, tab3 = st.tabs(["Stock In", "IMEI Lookup", "Stock On Hand"])
+    
+    with tab1:
+        with st.form("stock_in_form", clear_on_submit=True):
+            col_dt, col_t = st.columns(2)
+            with col_dt:
+                stock_date = st.date_input("Date*", datetime.now().date(), key="stock_date")
+            with col_t:
+                stock_time = st.time_input("Time*", datetime.now().time(), key="stock_time")
+            
+            category = st.selectbox("Category*", STOCK_CATEGORIES, key="stock_category")
+            col1, col2 = st.columns(2)
+            with col1:
+                brand = st.text_input("Brand", key="stock_brand", placeholder="e.g., Samsung, Anker")
+                color = st.text_input("Color (Mobile)", key="stock_color")
+                quantity = st.number_input("Quantity*", min_value=1, step=1, key="stock_qty", value=1)
+            with col2:
+                model = st.text_input("Model", key="stock_model", placeholder="e.g., S23 Ultra, A2544")
+                storage = st.text_input("Storage (Mobile)", key="stock_storage")
+                item_name = st.text_input("Item Name (Accessories)", key="stock_item", placeholder="e.g., Screen Protector")
+            
+            imei = st.text_area("IMEI Numbers (Mobile)", key="stock_imei", placeholder="One handset per line")
+            col3, col4 = st.columns(2)
+            with col3:
+                cost_price = st.number_input("Cost Price per Unit (PKR)", min_value=0, key="stock_cost_price", value=0)
+            with col4:
+                supplier = st.text_input("Supplier", key="stock_supplier")
+            notes = st.text_input("Notes", key="stock_notes")
+            
+            submitted = st.form_submit_button("💾 Save Stock", use_container_width=True)
+            if submitted:
+                imeis = imei_numbers(imei)
+                if category == 'Mobile' and not all([brand, model, color, storage]):
+                    st.error("Please enter the brand, model, color and storage of the handsets.")
+                elif category == 'Accessories' and not item_name:
+                    st.error("Please enter the item name.")
+                elif len(imeis) != len(set(imeis)):
+                    st.error("The same IMEI was entered twice.")
+                elif stocked_imeis(imeis):
+                    st.error(f"IMEI {stocked_imeis(imeis)[0]} is already in stock.")
+                else:
+                    queue_new_row('stock', {
+                        'Date': stock_date,
+                        'Time': stock_time.strftime('%H:%M:%S'),
+                        'Category': category,
+                        'Brand': brand,
+                        'Model': model,
+                        'Item': item_name if category == 'Accessories' else f"{brand} {model} ({color}, {storage})",
+                        'Color': color if category == 'Mobile' else '',
+                        'Storage': storage if category == 'Mobile' else '',
+                        'IMEI': '\n'.join(imeis),
+                        'Quantity': quantity,
+                        'Cost_Price': cost_price,
+                        'Supplier': supplier,
+                        'Notes': notes
+                    })
+                    if save_data():
+                        st.success("✅ Stock recorded successfully!")
+    
+    with tab2:
+        imei = st.text_input("IMEI", key="imei_lookup", placeholder="15-digit IMEI")
+        if imei:
+            imeis = imei_numbers(imei)
+            if not imeis:
+                st.warning("Please enter a 14 to 16 digit IMEI.")
+            else:
+                found = find_imei(imeis[0])
+                if found['stock'] is None and found['sold'] is None:
+                    st.info("No stock or sale recorded for this IMEI.")
+                if found['stock'] is not None:
+                    stock_row = found['stock']
+                    st.markdown(f"**Stocked:** {stock_row['Item']} on {pd.Timestamp(stock_row['Date']).strftime('%Y-%m-%d')}"
+                                f" from {stock_row['Supplier'] or 'unknown supplier'}")
+                if found['sold'] is not None:
+                    sale = found['sold']
+                    st.markdown(f"**Sold:** {sale['Transaction_ID']} on {pd.Timestamp(sale['Date']).strftime('%Y-%m-%d')}"
+                                f" to {sale['Customer_Name']} ({sale['Phone']})")
+                elif found['stock'] is not None:
+                    st.success("✅ In stock")
+    
+    with tab3:
+        summary = stock_summary()
+        if summary.empty:
+            st.info("No stock recorded yet.")
+        else:
+            low_stock = summary[summary['In Stock'] <= 0]
+            if not low_stock.empty:
+                st.warning(f"⚠️ {len(low_stock)} items are out of stock.")
+            st.dataframe(summary.sort_values(['Category', 'Item']), use_container_width=True)
+            st.download_button(
+                label="📥 Download Stock Records CSV",
+                data=partial(table_csv, 'stock'),
+                file_name="stock.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+
+def bulk_import_page():
+    st.markdown('<div class="section-title">📥 Bulk Import</div>', unsafe_allow_html=True)
+    
+    st.write("Import historical sales or expenditures from a CSV or Excel (.xlsx) sheet. "
+             "Column headers should match the data view columns, e.g. Date, Customer Name, Phone, "
+             "Selling Price, Paid Amount for sales or Date, Category, Amount, Description for expenditures. "
+             "Dates can be written year first (2025-02-01) or day first (01/02/2025), mixed in one sheet. "
+             "Transaction IDs are always assigned by the app.")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        kind = st.selectbox("Records", ["Sales", "Expenditures"], key="import_kind")
+    with col2:
+        if kind == "Sales":
+            default_category = st.selectbox("Category for rows without one", ["Mobile", "Accessories", "Repair"], key="import_category")
+        else:
+            default_category = st.text_input("Category for rows without one", key="import_exp_category")
+    
+    uploaded_file = st.file_uploader("Sheet", type=["csv", "xlsx"], key="import_file")
+    
+    if uploaded_file is not None and st.button("📥 Import Records", use_container_width=True):
+        progress_text = st.empty()
+        def progress(rows_read):
+            progress_text.caption(f"Read {rows_read:,} rows...")
+        try:
+            imported, rejected = import_records(uploaded_file, kind, default_category, progress)
+        except Exception as e:
+            st.error(f"Error importing records: {e}")
+            return
+        progress_text.empty()
+        
+        if imported:
+            st.success(f"✅ Imported {imported:,} {kind.lower()} records.")
+        if not rejected.empty:
+            st.warning(f"⚠️ {len(rejected):,} rows were skipped.")
+            st.dataframe(rejected.head(100))
+            st.download_button(
+                label="📥 Download Skipped Rows (CSV)",
+                data=rejected.to_csv(index=False).encode('utf-8'),
+                file_name="skipped_rows.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+
+def manage_users_page():
+    st.markdown('<div class="section-title">👥 Manage Users</div>', unsafe_allow_html=True)
+    
+    auth_config = load_credentials()
+    users = pd.DataFrame(
+        [{'Username': name, 'Role': user['role']} for name, user in sorted(auth_config['users'].items())]
+    )
+    st.dataframe(users, use_container_width=True, hide_index=True)
+    
+    st.subheader("Add User")
+    with st.form("add_user_form", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            new_username = st.text_input("Username")
+            role = st.selectbox("Role", ROLES)
+        with col2:
+            password = st.text_input("Password", type="password")
+            confirm_password = st.text_input("Confirm Password", type="password")
+        
+        if st.form_submit_button("➕ Add User", use_container_width=True):
+            new_username = new_username.strip()
+            if not new_username or not password:
+                st.error("Please enter a username and password")
+            elif password != confirm_password:
+                st.error("Passwords do not match")
+            else:
+                try:
+                    if not add_user(new_username, password, role):
+                        st.error(f"User {new_username} already exists")
+                    else:
+                        st.success(f"✅ Added {role} {new_username}")
+                        st.rerun()
+                except OSError as e:
+                    st.error(f"Error adding user: {e}")
+    
+    st.subheader("Change User")
+    username = st.selectbox("User", list(users['Username']), key="manage_user")
+    col1, col2 = st.columns(2)
+    with col1:
+        with st.form("user_role_form"):
+            current_role = auth_config['users'][username]['role']
+            role = st.selectbox("Role", ROLES, index=ROLES.index(current_role))
+            if st.form_submit_button("Update Role", use_container_width=True):
+                try:
+                    set_user_role(username, role)
+                    if username == st.session_state.username:
+                        st.session_state.role = role
+                    st.success(f"✅ {username} is now {role}")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error updating role: {e}")
+        with st.form("user_remove_form"):
+            if st.form_submit_button("🗑️ Remove User", use_container_width=True):
+                if username == st.session_state.username:
+                    st.error("You can't remove the account you are logged in with")
+                else:
+                    try:
+                        remove_user(username)
+                        st.success(f"✅ Removed {username}")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error removing user: {e}")
+    with col2:
+        with st.form("user_password_form", clear_on_submit=True):
+            password = st.text_input("New Password", type="password")
+            confirm_password = st.text_input("Confirm New Password", type="password")
+            if st.form_submit_button("Set Password", use_container_width=True):
+                if not password:
+                    st.error("Please enter a password")
+                elif password != confirm_password:
+                    st.error("Passwords do not match")
+                else:
+                    try:
+                        update_password(username, password)
+                        if username == st.session_state.username:
+                            # The old token was signed with the old password hash
+                            st.query_params['session'] = issue_session_token(username)
+                        st.success(f"✅ Password changed for {username}")
+                    except OSError as e:
+                        st.error(f"Error changing password: {e}")
+
+def backups_page():
+    st.markdown('<div class="section-title">🗄️ Backups</div>', unsafe_allow_html=True)
+    
+    st.write(f"A backup is taken automatically every {BACKUP_INTERVAL // 3600} hours. Months that did not change "
+             f"since an earlier backup are not stored again. The newest backup of each of the last "
+             f"{BACKUP_KEEP_DAILY} days and {BACKUP_KEEP_MONTHLY} months is kept.")
+    
+    if st.button("💾 Back Up Now", use_container_width=True):
+        try:
+            name = create_backup()
+            prune_backups()
+            st.success(f"✅ Created {name}")
+        except Exception as e:
+            st.error(f"Error backing up data: {e}")
+    
+    names = backup_names()
+    if not names:
+        st.info("No backups yet.")
+        return
+    
+    rows = []
+    for name in reversed(names):
+        manifest = read_backup_manifest(name)
+        rows.append({
+            'Backup': name,
+            'Created': manifest['created'],
+            'Sales': manifest['rows'].get('transactions', 0),
+            'Expenditures': manifest['rows'].get('expenditures', 0),
+            'Payments': manifest['rows'].get('payments', 0),
+            'New Data (KB)': round(manifest['stored_bytes'] / 1024, 1)
+        })
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    
+    st.subheader("Restore")
+    with st.form("restore_backup_form"):
+        name = st.selectbox("Backup", list(reversed(names)))
+        confirm = st.checkbox("Replace all current data with this backup (the current data is backed up first)")
+        if st.form_submit_button("♻️ Restore Backup", use_container_width=True):
+            if not confirm:
+                st.error("Please confirm the restore")
+            else:
+                try:
+                    restore_backup(name)
+                    st.session_state.data_generation = None
+                    load_data()
+                    st.success(f"✅ Restored {name}")
+                except Exception as e:
+                    st.error(f"Error restoring backup: {e}")
 
 # ==============================
 # MAIN APPLICATION LOGIC
@@ -2321,23 +5773,44 @@ def main():
         st.session_state.authenticated = False
     if 'username' not in st.session_state:
         st.session_state.username = None
+    if 'role' not in st.session_state:
+        st.session_state.role = None
     if 'show_reset' not in st.session_state:
         st.session_state.show_reset = False
 
-    # Check authentication
-    if not st.session_state.authenticated:
+    try:
+        load_credentials()
+    except Exception as e:
+        st.error(f"Error loading credentials: {e}")
+        st.stop()
+
+    # Roles can be changed and accounts removed from other sessions, so the
+    # role is re-read on every run like the session token is
+    if st.session_state.authenticated:
+        st.session_state.role = user_role(st.session_state.username)
+        if st.session_state.role is None:
+            end_session()
+    
+    # Check authentication; a reconnecting browser presents its session token
+    if not st.session_state.authenticated and not restore_session():
         login_section()
         return
 
     # Load data on app start
     load_data()
+    schedule_backup()
+    if STORAGE_BACKEND == 'journal':
+        check_journal_damage()
 
     # Sidebar for navigation
     st.sidebar.markdown(f'<h1 style="text-align: center; color: #a442f5; font-size: 2rem;">AHSAN MOBILE SHOP</h1>', unsafe_allow_html=True)
     st.sidebar.markdown("---")
     
     # Display username and logout button
-    st.sidebar.markdown(f'<p style="text-align: center; color: #8c8c8c;">Logged in as: <strong>{st.session_state.username}</strong></p>', unsafe_allow_html=True)
+    st.sidebar.markdown(f'<p style="text-align: center; color: #8c8c8c;">Logged in as: <strong>{st.session_state.username}</strong> ({st.session_state.role})</p>', unsafe_allow_html=True)
+    is_owner = st.session_state.role == 'owner'
+    if not is_owner and st.session_state.page in OWNER_PAGES:
+        st.session_state.page = "Dashboard"
     
     # Navigation buttons
     if st.sidebar.button("📊 Dashboard"):
@@ -2356,9 +5829,17 @@ def main():
         st.session_state.page = "Customer Balances"
     if st.sidebar.button("🗃️ View & Download Data"):
         st.session_state.page = "Data View"
+    if st.sidebar.button("📦 Inventory"):
+        st.session_state.page = "Inventory"
+    if is_owner and st.sidebar.button("📥 Bulk Import"):
+        st.session_state.page = "Bulk Import"
+    if is_owner and st.sidebar.button("👥 Manage Users"):
+        st.session_state.page = "Manage Users"
+    if is_owner and st.sidebar.button("🗄️ Backups"):
+        st.session_state.page = "Backups"
     
     st.sidebar.markdown("---")
-    st.sidebar.button("🔄 Reload Data", on_click=load_data, use_container_width=True)
+    st.sidebar.button("🔄 Reload Data", on_click=reload_data, use_container_width=True)
     
     # Logout button
     logout_button()
@@ -2387,26 +5868,57 @@ def main():
         customer_balance_page()
     elif st.session_state.page == "Data View":
         data_view_page()
-        
-    st.markdown("---")
-    
-    # Display the receipt if a transaction was just submitted
-    if st.session_state.get('last_transaction'):
-        st.subheader("Transaction Receipt")
-        receipt_data = st.session_state.last_transaction
-        st.markdown(generate_receipt(receipt_data), unsafe_allow_html=True)
-        
-        pdf_data = create_receipt_pdf(receipt_data)
-        st.download_button(
-            label="📄 Download PDF Receipt",
-            data=pdf_data,
-            file_name=f"receipt_{receipt_data['Transaction_ID']}.pdf",
-            mime="application/pdf",
-            use_container_width=True
-        )
+    elif st.session_state.page == "Inventory":
+        inventory_page()
+    elif st.session_state.page == "Bulk Import":
+        bulk_import_page()
+    elif st.session_state.page == "Manage Users":
+        manage_users_page()
+    elif st.session_state.page == "Backups":
+        backups_page()
+    
+    # Sale pages show the receipt inside their fragment (see page_fragment)
+    if st.session_state.page not in SALE_PAGES:
+        transaction_receipt()
         
     st.markdown('<div class="footer">Developed by DV>Z | A Project by AHSAN MOBILE SHOP AND EASYPAISA CENTER LORALAI</div>', unsafe_allow_html=True)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate-sqlite':
+        # python ssssssssssssssssss.py migrate-sqlite
+        migrate_to_sqlite()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'backup':
+        # python ssssssssssssssssss.py backup
+        name = create_backup()
+        prune_backups()
+        print(f"Created {name} ({read_backup_manifest(name)['stored_bytes']:,} new bytes stored)")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'customers':
+        # python ssssssssssssssssss.py customers [output CSV, default: customers.csv]
+        output = sys.argv[2] if len(sys.argv) > 2 else 'customers.csv'
+        customers = customer_master()
+        customers.to_csv(output, index=False)
+        print(f"Wrote {len(customers):,} customers to {output}")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'print':
+        # python ssssssssssssssssss.py print TXN-00001 [printer, default: MOBILE_SHOP_PRINTER]
+        transactions = get_data()[0]['transactions']
+        match = transactions[transactions['Transaction_ID'] == sys.argv[2]] if len(sys.argv) > 2 else transactions.iloc[0:0]
+        target = sys.argv[3] if len(sys.argv) > 3 else PRINTER_TARGET
+        if match.empty or not target:
+            print("Usage: print TXN-##### [printer]; needs an existing transaction and a printer")
+        else:
+            job_id = queue_print('receipt', match.iloc[-1].to_dict(), target)
+            wait_for_prints()
+            job = print_job_status(job_id)
+            print(f"{job['name']}: {job['status']}" + (f" ({job['error']})" if job['error'] else ''))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'restore':
+        # python ssssssssssssssssss.py restore [backup name, default: the latest]
+        names = backup_names()
+        name = sys.argv[2] if len(sys.argv) > 2 else (names[-1] if names else None)
+        if name not in names:
+            print(f"No backup {name}. Available: {', '.join(names) or 'none'}")
+        else:
+            restore_backup(name)
+            print(f"Restored {name}; the data it replaced was backed up first.")
+    else:
+        main()
\ No newline at end of file